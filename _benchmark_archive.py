@@ -0,0 +1,151 @@
+import argparse
+import io
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from build_tools import archive
+
+"""
+Compares previous per-member cmake unpacking (getnames()/getmembers() followed by
+extract() of every member and startswith() exclusion scan) against single pass
+build_tools.archive engine.
+
+Without arguments synthetic archive with layout of cmake-4.2.0-linux-x86_64.tar.gz
+is generated (same directories, roughly the same file counts and sizes).
+Pass real archive with --archive to measure on it.
+"""
+
+ROOT_FOLDER_NAME = "cmake-4.2.0-linux-x86_64"
+
+EXCLUDED_DIRS = [
+    'doc', 'man', 'share/aclocal', 'share/bash-completion', 'share/cmake-4.2/Help',
+    'share/cmake-4.2/Licenses', 'share/emacs', 'share/vim', 'share/icons', 'share/mime',
+]
+EXCLUDED_FILES = ['bin/cmake-gui', 'bin/cmcldeps', 'bin/cpack', 'bin/ctest']
+
+# (directory, number of files, average file size)
+SYNTHETIC_LAYOUT: list[tuple[str, int, int]] = [
+    ('bin', 5, 12 * 1024 * 1024),
+    ('doc/cmake-4.2/html/command', 450, 12 * 1024),
+    ('doc/cmake-4.2/html/module', 450, 10 * 1024),
+    ('doc/cmake-4.2/html/prop_tgt', 650, 6 * 1024),
+    ('doc/cmake-4.2/html/variable', 1100, 5 * 1024),
+    ('man/man7', 20, 60 * 1024),
+    ('share/aclocal', 1, 4 * 1024),
+    ('share/bash-completion/completions', 4, 8 * 1024),
+    ('share/cmake-4.2/Help/command', 450, 6 * 1024),
+    ('share/cmake-4.2/Help/variable', 1100, 2 * 1024),
+    ('share/cmake-4.2/Licenses', 10, 2 * 1024),
+    ('share/cmake-4.2/Modules', 600, 20 * 1024),
+    ('share/cmake-4.2/Modules/Platform', 450, 3 * 1024),
+    ('share/cmake-4.2/Modules/Compiler', 300, 2 * 1024),
+    ('share/cmake-4.2/Templates', 40, 4 * 1024),
+    ('share/emacs/site-lisp', 1, 20 * 1024),
+    ('share/vim/vimfiles/syntax', 2, 100 * 1024),
+]
+
+def _synthetic_files() -> list[tuple[str, bytes]]:
+    generator = random.Random(42)
+    files: list[tuple[str, bytes]] = []
+    for directory, count, size in SYNTHETIC_LAYOUT:
+        for index in range(count):
+            name = ['ccmake', 'cmake', 'cmake-gui', 'cpack', 'ctest'][index] if directory == 'bin' else f'file{index}.txt'
+            # Half random, half repeated text, so it compresses like real content
+            data = generator.randbytes(size // 2) + b'cmake ' * (size // 12)
+            files.append((f'{ROOT_FOLDER_NAME}/{directory}/{name}', data))
+    return files
+
+def _write_synthetic_tar(path: str):
+    with tarfile.open(path, 'w:gz') as tar_file:
+        for name, data in _synthetic_files():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o755
+            tar_file.addfile(info, io.BytesIO(data))
+
+def _write_synthetic_zip(path: str):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in _synthetic_files():
+            zip_file.writestr(name, data)
+
+def _legacy_is_excluded(filename: str) -> bool:
+    for excluded_dir in EXCLUDED_DIRS:
+        if filename.startswith(f'{ROOT_FOLDER_NAME}/{excluded_dir}'):
+            return True
+    for excluded_file in EXCLUDED_FILES:
+        if filename == f'{ROOT_FOLDER_NAME}/{excluded_file}':
+            return True
+    return False
+
+def _legacy_tar(archive_path: str, output_dir: str):
+    with tarfile.open(archive_path, 'r:gz') as tar_file:
+        for file_path, file_member in zip(tar_file.getnames(), tar_file.getmembers()):
+            if _legacy_is_excluded(file_path) or file_member.isdir():
+                continue
+            output_path = f'{output_dir}/{file_path[len(ROOT_FOLDER_NAME) + 1:]}'
+            output_path = os.path.dirname(output_path)
+            file_member.name = f'{output_path}/{os.path.basename(file_path)}'
+            tar_file.extract(file_member, output_path)
+
+def _legacy_zip(archive_path: str, output_dir: str):
+    with zipfile.ZipFile(archive_path, 'r') as zip_file:
+        for file in zip_file.filelist:
+            if _legacy_is_excluded(file.filename) or file.is_dir():
+                continue
+            output_path = f'{output_dir}/{file.filename[len(ROOT_FOLDER_NAME) + 1:]}'
+            output_path = os.path.dirname(output_path)
+            file.filename = os.path.basename(file.filename)
+            zip_file.extract(file, output_path)
+
+def _engine_tar(archive_path: str, output_dir: str):
+    with open(archive_path, 'rb') as stream:
+        archive.extract_tar_stream(stream, output_dir, archive.PathFilter(ROOT_FOLDER_NAME, EXCLUDED_DIRS, EXCLUDED_FILES))
+
+def _engine_zip(archive_path: str, output_dir: str):
+    with zipfile.ZipFile(archive_path, 'r') as zip_file:
+        archive.extract_zip(zip_file, output_dir, archive.PathFilter(ROOT_FOLDER_NAME, EXCLUDED_DIRS, EXCLUDED_FILES))
+
+def _measure(name: str, function, archive_path: str, work_dir: str, repeats: int):
+    timings: list[float] = []
+    for repeat in range(repeats):
+        output_dir = f'{work_dir}/{name}-{repeat}'
+        start = time.perf_counter()
+        function(archive_path, output_dir)
+        timings.append(time.perf_counter() - start)
+        shutil.rmtree(output_dir)
+    print(f"{name:<12} best: {min(timings):.3f}s | mean: {sum(timings) / len(timings):.3f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="build_tools archive extraction benchmark")
+    parser.add_argument('-a', '--archive', default=None, help="Real cmake archive (.tar.gz or .zip). Synthetic one is generated if not set")
+    parser.add_argument('-r', '--repeats', default=3, type=int, help="Number of runs of each variant")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        archive_path = args.archive
+        if archive_path is None:
+            archive_path = f'{work_dir}/{ROOT_FOLDER_NAME}.tar.gz'
+            print(f"Generating synthetic archive {archive_path}...")
+            _write_synthetic_tar(archive_path)
+            _measure("legacy-tar", _legacy_tar, archive_path, work_dir, args.repeats)
+            _measure("engine-tar", _engine_tar, archive_path, work_dir, args.repeats)
+
+            archive_path = f'{work_dir}/{ROOT_FOLDER_NAME}.zip'
+            print(f"Generating synthetic archive {archive_path}...")
+            _write_synthetic_zip(archive_path)
+            _measure("legacy-zip", _legacy_zip, archive_path, work_dir, args.repeats)
+            _measure("engine-zip", _engine_zip, archive_path, work_dir, args.repeats)
+        elif archive_path.endswith('.zip'):
+            _measure("legacy-zip", _legacy_zip, archive_path, work_dir, args.repeats)
+            _measure("engine-zip", _engine_zip, archive_path, work_dir, args.repeats)
+        else:
+            _measure("legacy-tar", _legacy_tar, archive_path, work_dir, args.repeats)
+            _measure("engine-tar", _engine_tar, archive_path, work_dir, args.repeats)
+
+if __name__ == "__main__":
+    main()
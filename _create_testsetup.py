@@ -67,15 +67,10 @@ def main():
     # Setup
     _run(["python3", "setup.py", "-g", "-o"])
 
-    # Build debug
-    _run(["python3", "build.py", "-d", "-m", "debug"])
-    _run(["python3", "build.py", "-c", "-m", "debug"])
-    _run(["python3", "build.py", "-r", "-m", "debug"])
-
-    # Build release
-    _run(["python3", "build.py", "-d", "-m", "release"])
-    _run(["python3", "build.py", "-c", "-m", "release"])
-    _run(["python3", "build.py", "-r", "-m", "release"])
+    # Build debug and release at once
+    _run(["python3", "build.py", "-d", "-m", "debug,release"])
+    _run(["python3", "build.py", "-c", "-m", "debug,release"])
+    _run(["python3", "build.py", "-r", "-m", "debug,release"])
 
     # Addons
     _run(["python3", "build.py", "--clion"])
@@ -5,4 +5,12 @@ from . import ninja
 from . import clion
 from . import commons
 from . import vcvarsall
+from . import toolset
+from . import trace
+from . import build_report
+from . import includes
+from . import pch
+from . import unity
+from . import resources
+from . import jobserver
 from .config import BuildToolsConfig
\ No newline at end of file
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+"""
+Compiler launcher caching object files, used when neither ccache nor sccache is available.
+Runs as standalone script, started by build system for every compilation:
+
+    python _compiler_cache_launcher.py CACHE_DIR COMPILER ARGS...
+
+Cache key is sha256 of compiler identity (path, size, mtime), working directory,
+all arguments and preprocessed source (output of 'COMPILER ARGS -E'). Entry keeps
+object file, depfile, stdout and stderr of compilation, hit restores all of them.
+Only plain gcc/clang style single source compilations (-c with -o) are cached,
+everything else is passed through to compiler untouched. Any failure of caching
+itself falls back to plain compilation, so launcher never breaks a build.
+
+Miss compiles the original source, so preprocessor runs twice for it (like
+ccache with run_second_cpp). Compiling preprocessed output would save that,
+but diagnostics lose macro expansion context and some warnings change
+(clang and gcc warn differently about code coming from macros), depfile would
+have to come from preprocessing step and stored stderr would differ from what
+plain build prints. Misses are paid once per change, hits run preprocessor once.
+
+Every invocation appends one letter to CACHE_DIR/stats:
+h - hit, m - miss, u - uncacheable, e - caching error.
+"""
+
+LAUNCHER_VERSION = '1'
+STATS_FILE_NAME = 'stats'
+ENTRIES_DIR_NAME = 'entries'
+STAT_HIT = b'h'
+STAT_MISS = b'm'
+STAT_UNCACHEABLE = b'u'
+STAT_ERROR = b'e'
+
+_SOURCE_EXTENSIONS = ['.c', '.cc', '.cpp', '.cxx', '.c++', '.C', '.m', '.mm']
+# Options taking separate value argument, their values are never sources
+_OPTIONS_WITH_VALUE = [
+    '-o', '-MF', '-MT', '-MQ', '-I', '-isystem', '-iquote', '-idirafter', '-include', '-imacros',
+    '-D', '-U', '-x', '-arch', '-target', '--target', '-Xclang', '-Xpreprocessor', '-Xlinker',
+    '-isysroot', '--sysroot', '-iprefix', '-iwithprefix',
+]
+_DEPFILE_OPTIONS_WITH_VALUE = ['-MF', '-MT', '-MQ']
+_DEPFILE_FLAGS = ['-MD', '-MMD', '-MP']
+# Outputs next to object or whole compiler behaviour that cache cannot reproduce
+_UNCACHEABLE_PREFIXES = ['--coverage', '-fprofile-', '-ftest-coverage', '-save-temps', '-fdump-', '-gsplit-dwarf', '-M', '-E', '-S']
+
+class _Compilation:
+    def __init__(self, compiler: str, args: list[str]):
+        self.compiler = compiler
+        self.args = args
+        self.object_path: str | None = None
+        self.depfile_path: str | None = None
+        self.source_path: str | None = None
+        self.preprocess_args: list[str] = []
+
+def _append_stat(cache_dir: str, stat: bytes):
+    # O_APPEND writes of one byte never interleave, no locking needed
+    file_descriptor = os.open(os.path.join(cache_dir, STATS_FILE_NAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(file_descriptor, stat)
+    finally:
+        os.close(file_descriptor)
+
+def _parse(compiler: str, args: list[str]) -> _Compilation | None:
+    # Returns None when compilation cannot be cached
+    compilation = _Compilation(compiler, args)
+    if '-c' not in args or os.path.basename(compiler).lower() in ['cl.exe', 'cl', 'clang-cl', 'clang-cl.exe']:
+        return None
+    sources: list[str] = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg.startswith('@') or arg == '-':
+            return None
+        if arg in _OPTIONS_WITH_VALUE:
+            if index + 1 >= len(args):
+                return None
+            value = args[index + 1]
+            if arg == '-x' and value.endswith('-header'):
+                # Precompiled header, compiler validates it by its own rules
+                return None
+            if arg == '-o':
+                compilation.object_path = value
+            elif arg == '-MF':
+                compilation.depfile_path = value
+            if arg != '-o' and arg not in _DEPFILE_OPTIONS_WITH_VALUE:
+                compilation.preprocess_args += [arg, value]
+            index += 2
+            continue
+        if arg.startswith('-o') and len(arg) > 2:
+            compilation.object_path = arg[2:]
+        elif arg.startswith('-MF') and len(arg) > 3:
+            compilation.depfile_path = arg[3:]
+        elif arg.startswith('-MT') or arg.startswith('-MQ') or arg in _DEPFILE_FLAGS or arg == '-c':
+            pass
+        elif any(arg.startswith(prefix) for prefix in _UNCACHEABLE_PREFIXES):
+            return None
+        else:
+            if not arg.startswith('-') and os.path.splitext(arg)[1] in _SOURCE_EXTENSIONS:
+                sources.append(arg)
+            compilation.preprocess_args.append(arg)
+        index += 1
+
+    if len(sources) != 1 or compilation.object_path is None:
+        return None
+    compilation.source_path = sources[0]
+    return compilation
+
+def _compute_key(compilation: _Compilation) -> str | None:
+    compiler_path = shutil.which(compilation.compiler) or compilation.compiler
+    compiler_stat = os.stat(compiler_path)
+    preprocess = _run([compilation.compiler] + compilation.preprocess_args + ['-E'], keep_stderr=False)
+    if preprocess.returncode != 0:
+        # Real compilation reports the error
+        return None
+    key = hashlib.sha256()
+    for part in [LAUNCHER_VERSION, os.path.realpath(compiler_path), str(compiler_stat.st_size), str(compiler_stat.st_mtime_ns), os.getcwd()]:
+        key.update(part.encode('UTF-8') + b'\0')
+    for arg in compilation.args:
+        key.update(arg.encode('UTF-8') + b'\0')
+    key.update(preprocess.stdout)
+    return key.hexdigest()
+
+def _run(args: list[str], keep_stderr: bool = True) -> subprocess.CompletedProcess:
+    # Children of cached compilation follow rules of process.py runner: stdin closed, output captured and killed
+    # with the launcher when it is interrupted. Runner itself is not imported, this script starts for every
+    # compilation and importing build_tools takes longer than a cache hit
+    return subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE if keep_stderr else subprocess.DEVNULL)
+
+def _get_entry_dir(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, ENTRIES_DIR_NAME, key[:2], key)
+
+def _copy_atomically(source_path: str, target_path: str):
+    target_dir = os.path.dirname(os.path.abspath(target_path))
+    os.makedirs(target_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=target_dir, delete=False) as temp_file:
+        with open(source_path, 'rb') as source:
+            shutil.copyfileobj(source, temp_file)
+    os.replace(temp_file.name, target_path)
+
+def _restore(entry_dir: str, compilation: _Compilation) -> bool:
+    object_entry = os.path.join(entry_dir, 'object')
+    if not os.path.exists(object_entry):
+        return False
+    depfile_entry = os.path.join(entry_dir, 'depfile')
+    if compilation.depfile_path is not None and not os.path.exists(depfile_entry):
+        return False
+    assert(compilation.object_path is not None)
+    _copy_atomically(object_entry, compilation.object_path)
+    if compilation.depfile_path is not None:
+        _copy_atomically(depfile_entry, compilation.depfile_path)
+    for name, stream in [('stdout', sys.stdout.buffer), ('stderr', sys.stderr.buffer)]:
+        with open(os.path.join(entry_dir, name), 'rb') as file:
+            stream.write(file.read())
+        stream.flush()
+    # Entry mtime is what size cap eviction looks at
+    os.utime(entry_dir)
+    return True
+
+def _store(cache_dir: str, entry_dir: str, compilation: _Compilation, stdout: bytes, stderr: bytes):
+    assert(compilation.object_path is not None)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    try:
+        shutil.copyfile(compilation.object_path, os.path.join(staging_dir, 'object'))
+        if compilation.depfile_path is not None:
+            shutil.copyfile(compilation.depfile_path, os.path.join(staging_dir, 'depfile'))
+        with open(os.path.join(staging_dir, 'stdout'), 'wb') as file:
+            file.write(stdout)
+        with open(os.path.join(staging_dir, 'stderr'), 'wb') as file:
+            file.write(stderr)
+        os.replace(staging_dir, entry_dir)
+    except OSError:
+        # Other compilation of the same source stored it first
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+def _pass_through(compiler: str, args: list[str]) -> int:
+    return subprocess.run([compiler] + args).returncode
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 3:
+        sys.stderr.write("usage: _compiler_cache_launcher.py CACHE_DIR COMPILER ARGS...\n")
+        return 2
+    cache_dir, compiler, args = argv[1], argv[2], argv[3:]
+    os.makedirs(cache_dir, exist_ok=True)
+
+    compilation = _parse(compiler, args)
+    if compilation is None:
+        _append_stat(cache_dir, STAT_UNCACHEABLE)
+        return _pass_through(compiler, args)
+
+    try:
+        key = _compute_key(compilation)
+        if key is None:
+            _append_stat(cache_dir, STAT_UNCACHEABLE)
+            return _pass_through(compiler, args)
+        entry_dir = _get_entry_dir(cache_dir, key)
+        if _restore(entry_dir, compilation):
+            _append_stat(cache_dir, STAT_HIT)
+            return 0
+    except OSError:
+        _append_stat(cache_dir, STAT_ERROR)
+        return _pass_through(compiler, args)
+
+    # Original source, not preprocessed output of the key, see module docstring
+    compile_process = _run([compiler] + args)
+    sys.stdout.buffer.write(compile_process.stdout)
+    sys.stdout.buffer.flush()
+    sys.stderr.buffer.write(compile_process.stderr)
+    sys.stderr.buffer.flush()
+    if compile_process.returncode != 0:
+        return compile_process.returncode
+    try:
+        _store(cache_dir, entry_dir, compilation, compile_process.stdout, compile_process.stderr)
+        _append_stat(cache_dir, STAT_MISS)
+    except OSError:
+        _append_stat(cache_dir, STAT_ERROR)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,321 @@
+import concurrent.futures
+import contextlib
+import heapq
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import time
+import typing
+import zipfile
+import zlib
+
+from . import cache
+from . import commons
+from . import download
+from . import log
+from . import trace
+
+"""
+Download-and-extract of tool archives without storing archive in workspace.
+tar.gz is unpacked while it arrives, in tarfile stream mode. Zip needs random
+access to its central directory, so it is spooled into bounded temporary buffer
+(memory first, temporary file when it gets bigger) and unpacked from there.
+
+Downloads go through machine-wide cache (see cache.py). On cache hit archive
+is read from there, on miss it is written to cache while it is unpacked.
+
+Extraction makes one sequential pass over archive members. Every member goes
+through 'path_mapper' (usually PathFilter), which returns path relative to
+output directory or None if member has to be skipped.
+"""
+
+PathMapper = typing.Callable[[str], str | None]
+
+_ZIP_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+_COPY_BUFFER_SIZE = 1024 * 1024
+_ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_ZIP_LOCAL_HEADER_SIZE = 30
+# Fixed per-file cost (create, open, close) in bytes of data, used to balance workers
+_ZIP_MEMBER_COST = 16 * 1024
+
+# Trie node markers. '/' never appears in path component, so they cannot clash with names
+_EXCLUDED_DIR_MARK = '/dir'
+_EXCLUDED_FILE_MARK = '/file'
+
+def _error_log_and_die(msg: str) -> typing.NoReturn:
+    log.error(msg)
+    exit(-1)
+
+class PathFilter:
+    """
+    Path mapper stripping archive root folder and skipping excluded directories
+    and files. Exclusions are relative to root folder and kept in prefix trie of
+    path components, so every member costs one dict lookup per path component
+    no matter how long exclusion lists are.
+    """
+
+    def __init__(
+        self,
+        root_folder_name: str | None = None,
+        excluded_dirs: list[str] | None = None,
+        excluded_files: list[str] | None = None
+    ):
+        self._root_prefix = '' if root_folder_name is None else f'{root_folder_name}/'
+        self._trie: dict = {}
+        for excluded_dir in ([] if excluded_dirs is None else excluded_dirs):
+            self._insert(excluded_dir)[_EXCLUDED_DIR_MARK] = True
+        for excluded_file in ([] if excluded_files is None else excluded_files):
+            self._insert(excluded_file)[_EXCLUDED_FILE_MARK] = True
+
+    def _insert(self, path: str) -> dict:
+        node = self._trie
+        for part in path.strip('/').split('/'):
+            node = node.setdefault(part, {})
+        return node
+
+    def __call__(self, member_path: str) -> str | None:
+        if not member_path.startswith(self._root_prefix):
+            return None
+        relative_path = member_path[len(self._root_prefix):]
+        node = self._trie
+        for part in relative_path.split('/'):
+            node = node.get(part)
+            if node is None:
+                return relative_path
+            if _EXCLUDED_DIR_MARK in node:
+                return None
+        return None if _EXCLUDED_FILE_MARK in node else relative_path
+
+class _DirectoryCreator:
+    # Archives list thousands of files in the same few directories, makedirs is called once per directory
+    def __init__(self):
+        self._created: set[str] = set()
+
+    def ensure_parent(self, file_path: str):
+        parent = os.path.dirname(file_path)
+        if parent not in self._created:
+            os.makedirs(parent, exist_ok=True)
+            self._created.add(parent)
+
+def _get_copy_buffer_size(file_size: int) -> int:
+    # Whole file in one read when it fits, no point in allocating full buffer for tiny ones
+    return max(min(file_size, _COPY_BUFFER_SIZE), 1)
+
+def _keep_path(member_path: str) -> str | None:
+    return member_path
+
+def _get_output_path(output_dir: str, output_name: str) -> str:
+    # Archives come from network, member must not be absolute nor leave output directory ('..')
+    normalized_name = os.path.normpath(output_name.replace('\\', '/')).replace('\\', '/')
+    if os.path.isabs(normalized_name) or normalized_name.startswith('/') or os.path.splitdrive(normalized_name)[0] != '' \
+            or normalized_name == '..' or normalized_name.startswith('../'):
+        _error_log_and_die(f"archive: member '{output_name}' points outside of '{output_dir}'")
+    return f'{output_dir}/{normalized_name}'
+
+def _check_tar_link(output_dir: str, member: tarfile.TarInfo):
+    # Same rules as data filter of tarfile: no device files, links stay inside output directory
+    if member.issym():
+        # Relative to directory of the link, absolute target is rejected as it is
+        _get_output_path(output_dir, os.path.join(os.path.dirname(member.name), member.linkname))
+    elif member.islnk():
+        _get_output_path(output_dir, member.linkname)
+    elif not member.isreg() and not member.isdir():
+        _error_log_and_die(f"archive: special member '{member.name}' is not allowed")
+
+def extract_tar_stream(stream: typing.BinaryIO, output_dir: str, path_mapper: PathMapper | None = None) -> int:
+    # Single sequential pass over tar.gz stream. Returns number of extracted files
+    path_mapper = _keep_path if path_mapper is None else path_mapper
+    directories = _DirectoryCreator()
+    extracted_count = 0
+    with tarfile.open(fileobj=stream, mode='r|gz') as tar_file:
+        for member in tar_file:
+            if member.isdir():
+                continue
+            output_name = path_mapper(member.name)
+            if output_name is None or len(output_name) == 0:
+                continue
+            output_path = _get_output_path(output_dir, output_name)
+            directories.ensure_parent(output_path)
+            if member.isreg():
+                source = tar_file.extractfile(member)
+                assert(source is not None)
+                with open(output_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, _get_copy_buffer_size(member.size))
+                if not commons.is_windows():
+                    os.chmod(output_path, member.mode & 0o777)
+                extracted_count += 1
+                continue
+            # Links and other special members are rare, tarfile handles them
+            if member.islnk():
+                link_target = path_mapper(member.linkname)
+                if link_target is None:
+                    log.warn(f"Skipping hardlink '{member.name}' pointing to excluded '{member.linkname}'")
+                    continue
+                member.linkname = link_target
+            member.name = output_name
+            if hasattr(tarfile, 'data_filter'):
+                # Data filter rejects links pointing outside of output directory
+                tar_file.extract(member, output_dir, filter='data')
+            else:
+                # Python without extraction filters (before 3.10.12), links are checked here
+                _check_tar_link(output_dir, member)
+                tar_file.extract(member, output_dir)
+            extracted_count += 1
+    return extracted_count
+
+def _write_unix_mode(output_path: str, member: zipfile.ZipInfo):
+    # Unix permissions live in upper bits of external_attr, zipfile doesn't restore them
+    unix_mode = (member.external_attr >> 16) & 0o777
+    if unix_mode != 0 and not commons.is_windows():
+        os.chmod(output_path, unix_mode)
+
+def extract_zip(zip_file: zipfile.ZipFile, output_dir: str, path_mapper: PathMapper | None = None) -> int:
+    # Single sequential pass over zip members. Returns number of extracted files
+    path_mapper = _keep_path if path_mapper is None else path_mapper
+    directories = _DirectoryCreator()
+    extracted_count = 0
+    for member in zip_file.infolist():
+        if member.is_dir():
+            continue
+        output_name = path_mapper(member.filename)
+        if output_name is None or len(output_name) == 0:
+            continue
+        output_path = _get_output_path(output_dir, output_name)
+        directories.ensure_parent(output_path)
+        with zip_file.open(member, 'r') as source, open(output_path, 'wb') as target:
+            shutil.copyfileobj(source, target, _get_copy_buffer_size(member.file_size))
+        _write_unix_mode(output_path, member)
+        extracted_count += 1
+    return extracted_count
+
+def _extract_raw_zip_member(archive_file: typing.BinaryIO, member: zipfile.ZipInfo, output_path: str):
+    # Reads member straight from its local header. Central directory is parsed once
+    # by caller, workers only need plain file handle of their own
+    archive_file.seek(member.header_offset)
+    local_header = archive_file.read(_ZIP_LOCAL_HEADER_SIZE)
+    if local_header[0:4] != _ZIP_LOCAL_HEADER_SIGNATURE:
+        _error_log_and_die(f"archive: bad local header of zip member '{member.filename}'")
+    name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    archive_file.seek(name_length + extra_length, os.SEEK_CUR)
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if member.compress_type == zipfile.ZIP_DEFLATED else None
+    remaining = member.compress_size
+    crc = 0
+    with open(output_path, 'wb') as target:
+        while remaining > 0:
+            chunk = archive_file.read(min(remaining, _COPY_BUFFER_SIZE))
+            if len(chunk) == 0:
+                _error_log_and_die(f"archive: zip member '{member.filename}' is truncated")
+            remaining -= len(chunk)
+            data = chunk if decompressor is None else decompressor.decompress(chunk)
+            crc = zlib.crc32(data, crc)
+            target.write(data)
+        if decompressor is not None:
+            data = decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            target.write(data)
+    if crc != member.CRC:
+        _error_log_and_die(f"archive: CRC mismatch of zip member '{member.filename}'")
+    _write_unix_mode(output_path, member)
+
+def extract_zip_parallel(zip_path: str, output_dir: str, path_mapper: PathMapper | None = None, workers: int | None = None) -> int:
+    # Members are split between workers, each reading archive through its own file handle.
+    # Returns number of extracted files
+    path_mapper = _keep_path if path_mapper is None else path_mapper
+    workers = min(32, os.cpu_count() or 1) if workers is None else max(workers, 1)
+
+    jobs: list[tuple[zipfile.ZipInfo, str]] = []
+    with zipfile.ZipFile(zip_path, 'r') as zip_file:
+        for member in zip_file.infolist():
+            if member.is_dir():
+                continue
+            if member.compress_type not in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED] or member.flag_bits & 0x1:
+                log.info(f"Zip '{zip_path}' uses compression or encryption unsupported by parallel extraction. Extracting sequentially.")
+                return extract_zip(zip_file, output_dir, path_mapper)
+            output_name = path_mapper(member.filename)
+            if output_name is None or len(output_name) == 0:
+                continue
+            jobs.append((member, _get_output_path(output_dir, output_name)))
+
+    # All directories at once, so workers never race on makedirs
+    for directory in sorted({os.path.dirname(output_path) for _, output_path in jobs}):
+        os.makedirs(directory, exist_ok=True)
+
+    # Biggest members first, each to the least loaded worker. Every worker then
+    # goes through its members in archive order to keep reads mostly sequential
+    worker_loads = [(0, index) for index in range(workers)]
+    worker_jobs: list[list[tuple[zipfile.ZipInfo, str]]] = [[] for _ in range(workers)]
+    for job in sorted(jobs, key=lambda job: job[0].compress_size, reverse=True):
+        load, index = heapq.heappop(worker_loads)
+        worker_jobs[index].append(job)
+        heapq.heappush(worker_loads, (load + job[0].compress_size + _ZIP_MEMBER_COST, index))
+
+    def _worker(jobs: list[tuple[zipfile.ZipInfo, str]]):
+        jobs.sort(key=lambda job: job[0].header_offset)
+        with open(zip_path, 'rb') as archive_file:
+            for member, output_path in jobs:
+                _extract_raw_zip_member(archive_file, member, output_path)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="unzip") as executor:
+        for future in [executor.submit(_worker, jobs) for jobs in worker_jobs if len(jobs) > 0]:
+            future.result()
+    return len(jobs)
+
+def _log_unpack_speed(output_dir: str, files_count: int, start_time: float):
+    end_time = time.perf_counter()
+    elapsed = end_time - start_time
+    files_per_second = files_count / elapsed if elapsed > 0 else 0.0
+    log.info(f"Unpacked {files_count} files into '{output_dir}' in {elapsed:.2f}s ({files_per_second:.0f} files/s)")
+    trace.add_span("unpack", 'archive', start_time, end_time, {'output_dir': output_dir, 'files': files_count})
+
+def stream_extract(
+    url: str,
+    output_dir: str,
+    archive_ext: str,
+    path_mapper: PathMapper | None = None,
+    parallel: bool = False
+):
+    # 'parallel' unpacks zip with extract_zip_parallel(), it pays off for archives with many small files
+    os.makedirs(output_dir, exist_ok=True)
+    if archive_ext in ["tar.gz", "tgz"]:
+        with cache.open_url(url) as stream:
+            start_time = time.perf_counter()
+            files_count = extract_tar_stream(stream, output_dir, path_mapper)
+        _log_unpack_speed(output_dir, files_count, start_time)
+    elif archive_ext == "zip":
+        if cache.is_enabled() or parallel:
+            # Cached file is already on disk, there is nothing to spool
+            with local_copy(url) as zip_path:
+                extract_zip_file(zip_path, output_dir, path_mapper, parallel)
+            return
+        with download.open_url(url) as response, tempfile.SpooledTemporaryFile(max_size=_ZIP_SPOOL_MAX_SIZE) as spool:
+            shutil.copyfileobj(response, spool, _COPY_BUFFER_SIZE)
+            spool.seek(0)
+            start_time = time.perf_counter()
+            with zipfile.ZipFile(spool, 'r') as zip_file:
+                files_count = extract_zip(zip_file, output_dir, path_mapper)
+            _log_unpack_speed(output_dir, files_count, start_time)
+    else:
+        _error_log_and_die(f"archive.stream_extract(): unsupported archive type '{archive_ext}'")
+
+@contextlib.contextmanager
+def local_copy(url: str) -> typing.Iterator[str]:
+    # Path to url content on disk: cached file, or temporary one when cache is disabled
+    if cache.is_enabled():
+        yield cache.fetch(url)
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = f'{temp_dir}/{os.path.basename(url)}'
+        download.download_file(url, file_path)
+        yield file_path
+
+def extract_zip_file(zip_path: str, output_dir: str, path_mapper: PathMapper | None = None, parallel: bool = False):
+    start_time = time.perf_counter()
+    if parallel:
+        files_count = extract_zip_parallel(zip_path, output_dir, path_mapper)
+    else:
+        with zipfile.ZipFile(zip_path, 'r') as zip_file:
+            files_count = extract_zip(zip_file, output_dir, path_mapper)
+    _log_unpack_speed(output_dir, files_count, start_time)
@@ -0,0 +1,248 @@
+import dataclasses
+import os
+import re
+
+from . import cmake
+from . import commons
+from . import config
+from . import log
+from . import trace
+
+"""
+Build report from .ninja_log of the last build.
+
+.ninja_log keeps start and end time (ms since start of the build) of every
+edge output. It is appended by every build and restat entries repeat outputs,
+so only the last entry of each output is kept and only entries of the last
+build are reported (new build starts where end time goes back). Outputs with
+the same start, end and command hash come from the same edge.
+
+Dependencies and rule names come from 'ninja -t graph'. They give compile and
+link classification and critical path: the longest chain of dependent edges,
+which is lower bound of build time no matter how many cores are available.
+Effective parallelism is number of edges running at once, over time.
+"""
+
+_TIMELINE_BUCKETS = 20
+_TIMELINE_BAR_MAX_WIDTH = 60
+_COMPILE_EXTENSIONS = ['.o', '.obj']
+_LINK_EXTENSIONS = ['', '.exe', '.dll', '.so', '.a', '.lib', '.dylib']
+
+_GRAPH_NODE_PATTERN = re.compile(r'^"(?P<id>[^"]+)" \[label="(?P<label>.*)"(?P<ellipse>, shape=ellipse)?\]$')
+_GRAPH_ARC_PATTERN = re.compile(r'^"(?P<source>[^"]+)" -> "(?P<target>[^"]+)"(?: \[(?P<attributes>.*)\])?$')
+_GRAPH_ARC_LABEL_PATTERN = re.compile(r'label=" (?P<rule>[^"]*)"')
+
+@dataclasses.dataclass
+class LogEdge:
+    outputs: list[str]
+    start: int
+    end: int
+    command_hash: str
+    kind: str = 'other'
+    rule: str | None = None
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+@dataclasses.dataclass
+class BuildGraph:
+    # Every output mapped to rule and inputs (including implicit and order-only) of edge producing it
+    rules: dict[str, str]
+    inputs: dict[str, list[str]]
+
+def parse_ninja_log(log_path: str) -> list[LogEdge]:
+    with open(log_path, "r", encoding="UTF-8", errors="replace") as file:
+        lines = file.read().splitlines()
+    if len(lines) == 0 or not lines[0].startswith('# ninja log v'):
+        log.warn(f"'{log_path}' is not a ninja log")
+        return []
+
+    # Dict keeps insertion order, output rebuilt later moves to its latest position
+    entries: dict[str, tuple[int, int, str]] = {}
+    last_end = 0
+    for line in lines[1:]:
+        parts = line.split('\t')
+        if len(parts) != 5:
+            continue
+        start, end, _, output, command_hash = parts
+        if int(end) < last_end:
+            entries.clear()
+        last_end = int(end)
+        entries.pop(output, None)
+        entries[output] = (int(start), int(end), command_hash)
+
+    edges: dict[tuple[int, int, str], LogEdge] = {}
+    for output, key in entries.items():
+        edge = edges.get(key)
+        if edge is None:
+            edges[key] = LogEdge([output], key[0], key[1], key[2])
+        else:
+            edge.outputs.append(output)
+    return list(edges.values())
+
+def parse_ninja_graph(dot_text: str) -> BuildGraph:
+    labels: dict[str, str] = {}
+    edge_rules: dict[str, str] = {}
+    edge_inputs: dict[str, list[str]] = {}
+    edge_outputs: dict[str, list[str]] = {}
+    for line in dot_text.splitlines():
+        node_match = _GRAPH_NODE_PATTERN.match(line)
+        if node_match is not None:
+            if node_match['ellipse'] is not None:
+                # Edge with many inputs or outputs is a node of its own
+                edge_rules[node_match['id']] = node_match['label']
+            else:
+                labels[node_match['id']] = node_match['label']
+            continue
+        arc_match = _GRAPH_ARC_PATTERN.match(line)
+        if arc_match is None:
+            continue
+        source, target, attributes = arc_match['source'], arc_match['target'], arc_match['attributes'] or ''
+        label_match = _GRAPH_ARC_LABEL_PATTERN.search(attributes)
+        if label_match is not None:
+            # Edge with single input and output is just labeled arc
+            edge_id = f'{source}->{target}'
+            edge_rules[edge_id] = label_match['rule']
+            edge_inputs.setdefault(edge_id, []).append(source)
+            edge_outputs.setdefault(edge_id, []).append(target)
+        elif target in edge_rules:
+            edge_inputs.setdefault(target, []).append(source)
+        else:
+            edge_outputs.setdefault(source, []).append(target)
+
+    graph = BuildGraph({}, {})
+    for edge_id, rule in edge_rules.items():
+        inputs = [labels[node] for node in edge_inputs.get(edge_id, []) if node in labels]
+        for output_node in edge_outputs.get(edge_id, []):
+            if output_node not in labels:
+                continue
+            graph.rules[labels[output_node]] = rule
+            graph.inputs[labels[output_node]] = inputs
+    return graph
+
+def _classify(edge: LogEdge, graph: BuildGraph | None):
+    rule = None if graph is None else graph.rules.get(edge.outputs[0])
+    edge.rule = rule
+    if rule is not None:
+        # CMake names rules like CXX_COMPILER__<target>_<config>, CXX_EXECUTABLE_LINKER__<target>_<config>
+        if 'LINKER' in rule:
+            edge.kind = 'link'
+        elif 'COMPILER' in rule:
+            edge.kind = 'compile'
+        return
+    extension = os.path.splitext(edge.outputs[0])[1].lower()
+    if extension in _COMPILE_EXTENSIONS:
+        edge.kind = 'compile'
+    elif extension in _LINK_EXTENSIONS:
+        edge.kind = 'link'
+
+def find_critical_path(edges: list[LogEdge], graph: BuildGraph) -> list[LogEdge]:
+    # Longest chain of dependent edges. Nodes that were not built (sources, phony
+    # targets, up to date outputs) cost nothing but still connect their inputs
+    edge_of_output = {output: edge for edge in edges for output in edge.outputs}
+    finish: dict[str, int] = {}
+    previous: dict[str, str | None] = {}
+    for root in graph.inputs.keys():
+        stack: list[tuple[str, bool]] = [(root, False)]
+        visiting: set[str] = set()
+        while len(stack) > 0:
+            node, inputs_done = stack.pop()
+            if node in finish:
+                continue
+            inputs = graph.inputs.get(node, [])
+            if not inputs_done:
+                if node in visiting:
+                    # Dependency cycle, ninja would refuse to build it
+                    finish[node] = 0
+                    previous[node] = None
+                    continue
+                visiting.add(node)
+                stack.append((node, True))
+                stack.extend((input_node, False) for input_node in inputs if input_node not in finish)
+                continue
+            visiting.discard(node)
+            longest_input = max(inputs, key=lambda input_node: finish.get(input_node, 0), default=None)
+            edge = edge_of_output.get(node)
+            finish[node] = (0 if longest_input is None else finish.get(longest_input, 0)) + (0 if edge is None else edge.duration)
+            previous[node] = longest_input
+
+    if len(finish) == 0:
+        return []
+    node: str | None = max(finish.keys(), key=lambda output: finish[output])
+    path: list[LogEdge] = []
+    while node is not None:
+        edge = edge_of_output.get(node)
+        if edge is not None and (len(path) == 0 or path[-1] is not edge):
+            path.append(edge)
+        node = previous.get(node)
+    path.reverse()
+    return path
+
+def get_parallelism_timeline(edges: list[LogEdge], buckets: int = _TIMELINE_BUCKETS) -> list[float]:
+    # Average number of running edges in each of equal time slices of the build
+    if len(edges) == 0:
+        return []
+    build_start = min(edge.start for edge in edges)
+    build_end = max(edge.end for edge in edges)
+    bucket_width = max((build_end - build_start) / buckets, 1)
+    busy = [0.0] * buckets
+    for edge in edges:
+        for bucket in range(int((edge.start - build_start) // bucket_width), min(int((edge.end - build_start) // bucket_width) + 1, buckets)):
+            bucket_start = build_start + bucket * bucket_width
+            overlap = min(edge.end, bucket_start + bucket_width) - max(edge.start, bucket_start)
+            busy[bucket] += max(overlap, 0)
+    return [bucket_busy / bucket_width for bucket_busy in busy]
+
+def _load_graph(build_dir: str, toolset_config: config.BuildToolsConfig) -> BuildGraph | None:
+    if not toolset_config.is_ninja_set():
+        log.warn("Build report: ninja is not set, critical path and rule names are unavailable")
+        return None
+    dot_text = commons.execute_process([str(toolset_config.ninja_exe), '-t', 'graph'], build_dir, return_stdout=True)
+    return parse_ninja_graph(dot_text or '')
+
+def _format_edge(edge: LogEdge) -> str:
+    more_outputs = f' (+{len(edge.outputs) - 1} outputs)' if len(edge.outputs) > 1 else ''
+    return f"{edge.duration / 1000:>8.2f}s  {edge.outputs[0]}{more_outputs}"
+
+@trace.traced("build_report.report")
+def report(cmake_config: cmake.Config, toolset_config: config.BuildToolsConfig, top_count: int = 10):
+    build_dir = cmake.get_config_files_path(cmake_config)
+    log_path = f'{build_dir}/.ninja_log'
+    if not os.path.exists(log_path):
+        log.warn(f"Build report: '{log_path}' doesn't exist. Report needs project built with Ninja generator.")
+        return
+    edges = parse_ninja_log(log_path)
+    if len(edges) == 0:
+        log.info("Build report: nothing was built in the last build")
+        return
+    graph = _load_graph(build_dir, toolset_config)
+    for edge in edges:
+        _classify(edge, graph)
+
+    wall_time = max(edge.end for edge in edges) - min(edge.start for edge in edges)
+    total_time = sum(edge.duration for edge in edges)
+    log.info(f"Build report of '{build_dir}': {len(edges)} edges, wall time {wall_time / 1000:.2f}s, sum of edge times {total_time / 1000:.2f}s")
+    for kind in ['compile', 'link']:
+        kind_edges = sorted([edge for edge in edges if edge.kind == kind], key=lambda edge: edge.duration, reverse=True)
+        if len(kind_edges) == 0:
+            continue
+        kind_total = sum(edge.duration for edge in kind_edges)
+        log.info(f"Slowest {kind} steps ({len(kind_edges)} in total, {kind_total / 1000:.2f}s):")
+        for edge in kind_edges[:top_count]:
+            log.info(_format_edge(edge))
+
+    if graph is not None:
+        critical_path = find_critical_path(edges, graph)
+        critical_time = sum(edge.duration for edge in critical_path)
+        log.info(f"Critical path ({len(critical_path)} steps, {critical_time / 1000:.2f}s, build can't be faster than that):")
+        for edge in critical_path:
+            log.info(f"{_format_edge(edge)} [{edge.kind}]")
+
+    timeline = get_parallelism_timeline(edges)
+    average = total_time / wall_time if wall_time > 0 else float(len(edges))
+    log.info(f"Effective parallelism: average {average:.2f}, peak slice {max(timeline):.2f}")
+    bar_scale = min(1.0, _TIMELINE_BAR_MAX_WIDTH / max(max(timeline), 1))
+    slice_seconds = wall_time / len(timeline) / 1000
+    for index, value in enumerate(timeline):
+        log.info(f"{index * slice_seconds:>8.2f}s {value:>6.2f} {'#' * round(value * bar_scale)}")
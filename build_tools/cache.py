@@ -0,0 +1,244 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import typing
+
+from . import commons
+from . import download
+from . import log
+
+"""
+Machine-wide, content-addressed cache of downloaded files, shared by all workspaces.
+
+Cache structure looks like this:
+CACHE_DIR/downloads:
+    - objects/<sha256 of content>   - downloaded files
+    - urls/<sha256 of url>          - '<sha256 of content>\\n<url>' pointing to object
+    - tmp/<sha256 of url>.part      - files being downloaded, resumed by the next
+                                      run when interrupted (see download.open_partial())
+
+CACHE_DIR is taken from BUILD_TOOLS_CACHE_DIR, then XDG_CACHE_HOME/build_tools,
+then ~/.cache/build_tools (%LOCALAPPDATA%/build_tools on windows). Set
+BUILD_TOOLS_CACHE_DIR to empty string to disable cache.
+Objects are verified by sha256 on every hit and evicted least recently used
+first when cache grows over BUILD_TOOLS_CACHE_MAX_SIZE_MB (default 8192).
+Only immutable urls (tagged releases) should go through it.
+"""
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+_DEFAULT_MAX_SIZE_MB = 8192
+
+def get_cache_dir() -> str | None:
+    cache_dir = os.environ.get('BUILD_TOOLS_CACHE_DIR')
+    if cache_dir is not None:
+        return None if len(cache_dir) == 0 else commons.normalize_path(cache_dir)
+    if commons.is_windows():
+        base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~/AppData/Local'))
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return commons.normalize_path(f'{base_dir}/build_tools')
+
+def is_enabled() -> bool:
+    return get_cache_dir() is not None
+
+def _get_max_size() -> int:
+    return int(os.environ.get('BUILD_TOOLS_CACHE_MAX_SIZE_MB', _DEFAULT_MAX_SIZE_MB)) * 1024 * 1024
+
+def _get_downloads_dir() -> str:
+    cache_dir = get_cache_dir()
+    assert(cache_dir is not None)
+    return f'{cache_dir}/downloads'
+
+def _get_objects_dir() -> str:
+    return f'{_get_downloads_dir()}/objects'
+
+def _get_urls_dir() -> str:
+    return f'{_get_downloads_dir()}/urls'
+
+def _get_tmp_dir() -> str:
+    return f'{_get_downloads_dir()}/tmp'
+
+def _get_url_entry_path(url: str) -> str:
+    return f'{_get_urls_dir()}/{hashlib.sha256(url.encode("UTF-8")).hexdigest()}'
+
+def file_sha256(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(_HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def lookup(url: str) -> str | None:
+    if not is_enabled():
+        return None
+    entry_path = _get_url_entry_path(url)
+    if not os.path.exists(entry_path):
+        return None
+    with open(entry_path, "r", encoding="UTF-8") as file:
+        object_hash = file.readline().strip()
+    object_path = f'{_get_objects_dir()}/{object_hash}'
+    if not os.path.exists(object_path):
+        os.remove(entry_path)
+        return None
+    if file_sha256(object_path) != object_hash:
+        log.warn(f"Cached file of '{url}' is corrupted. Removing it from cache.")
+        os.remove(object_path)
+        os.remove(entry_path)
+        return None
+    # atime is what LRU eviction looks at. mtime is left alone, object can be
+    # hardlinked into workspace and install markers compare it
+    os.utime(object_path, ns=(time.time_ns(), os.stat(object_path).st_mtime_ns))
+    log.info(f"Using cached '{url}' ({object_hash[:12]})")
+    return object_path
+
+def _store(temp_path: str, object_hash: str, url: str) -> str:
+    object_path = f'{_get_objects_dir()}/{object_hash}'
+    os.makedirs(_get_objects_dir(), exist_ok=True)
+    os.makedirs(_get_urls_dir(), exist_ok=True)
+    os.replace(temp_path, object_path)
+
+    entry_path = _get_url_entry_path(url)
+    with tempfile.NamedTemporaryFile("w", dir=_get_tmp_dir(), delete=False, encoding="UTF-8") as entry_file:
+        entry_file.write(f'{object_hash}\n{url}\n')
+    os.replace(entry_file.name, entry_path)
+    # Object bigger than size cap stays until the next store, caller is about to use it
+    evict(_get_max_size(), keep_hash=object_hash)
+    return object_path
+
+class _HashingTee:
+    # Resumed download is read from partial file first, then from network
+    def __init__(self, source: download.ResumableStream, target: typing.BinaryIO, partial_path: str):
+        self._source = source
+        self._target = target
+        self._hash = hashlib.sha256()
+        self._prefix: typing.BinaryIO | None = open(partial_path, 'rb') if source.start_offset > 0 else None
+        self._prefix_remaining = source.start_offset
+        self.name = partial_path
+
+    def read(self, size: int = -1) -> bytes:
+        prefix_data = b''
+        if self._prefix is not None:
+            prefix_data = self._prefix.read(self._prefix_remaining if size < 0 else min(size, self._prefix_remaining))
+            self._prefix_remaining -= len(prefix_data)
+            if self._prefix_remaining <= 0 or len(prefix_data) == 0:
+                self._prefix.close()
+                self._prefix = None
+            self._hash.update(prefix_data)
+            # Sized read may return less, unsized one returns everything
+            if size >= 0 and len(prefix_data) > 0:
+                return prefix_data
+        data = self._source.read(size)
+        self._target.write(data)
+        self._hash.update(data)
+        return prefix_data + data
+
+    def drain(self):
+        while self.read(_HASH_CHUNK_SIZE):
+            pass
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+def _get_partial_path(url: str) -> str:
+    return f'{_get_tmp_dir()}/{hashlib.sha256(url.encode("UTF-8")).hexdigest()}.part'
+
+@contextlib.contextmanager
+def _download_to_cache(url: str) -> typing.Iterator[_HashingTee]:
+    # Partial file is kept when interrupted, next run resumes it
+    partial_path = _get_partial_path(url)
+    with download.open_partial(url, partial_path) as (response, partial_file):
+        tee = _HashingTee(response, partial_file, partial_path)
+        yield tee
+        tee.drain()
+
+@contextlib.contextmanager
+def _download_lock(url: str) -> typing.Iterator[None]:
+    # Runs in other workspaces downloading the same url wait, then find it in cache
+    with commons.file_lock(f'{_get_partial_path(url)}.lock', f"download of '{url}'"):
+        yield
+
+@contextlib.contextmanager
+def open_url(url: str) -> typing.Iterator[typing.BinaryIO]:
+    # Yields readable stream of url content. On cache miss, content is written
+    # to cache while it is read, so downloaded data is consumed only once
+    cached_path = lookup(url)
+    if cached_path is not None:
+        with open(cached_path, 'rb') as file:
+            yield file
+        return
+
+    if not is_enabled():
+        with download.open_url(url) as response:
+            yield typing.cast(typing.BinaryIO, response)
+        return
+
+    with _download_lock(url):
+        cached_path = lookup(url)
+        if cached_path is not None:
+            with open(cached_path, 'rb') as file:
+                yield file
+            return
+        with _download_to_cache(url) as tee:
+            yield typing.cast(typing.BinaryIO, tee)
+        _store(tee.name, tee.hexdigest(), url)
+
+def fetch(url: str) -> str:
+    # Returns path to cached file with url content, downloading it if needed
+    cached_path = lookup(url)
+    if cached_path is not None:
+        return cached_path
+    if not is_enabled():
+        log.error("cache.fetch(): cache is disabled")
+        exit(-1)
+    with _download_lock(url):
+        cached_path = lookup(url)
+        if cached_path is not None:
+            return cached_path
+        with _download_to_cache(url) as tee:
+            pass
+        return _store(tee.name, tee.hexdigest(), url)
+
+def install_file(url: str, target_path: str, executable: bool = False):
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    if not is_enabled():
+        download.download_file(url, target_path)
+    else:
+        cached_path = fetch(url)
+        if executable:
+            # Hardlink shares mode with cached object, executable gets its own copy to chmod
+            shutil.copyfile(cached_path, target_path)
+        else:
+            try:
+                os.link(cached_path, target_path)
+            except OSError:
+                shutil.copyfile(cached_path, target_path)
+    if executable and not commons.is_windows():
+        os.chmod(target_path, 0o755)
+
+def evict(max_size: int, keep_hash: str | None = None):
+    objects_dir = _get_objects_dir()
+    if not os.path.isdir(objects_dir):
+        return
+    entries: list[os.DirEntry] = []
+    total_size = 0
+    with os.scandir(objects_dir) as iterator:
+        for entry in iterator:
+            total_size += entry.stat().st_size
+            if entry.name != keep_hash:
+                entries.append(entry)
+    if total_size <= max_size:
+        return
+
+    entries.sort(key=lambda entry: entry.stat().st_atime)
+    for entry in entries:
+        if total_size <= max_size:
+            break
+        log.info(f"Evicting '{entry.name[:12]}' from download cache")
+        total_size -= entry.stat().st_size
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(entry.path)
@@ -8,12 +8,15 @@ from . import log
 from . import commons
 from . import config
 from . import cmake
+from . import resources
+from . import trace
 
 def _error_log_and_die(msg: str) -> typing.NoReturn:
     log.error(msg)
     exit(-1)
 
 
+@trace.traced("clion.create_build_tools_configurations")
 def create_build_tools_configurations(
     cmake_config: cmake.Config,
     toolset_config: config.BuildToolsConfig,
@@ -74,6 +77,7 @@ def _create_idea_project_xml(
         configurations_element.insert(index, config)
 
     # Create all build_tools configs
+    job_count = resources.get_job_count(toolset_config.workspace_dir, resources.PROJECT)
     for mode in ["Debug", "Release"]:
         toolchain_file = conan.get_toolchain_filepath(
             mode.capitalize(), 
@@ -82,17 +86,23 @@ def _create_idea_project_xml(
         )
         toolchain_file = commons.normalize_path(toolchain_file)
         cmake_options = cmake.generate_configure_options(cmake_config, toolset_config, vcpkg_dependencies)
+        # CLion configures on its own, files the options point at have to exist
+        cmake.write_configure_files(cmake_config, toolset_config)
         generation_options: list[str] = []
         for key, value in cmake_options.variables.items():
             generation_options += [f'{key}="{value}"']
 
         toolchain_name = "Visual Studio" if commons.is_windows() else "Unix Makefiles"
-        build_options = ["-j16"] if toolset_config.is_ninja_set() else []
+        build_options = [f"-j{job_count}"] if toolset_config.is_ninja_set() else []
+        # Multi config profiles share build tree of build.py, switching profile doesn't reconfigure
+        generation_dir = f"$PROJECT_DIR$/.workspace/clion/{mode.lower()}"
+        if cmake_config.is_multi_config():
+            generation_dir = commons.normalize_path(cmake.get_config_files_path(cmake_config))
 
         new_config: dict[str, str] = {
             "PROFILE_NAME" : mode,
             "ENABLED" : "true",
-            "GENERATION_DIR" : f"$PROJECT_DIR$/.workspace/clion/{mode.lower()}",
+            "GENERATION_DIR" : generation_dir,
             "GENERATION_OPTIONS": ' '.join(generation_options),
             "CONFIG_NAME" : mode,
             "TOOLCHAIN_NAME": toolchain_name,
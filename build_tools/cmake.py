@@ -1,17 +1,31 @@
 import dataclasses
+import hashlib
+import json
 import os
-import tarfile
-import urllib.request
-import zipfile
 import shutil
 import platform
 
+from . import archive
+from . import cache
 from . import commons
+from . import compiler_cache
+from . import install
+from . import jobserver
 from . import log
 from . import conan
 from . import config
+from . import resources
+from . import trace
 
 """
+Configure runs only when something it depends on changed. Fingerprint of
+configure options, cmake executable, toolchain file and files included after
+project() (see get_project_include_dir()), together with size,
+mtime and hash of every CMakeLists.txt and *.cmake file read by the last
+configure (cmakeFiles reply of CMake file API) is kept in the build tree
+(build_tools_configure.json). CONFIGURE_DEPENDS globs are left to the build,
+ninja checks them before every build on its own.
+
 CMake default structure for this configuration looks like this:
 
 For 4.2.0
@@ -26,31 +40,47 @@ WORKSPACE_DIR/cmake:
 """
 
 
+def _detect_mode(build_type: str) -> str:
+    match build_type.lower():
+        case "debug": return "Debug"
+        case "release": return "Release"
+        case "relwithdebinfo": return "RelWithDebInfo" 
+        case "minsizerel": return "MinSizeRel"
+    log.info(f"Unusual cmake build type detected: '{build_type}'. Passing it trough as defined.")
+    return build_type
+
 class Config:
     def __init__(self, 
         list_dir: str,
         build_dir: str,
         build_type: str,
-        prefix_paths: list[str] | None = None
+        prefix_paths: list[str] | None = None,
+        unity_build: bool = False,
+        multi_config_types: list[str] | None = None
     ):
         self.list_dir = list_dir
         self.build_dir = build_dir
         self.prefix_paths = [] if prefix_paths is None else prefix_paths
-        
-        def _detect_mode() -> str:
-            match build_type.lower():
-                case "debug": return "Debug"
-                case "release": return "Release"
-                case "relwithdebinfo": return "RelWithDebInfo" 
-                case "minsizerel": return "MinSizeRel"
-            log.info(f"Unusual cmake build type detected: '{build_type}'. Passing it trough as defined.")
-            return build_type
-        self.build_mode = _detect_mode()
+        # Sources are batched by build_tools, see unity.py
+        self.unity_build = unity_build
+        self.build_mode = _detect_mode(build_type)
+        # With types set, single 'Ninja Multi-Config' build tree holds all of them, build_mode is the default one
+        self.multi_config_types: list[str] | None = None
+        if multi_config_types is not None:
+            self.multi_config_types = [_detect_mode(multi_config_type) for multi_config_type in multi_config_types]
+            if self.build_mode not in self.multi_config_types:
+                self.multi_config_types.insert(0, self.build_mode)
+
+    def is_multi_config(self) -> bool:
+        return self.multi_config_types is not None
+
 
+def _cmake_4_2_0_get_install_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/cmake/cmake-4.2.0'
 
 def _cmake_4_2_0_get_exec_path(workspace_dir: str) -> str:
     exe_ext = ".exe" if commons.is_windows() else ""
-    return f'{workspace_dir}/cmake/cmake-4.2.0/bin/cmake{exe_ext}'
+    return f'{_cmake_4_2_0_get_install_dir(workspace_dir)}/bin/cmake{exe_ext}'
 
 def _cmake_4_2_0_download(workspace_dir: str) -> str:
     if not commons.is_windows() and not commons.is_linux():
@@ -60,78 +90,126 @@ def _cmake_4_2_0_download(workspace_dir: str) -> str:
     system_string = "windows" if commons.is_windows() else "linux"
     archive_ext = "zip" if commons.is_windows() else "tar.gz"
 
-    download_link = f"https://github.com/Kitware/CMake/releases/download/v4.2.0/cmake-4.2.0-{system_string}-x86_64.{archive_ext}"
-    cmake_main_dir = f'{workspace_dir}/cmake'
-
+    download_link = f"{commons.get_github_url()}/Kitware/CMake/releases/download/v4.2.0/cmake-4.2.0-{system_string}-x86_64.{archive_ext}"
     archive_root_folder_name = f'cmake-4.2.0-{system_string}-x86_64'
-    renamed_archive_dir_name = f'cmake-4.2.0'
-    renamed_archive_dir_path = f'{cmake_main_dir}/{renamed_archive_dir_name}'
-    downloaded_archive_path = f'{workspace_dir}/cmake-4.2.0.{archive_ext}'
-
-    if os.path.exists(renamed_archive_dir_path):
-        log.info("Previous cmake download exists. Deleting...")
-        commons.delete_dir(renamed_archive_dir_path)
-
-    log.info("Downloading cmake executable...")
-    urllib.request.urlretrieve(download_link, downloaded_archive_path)
-    log.info("CMake downloaded.")
+    renamed_archive_dir_path = _cmake_4_2_0_get_install_dir(workspace_dir)
 
     exe_ext = ".exe" if commons.is_windows() else ""
     package_dirs_exclusion_list: list[str] = [
-        f'{archive_root_folder_name}/doc',
-        f'{archive_root_folder_name}/man',
-        f'{archive_root_folder_name}/share/aclocal',
-        f'{archive_root_folder_name}/share/bash-completion',
-        f'{archive_root_folder_name}/share/cmake-4.2/Help',
-        f'{archive_root_folder_name}/share/cmake-4.2/Licenses',
-        f'{archive_root_folder_name}/share/emacs',
-        f'{archive_root_folder_name}/share/vim',
-        f'{archive_root_folder_name}/share/icons', # Additionally in linux package
-        f'{archive_root_folder_name}/share/mime',  # Additionally in linux package
+        'doc',
+        'man',
+        'share/aclocal',
+        'share/bash-completion',
+        'share/cmake-4.2/Help',
+        'share/cmake-4.2/Licenses',
+        'share/emacs',
+        'share/vim',
+        'share/icons', # Additionally in linux package
+        'share/mime',  # Additionally in linux package
     ]
     package_files_exclusion_list: list[str] = [
-        f'{archive_root_folder_name}/bin/cmake-gui{exe_ext}',
-        f'{archive_root_folder_name}/bin/cmcldeps{exe_ext}',
-        f'{archive_root_folder_name}/bin/cpack{exe_ext}',
-        f'{archive_root_folder_name}/bin/ctest{exe_ext}',
+        f'bin/cmake-gui{exe_ext}',
+        f'bin/cmcldeps{exe_ext}',
+        f'bin/cpack{exe_ext}',
+        f'bin/ctest{exe_ext}',
     ]
 
-    def _is_excluded(filename: str) -> bool:
-        for excluded_dir in package_dirs_exclusion_list:
-            if filename.startswith(excluded_dir):
-                return True
-        for excluded_file in package_files_exclusion_list:
-            if filename == excluded_file:
-                return True
-        return False
-    
-    log.info("Unpacking cmake executable (it can take a minute)...")
-    os.makedirs(cmake_main_dir, exist_ok=True)
-    if commons.is_windows():
-        with zipfile.ZipFile(downloaded_archive_path, 'r') as zip_file:
-            for file in zip_file.filelist:
-                if _is_excluded(file.filename) or file.is_dir(): 
-                    continue
-                output_path = f'{renamed_archive_dir_path}/{file.filename[len(archive_root_folder_name) + 1:]}'
-                output_path = os.path.dirname(output_path)
-                file.filename = os.path.basename(file.filename)
-                zip_file.extract(file, output_path)
-    else:
-        with tarfile.open(downloaded_archive_path, 'r:gz') as tar_file:
-            for file_path, file_member in zip(tar_file.getnames(), tar_file.getmembers()):
-                if _is_excluded(file_path) or file_member.isdir(): 
-                    continue
-                output_path = f'{renamed_archive_dir_path}/{file_path[len(archive_root_folder_name) + 1:]}'
-                output_path = os.path.dirname(output_path)
-                file_member.name = f'{output_path}/{os.path.basename(file_path)}'
-                tar_file.extract(file_member, output_path)
+    # Archive is unpacked while it is downloaded, it never lands in workspace.
+    # Previous install stays usable until new one is complete
+    log.info("Downloading and unpacking cmake executable (it can take a minute)...")
+    with install.staged_install(workspace_dir, renamed_archive_dir_path, [f'bin/cmake{exe_ext}']) as staging_dir:
+        archive.stream_extract(
+            download_link,
+            staging_dir,
+            archive_ext,
+            archive.PathFilter(archive_root_folder_name, package_dirs_exclusion_list, package_files_exclusion_list)
+        )
+    log.info("CMake downloaded and unpacked.")
 
-    exe_ext = ".exe" if commons.is_windows() else ""
     return f'{renamed_archive_dir_path}/bin/cmake{exe_ext}'
 
 def get_config_files_path(config: Config) -> str:
+    if config.is_multi_config():
+        return f"{config.build_dir}/MultiConfig"
     return f"{config.build_dir}/{config.build_mode}"
 
+_COMPILER_CACHE_INCLUDE_NAME = 'build_tools_compiler_cache.cmake'
+
+def get_project_include_dir(workspace_dir: str) -> str:
+    # Every .cmake file here is included right after project() (CMAKE_PROJECT_INCLUDE).
+    # Passes tuning the build (pch.py, unity.py, compiler_cache.py) put their wiring here
+    return f'{workspace_dir}/cmake/project_include'
+
+def _get_project_includes(workspace_dir: str) -> dict[str, str]:
+    # Name and content of every file of project include dir, as write_configure_files() leaves them
+    include_dir = get_project_include_dir(workspace_dir)
+    project_includes: dict[str, str] = {}
+    for name in (os.listdir(include_dir) if os.path.isdir(include_dir) else []):
+        if name.endswith('.cmake'):
+            with open(f'{include_dir}/{name}', "r", encoding="UTF-8") as file:
+                project_includes[name] = file.read()
+    compiler_cache_include = compiler_cache.get_launcher_include(workspace_dir)
+    if compiler_cache_include is None:
+        project_includes.pop(_COMPILER_CACHE_INCLUDE_NAME, None)
+    else:
+        project_includes[_COMPILER_CACHE_INCLUDE_NAME] = compiler_cache_include
+    return dict(sorted(project_includes.items()))
+
+def _get_project_include_path(config: Config) -> str:
+    # In build tree of the mode, modes configured at once don't write the same file
+    return f'{get_config_files_path(config)}/build_tools_project_include.cmake'
+
+def _get_project_include_content(workspace_dir: str, project_includes: dict[str, str]) -> str:
+    include_dir = get_project_include_dir(workspace_dir)
+    lines = ['# Generated by build_tools, do not edit']
+    lines += [f'include("{include_dir}/{name}")' for name in project_includes.keys()]
+    return '\n'.join(lines) + '\n'
+
+def _get_project_include_sha256(workspace_dir: str) -> str:
+    # File API reports wrapper as generated (it is in build tree) and knows nothing about includes added since
+    # the last configure, so they are fingerprinted here
+    project_includes = _get_project_includes(workspace_dir)
+    sha256 = hashlib.sha256(_get_project_include_content(workspace_dir, project_includes).encode('UTF-8'))
+    for content in project_includes.values():
+        sha256.update(content.encode('UTF-8'))
+    return sha256.hexdigest()
+
+def _is_read_by_project_include(workspace_dir: str, variable: str) -> bool:
+    return any(variable in content for content in _get_project_includes(workspace_dir).values())
+
+def write_deferred_project_include(include_path: str, name: str, body_lines: list[str], enabled_variable: str | None = None):
+    # Project include runs right after every project() call, before targets exist. Body lines
+    # run once, at the end of top level CMakeLists.txt, when all targets are defined
+    guard = f'BUILD_TOOLS_{name.upper()}_DEFERRED'
+    lines = [
+        f'# Generated by build_tools ({name}.py), do not edit',
+        'if(CMAKE_VERSION VERSION_LESS 3.19)',
+        '    return()',
+        'endif()',
+    ]
+    if enabled_variable is not None:
+        lines += [
+            f'if(NOT {enabled_variable})',
+            '    return()',
+            'endif()',
+        ]
+    lines += [
+        f'get_property(_build_tools_{name}_deferred GLOBAL PROPERTY {guard})',
+        f'if(_build_tools_{name}_deferred)',
+        '    return()',
+        'endif()',
+        f'set_property(GLOBAL PROPERTY {guard} TRUE)',
+        f'function(_build_tools_apply_{name})',
+    ]
+    lines += [f'    {line}' for line in body_lines]
+    lines += [
+        'endfunction()',
+        f'cmake_language(DEFER DIRECTORY "${{CMAKE_SOURCE_DIR}}" CALL _build_tools_apply_{name})',
+    ]
+    os.makedirs(os.path.dirname(include_path), exist_ok=True)
+    with open(include_path, "w", encoding="UTF-8") as file:
+        file.write('\n'.join(lines) + '\n')
+
 def download_cmake(workspace_dir: str) -> str:
     return _cmake_4_2_0_download(workspace_dir)
 
@@ -139,7 +217,7 @@ def is_cmake_systemwide_installed() -> bool:
     return shutil.which("cmake") is not None
 
 def is_cmake_in_workspace_toolset(workspace_dir: str) -> bool:
-    return os.path.exists(_cmake_4_2_0_get_exec_path(workspace_dir))
+    return install.is_installed(_cmake_4_2_0_get_install_dir(workspace_dir))
 
 def get_toolset_cmake_exe_path(workspace_dir: str) -> str:
     return _cmake_4_2_0_get_exec_path(workspace_dir)
@@ -160,19 +238,38 @@ def generate_configure_options(
         '-S': config.list_dir,
     }
     cmake_variables: dict[str, str] = {
-        '-DCMAKE_BUILD_TYPE': config.build_mode
+        # Source of compile commands for passes analyzing includes (pch.py, unity.py)
+        '-DCMAKE_EXPORT_COMPILE_COMMANDS': 'ON',
     }
+    # Switches batches generated by unity.py, set every time they exist so turning it off works too.
+    # Without them nothing reads it and cmake warns about manually-specified variable not used
+    if _is_read_by_project_include(toolset_config.workspace_dir, 'BUILD_TOOLS_UNITY_BUILD'):
+        cmake_variables['-DBUILD_TOOLS_UNITY_BUILD'] = 'ON' if config.unity_build else 'OFF'
+    if config.multi_config_types is not None:
+        if not toolset_config.is_ninja_set():
+            log.error("cmake.generate_configure_options(): multi config build tree needs ninja")
+            exit(-1)
+        cmake_variables.update({
+            '-DCMAKE_CONFIGURATION_TYPES': ';'.join(config.multi_config_types),
+            '-DCMAKE_DEFAULT_BUILD_TYPE': config.build_mode,
+            # Every configuration buildable from one ninja run (all:Debug all:Release)
+            '-DCMAKE_CROSS_CONFIGS': 'all',
+        })
+    else:
+        cmake_variables.update({'-DCMAKE_BUILD_TYPE': config.build_mode})
 
     if toolset_config.is_conan_set():
         cmake_variables.update({
             '-DCMAKE_TOOLCHAIN_FILE': conan.get_toolchain_filepath(
                 config.build_mode, 
                 toolset_config.workspace_dir, 
-                toolset_config.is_ninja_set()
+                toolset_config.is_ninja_set(),
+                config.is_multi_config()
             )
         })
 
-    prefix_paths = config.prefix_paths
+    # Copy, config is shared by modes and CLion configurations
+    prefix_paths = list(config.prefix_paths)
     if toolset_config.is_vcpkg_set() and vcpkg_dependencies is not None and len(vcpkg_dependencies) > 0:
         prefix_paths += vcpkg_dependencies
     
@@ -183,39 +280,191 @@ def generate_configure_options(
 
     if toolset_config.is_ninja_set():
         cmake_variables.update({
-            '-DCMAKE_GENERATOR': 'Ninja',
+            '-DCMAKE_GENERATOR': 'Ninja Multi-Config' if config.is_multi_config() else 'Ninja',
             '-DCMAKE_MAKE_PROGRAM': f'{toolset_config.ninja_exe}',
         })
 
+    # CMakeCache keeps wrapper once it was passed, it is rewritten empty when its includes are removed
+    project_include = _get_project_include_path(config)
+    if len(_get_project_includes(toolset_config.workspace_dir)) > 0 or os.path.exists(project_include):
+        cmake_variables.update({'-DCMAKE_PROJECT_INCLUDE': project_include})
+
     return ConfigureOptions(cmake_direct_args, cmake_variables)
 
-def configure(
+def write_configure_files(config: Config, toolset_config: config.BuildToolsConfig):
+    # Files generate_configure_options() points at, written right before they are used
+    workspace_dir = toolset_config.workspace_dir
+    # Rebuilds after delete_cache() are mostly cache hits
+    compiler_cache.write_launcher_include(f'{get_project_include_dir(workspace_dir)}/{_COMPILER_CACHE_INCLUDE_NAME}', workspace_dir)
+    project_includes = _get_project_includes(workspace_dir)
+    project_include = _get_project_include_path(config)
+    if len(project_includes) == 0 and not os.path.exists(project_include):
+        return
+    os.makedirs(os.path.dirname(project_include), exist_ok=True)
+    with open(project_include, "w", encoding="UTF-8") as file:
+        file.write(_get_project_include_content(workspace_dir, project_includes))
+
+_CONFIGURE_STATE_NAME = 'build_tools_configure.json'
+_FILE_API_CLIENT = 'client-build_tools'
+
+def _get_configure_state_path(config: Config) -> str:
+    return f'{get_config_files_path(config)}/{_CONFIGURE_STATE_NAME}'
+
+def _get_configure_fingerprint(options: ConfigureOptions, toolset_config: config.BuildToolsConfig) -> dict:
+    cmake_path = shutil.which(toolset_config.cmake_exe) or toolset_config.cmake_exe
+    cmake_stat = os.stat(cmake_path)
+    toolchain_path = options.variables.get('-DCMAKE_TOOLCHAIN_FILE')
+    return {
+        'direct_args': options.direct_args,
+        'variables': options.variables,
+        'cmake': [commons.realpath(cmake_path), cmake_stat.st_size, cmake_stat.st_mtime_ns],
+        'toolchain': cache.file_sha256(toolchain_path) if toolchain_path is not None and os.path.isfile(toolchain_path) else None,
+        'project_include': _get_project_include_sha256(toolset_config.workspace_dir),
+    }
+
+def _write_file_api_query(build_path: str):
+    query_dir = f'{build_path}/.cmake/api/v1/query/{_FILE_API_CLIENT}'
+    os.makedirs(query_dir, exist_ok=True)
+    with open(f'{query_dir}/query.json', "w", encoding="UTF-8") as file:
+        json.dump({'requests': [{'kind': 'cmakeFiles', 'version': 1}]}, file)
+
+def _read_file_api_inputs(build_path: str) -> list[str]:
+    # Project files read by configure. CMake own modules change only with cmake executable
+    reply_dir = f'{build_path}/.cmake/api/v1/reply'
+    index_files = sorted(name for name in os.listdir(reply_dir) if name.startswith('index-')) if os.path.isdir(reply_dir) else []
+    if len(index_files) == 0:
+        return []
+    with open(f'{reply_dir}/{index_files[-1]}', "r", encoding="UTF-8") as file:
+        index = json.load(file)
+    responses = index.get('reply', {}).get(_FILE_API_CLIENT, {}).get('query.json', {}).get('responses', [])
+    inputs: list[str] = []
+    for response in responses:
+        if response.get('kind') != 'cmakeFiles':
+            continue
+        with open(f'{reply_dir}/{response["jsonFile"]}', "r", encoding="UTF-8") as file:
+            cmake_files = json.load(file)
+        source_dir = cmake_files['paths']['source']
+        for cmake_input in cmake_files['inputs']:
+            if cmake_input.get('isCMake', False) or cmake_input.get('isGenerated', False):
+                continue
+            path = cmake_input['path'] if os.path.isabs(cmake_input['path']) else f"{source_dir}/{cmake_input['path']}"
+            inputs.append(commons.normalize_path(path))
+    return inputs
+
+def _save_configure_state(config: Config, fingerprint: dict):
+    files: dict[str, list] = {}
+    for path in _read_file_api_inputs(get_config_files_path(config)):
+        if os.path.isfile(path):
+            path_stat = os.stat(path)
+            files[path] = [path_stat.st_mtime_ns, path_stat.st_size, cache.file_sha256(path)]
+    with open(_get_configure_state_path(config), "w", encoding="UTF-8") as file:
+        json.dump({'fingerprint': fingerprint, 'files': files}, file, indent=4)
+
+def _get_fingerprint_change(previous: dict, current: dict) -> str | None:
+    if previous.get('cmake') != current['cmake']:
+        return "cmake executable changed"
+    if previous.get('toolchain') != current['toolchain']:
+        return "toolchain file changed"
+    if previous.get('project_include') != current['project_include']:
+        return "project include files changed"
+    changed_options = sorted(
+        key for key in set(previous.get('variables', {})) | set(current['variables']) | set(previous.get('direct_args', {})) | set(current['direct_args'])
+        if previous.get('variables', {}).get(key) != current['variables'].get(key)
+        or previous.get('direct_args', {}).get(key) != current['direct_args'].get(key)
+    )
+    if len(changed_options) > 0:
+        return f"options changed: {', '.join(changed_options)}"
+    return None
+
+def _get_files_change(files: dict[str, list]) -> str | None:
+    for path, (mtime_ns, size, sha256) in files.items():
+        if not os.path.isfile(path):
+            return f"'{path}' was removed"
+        path_stat = os.stat(path)
+        if path_stat.st_mtime_ns == mtime_ns and path_stat.st_size == size:
+            continue
+        # Touched files with unchanged contents don't count
+        if path_stat.st_size != size or cache.file_sha256(path) != sha256:
+            return f"'{path}' changed"
+    return None
+
+def get_configure_change(
     config: Config,
     toolset_config: config.BuildToolsConfig,
     vcpkg_dependencies: list[str] | None = None
+) -> str | None:
+    # Reason why configuration has to run, None when the last one is up to date
+    state_path = _get_configure_state_path(config)
+    if not os.path.exists(f'{get_config_files_path(config)}/CMakeCache.txt') or not os.path.exists(state_path):
+        return "no previous configuration"
+    with open(state_path, "r", encoding="UTF-8") as file:
+        state = json.load(file)
+    options = generate_configure_options(config, toolset_config, vcpkg_dependencies)
+    return _get_fingerprint_change(state['fingerprint'], _get_configure_fingerprint(options, toolset_config)) or _get_files_change(state['files'])
+
+@trace.traced("cmake.configure")
+def configure(
+    config: Config,
+    toolset_config: config.BuildToolsConfig,
+    vcpkg_dependencies: list[str] | None = None,
+    force: bool = False
 ):
-    log.info(f"Configuring project for '{config.build_mode}'")
+    modes = config.build_mode if config.multi_config_types is None else ', '.join(config.multi_config_types)
+    change = "forced" if force else get_configure_change(config, toolset_config, vcpkg_dependencies)
+    if change is None:
+        log.info(f"Configuration for '{modes}' is up to date, skipping it")
+        return
+    log.info(f"Configuring project for '{modes}' ({change})")
     os.makedirs(config.build_dir, exist_ok=True)
     command = [toolset_config.cmake_exe]
 
     options = generate_configure_options(config, toolset_config, vcpkg_dependencies)
+    write_configure_files(config, toolset_config)
     for key, value in options.direct_args.items():
         command += [key, value]
     for key, value in options.variables.items():
         command += [f'{key}={value}']
+    _write_file_api_query(get_config_files_path(config))
     commons.execute_process(command, config.build_dir)
-
-def build_project(config: Config, toolset_config: config.BuildToolsConfig):
-    log.info(f"Building project for '{config.build_mode}'")
+    _save_configure_state(config, _get_configure_fingerprint(options, toolset_config))
+
+def _get_parallel_args(toolset_config: config.BuildToolsConfig) -> list[str]:
+    active_jobserver = jobserver.get_active()
+    if active_jobserver is None:
+        return ["--parallel", str(resources.get_job_count(toolset_config.workspace_dir, resources.PROJECT))]
+    if toolset_config.ninja_exe is None:
+        # Make joins jobserver from MAKEFLAGS, Visual Studio knows nothing about it
+        return ["--parallel", str(active_jobserver.jobs)] if commons.is_windows() else []
+    if jobserver.is_ninja_client(toolset_config.ninja_exe):
+        return []
+    # Load limit keeps older ninja from oversubscribing machine shared with other builds
+    return ["--parallel", str(active_jobserver.jobs), "--", "-l", str(active_jobserver.jobs)]
+
+@trace.traced("cmake.build_project")
+def build_project(config: Config, toolset_config: config.BuildToolsConfig, clean_first: bool = False):
+    modes = config.build_mode if config.multi_config_types is None else ', '.join(config.multi_config_types)
+    log.info(f"Building project for '{modes}'")
 
     os.makedirs(config.build_dir, exist_ok=True)
     command = [
         toolset_config.cmake_exe,
         "--build", ".",
-        "--config", config.build_mode
+        "--config", config.build_mode,
     ]
-    commons.execute_process(command, get_config_files_path(config))
-
+    if config.multi_config_types is not None:
+        # One ninja run schedules all configurations together, they share .ninja_log so they can't run apart
+        command += ["--target"] + [f"all:{multi_config_type}" for multi_config_type in config.multi_config_types]
+    if clean_first:
+        command += ["--clean-first"]
+    command += _get_parallel_args(toolset_config)
+    stats_offset = compiler_cache.get_stats_offset(toolset_config.workspace_dir)
+    result = commons.run_process(command, get_config_files_path(config))
+    resources.record_peak_rss(toolset_config.workspace_dir, resources.PROJECT, result.peak_rss)
+    if compiler_cache.is_builtin_launcher_used(toolset_config.workspace_dir):
+        compiler_cache.log_stats(toolset_config.workspace_dir, stats_offset)
+        compiler_cache.evict(toolset_config.workspace_dir)
+
+@trace.traced("cmake.delete_cache")
 def delete_cache(config: Config):
     log.info(f"Deleting project cache for '{config.build_mode}'")
     path = get_config_files_path(config)
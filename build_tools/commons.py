@@ -1,10 +1,16 @@
 import os
-import subprocess
 import re
 import platform
+import contextlib
 import functools
+import stat
+import threading
+import time
+import typing
 
+from . import jobserver
 from . import log
+from . import process
 
 
 def normalize_path(path: str) -> str:
@@ -16,27 +22,29 @@ def realpath(path: str) -> str:
     path = os.path.realpath(path)
     return normalize_path(path)
 
-def _execute_process_or_command(command: str | list[str], cwd: str, env = None, return_stdout: bool = False):
+def get_github_url() -> str:
+    # All tools are downloaded from github releases. BUILD_TOOLS_GITHUB_URL lets you
+    # point it at mirror (or local http server serving the same paths)
+    return os.environ.get('BUILD_TOOLS_GITHUB_URL', 'https://github.com').rstrip('/')
+
+def _run_process_or_command(command: str | list[str], cwd: str, env = None, capture_stdout: bool = False, keep_stdout: bool = False) -> process.ProcessResult:
+    # Thin wrapper over process runner, keeps log and exit on failure behaviour
     cwd = realpath(cwd)
 
     command_log_string = command if type(command) == str else ' '.join(command)
     log.info(f"Executing: {command_log_string} | CWD: {cwd}")
 
-    process = subprocess.run(
-        args = command, 
-        cwd = cwd, 
-        shell = type(command) == str, 
-        env = env, 
-        stdout = subprocess.PIPE if return_stdout else None
-    )
-    if process.returncode != 0:
-        log.info(f"Command: {command_log_string} failed with code: {process.returncode}")
-        exit(process.returncode)
+    try:
+        return process.run(process.Command(command, cwd, jobserver.apply(env), capture_stdout=capture_stdout, keep_stdout=keep_stdout))
+    except process.ProcessError as error:
+        log.info(f"Command: {command_log_string} failed with code: {error.result.exit_code}")
+        exit(error.result.exit_code)
+
+def _execute_process_or_command(command: str | list[str], cwd: str, env = None, return_stdout: bool = False):
+    result = _run_process_or_command(command, cwd, env, return_stdout)
     if return_stdout == False:
         return None
-    if process.stdout is None:
-        return ""
-    return process.stdout.decode("utf-8")
+    return result.stdout
 
 def execute_command(command: str, cwd: str, env = None, return_stdout: bool = False):
     if not os.path.isdir(cwd): log.error("commons.execute_command(): 'cwd' must be a directory"); exit(-1)
@@ -46,6 +54,11 @@ def execute_process(command: list[str], cwd: str, env = None, return_stdout: boo
     if not os.path.isdir(cwd): log.error("commons.execute_process(): 'cwd' must be a directory"); exit(-1)
     return _execute_process_or_command(command, cwd, env, return_stdout)
 
+def run_process(command: list[str], cwd: str, env = None, keep_stdout: bool = False) -> process.ProcessResult:
+    # execute_process() that returns measurements (times, peak RSS) of the process, with keep_stdout its echoed output too
+    if not os.path.isdir(cwd): log.error("commons.run_process(): 'cwd' must be a directory"); exit(-1)
+    return _run_process_or_command(command, cwd, env, keep_stdout=keep_stdout)
+
 def delete_dir(dir_path: str, suppress_output: bool = True):
     if not os.path.isdir(dir_path): log.error(f"commons.delete_dir(): dir_path: '{dir_path}' is not a directory"); exit(-1)
 
@@ -58,6 +71,33 @@ def delete_dir(dir_path: str, suppress_output: bool = True):
         command += [f'rm -rf "{dir_path}"']
     execute_command(' && '.join(command), cwd=os.path.dirname(dir_path))
 
+def remove_tree(dir_path: str):
+    # In-process rm -rf. Symlinks are removed, never followed
+    with os.scandir(dir_path) as iterator:
+        entries = list(iterator)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            remove_tree(entry.path)
+            continue
+        try:
+            os.unlink(entry.path)
+        except PermissionError:
+            # Read-only files cannot be removed on windows
+            os.chmod(entry.path, stat.S_IWRITE)
+            os.unlink(entry.path)
+    os.rmdir(dir_path)
+
+def remove_tree_in_background(dir_path: str) -> threading.Thread:
+    # Daemon thread, whatever is left at exit is removed by the next cleanup
+    def _remove():
+        try:
+            remove_tree(dir_path)
+        except OSError as error:
+            log.warn(f"Background removal of '{dir_path}' failed: {error}")
+    thread = threading.Thread(target=_remove, name=f"remove-{os.path.basename(dir_path)}", daemon=True)
+    thread.start()
+    return thread
+
 def rename_dir(source_dir_path: str, target_dir_name: str):
     if not os.path.isdir(source_dir_path): log.error(f"commons.rename_dir(): source_dir_path: {source_dir_path} is not a directory"); exit(-1)
     # Some checks to avoid problems, not full check as no idea how
@@ -80,3 +120,38 @@ def is_windows() -> bool:
 @functools.cache
 def is_linux() -> bool:
     return platform.system() == "Linux"
+
+@contextlib.contextmanager
+def file_lock(lock_path: str, description: str) -> typing.Iterator[None]:
+    # Exclusive lock shared by processes, released by the system when holder dies
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a+b") as file:
+        if is_windows():
+            import msvcrt
+            file.seek(0)
+            waiting_logged = False
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1) # type: ignore
+                    break
+                except OSError:
+                    if not waiting_logged:
+                        log.info(f"Waiting for {description} locked by another process ('{lock_path}')")
+                        waiting_logged = True
+                    time.sleep(0.5)
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1) # type: ignore
+            return
+        import fcntl
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.info(f"Waiting for {description} locked by another process ('{lock_path}')")
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,157 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from . import commons
+from . import log
+from . import _compiler_cache_launcher
+
+"""
+Compiler cache used as CMAKE_<LANG>_COMPILER_LAUNCHER.
+
+Launcher is set by cmake file in project include dir (see
+cmake.get_project_include_dir()), after project() detected compilers, only for
+gcc/clang style ones. cl.exe and clang-cl (MSVC frontend) are run directly.
+
+ccache or sccache is used when found on PATH or in workspace (WORKSPACE_DIR/ccache,
+WORKSPACE_DIR/sccache). Otherwise builtin launcher (_compiler_cache_launcher.py)
+caches object files in WORKSPACE_DIR/compiler_cache, capped to
+BUILD_TOOLS_COMPILER_CACHE_MAX_SIZE_MB (default 5120).
+
+BUILD_TOOLS_COMPILER_CACHE selects launcher: 'auto' (default), 'builtin' or 'off'.
+"""
+
+_DEFAULT_MAX_SIZE_MB = 5120
+_EXTERNAL_LAUNCHERS = ['ccache', 'sccache']
+
+def _get_mode() -> str:
+    mode = os.environ.get('BUILD_TOOLS_COMPILER_CACHE', 'auto').lower()
+    if mode not in ['auto', 'builtin', 'off']:
+        log.warn(f"Unknown BUILD_TOOLS_COMPILER_CACHE value '{mode}'. Using 'auto'.")
+        return 'auto'
+    return mode
+
+def get_cache_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/compiler_cache'
+
+def _get_max_size() -> int:
+    return int(os.environ.get('BUILD_TOOLS_COMPILER_CACHE_MAX_SIZE_MB', _DEFAULT_MAX_SIZE_MB)) * 1024 * 1024
+
+def _get_stats_path(workspace_dir: str) -> str:
+    return f'{get_cache_dir(workspace_dir)}/{_compiler_cache_launcher.STATS_FILE_NAME}'
+
+def find_external_launcher(workspace_dir: str) -> str | None:
+    exe_ext = ".exe" if commons.is_windows() else ""
+    for name in _EXTERNAL_LAUNCHERS:
+        workspace_exe = f'{workspace_dir}/{name}/{name}{exe_ext}'
+        if os.path.exists(workspace_exe):
+            return workspace_exe
+        system_exe = shutil.which(name)
+        if system_exe is not None:
+            return commons.normalize_path(system_exe)
+    return None
+
+def is_builtin_launcher_used(workspace_dir: str) -> bool:
+    mode = _get_mode()
+    return mode == 'builtin' or (mode == 'auto' and find_external_launcher(workspace_dir) is None)
+
+def get_launcher(workspace_dir: str) -> list[str] | None:
+    mode = _get_mode()
+    if mode == 'off':
+        return None
+    if mode == 'auto':
+        external_launcher = find_external_launcher(workspace_dir)
+        if external_launcher is not None:
+            return [external_launcher]
+    launcher_script = commons.normalize_path(os.path.abspath(_compiler_cache_launcher.__file__))
+    return [commons.normalize_path(sys.executable), launcher_script, get_cache_dir(workspace_dir)]
+
+def _get_launcher_include_lines(launcher: list[str]) -> list[str]:
+    launcher_args = ' '.join(f'"{arg}"' for arg in launcher)
+    return [
+        '# Generated by build_tools (compiler_cache.py), do not edit',
+        'foreach(_build_tools_language IN ITEMS C CXX)',
+        '    if(NOT DEFINED CMAKE_${_build_tools_language}_COMPILER_ID)',
+        '        continue()',
+        '    endif()',
+        '    if(CMAKE_${_build_tools_language}_COMPILER_ID STREQUAL "MSVC" OR CMAKE_${_build_tools_language}_COMPILER_FRONTEND_VARIANT STREQUAL "MSVC")',
+        '        continue()',
+        '    endif()',
+        f'    set(CMAKE_${{_build_tools_language}}_COMPILER_LAUNCHER {launcher_args})',
+        'endforeach()',
+    ]
+
+def get_launcher_include(workspace_dir: str) -> str | None:
+    # Content of cmake file setting the launcher, None when there is no launcher
+    launcher = get_launcher(workspace_dir)
+    if launcher is None:
+        return None
+    return '\n'.join(_get_launcher_include_lines(launcher)) + '\n'
+
+def write_launcher_include(include_path: str, workspace_dir: str):
+    # Rewritten only when changed, modes configured at once write the same content
+    content = get_launcher_include(workspace_dir)
+    if content is None:
+        if os.path.exists(include_path):
+            os.remove(include_path)
+        return
+    if os.path.exists(include_path):
+        with open(include_path, "r", encoding="UTF-8") as file:
+            if file.read() == content:
+                return
+    os.makedirs(os.path.dirname(include_path), exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(include_path), suffix='.tmp', delete=False, encoding="UTF-8") as file:
+        file.write(content)
+    os.replace(file.name, include_path)
+
+def get_stats_offset(workspace_dir: str) -> int:
+    # Position in stats file, pass it to log_stats() to get stats of compilations made since then
+    stats_path = _get_stats_path(workspace_dir)
+    return os.path.getsize(stats_path) if os.path.exists(stats_path) else 0
+
+def log_stats(workspace_dir: str, since_offset: int = 0):
+    stats_path = _get_stats_path(workspace_dir)
+    if not os.path.exists(stats_path):
+        return
+    with open(stats_path, 'rb') as file:
+        file.seek(since_offset)
+        stats = file.read()
+    hits = stats.count(_compiler_cache_launcher.STAT_HIT)
+    misses = stats.count(_compiler_cache_launcher.STAT_MISS)
+    uncacheable = stats.count(_compiler_cache_launcher.STAT_UNCACHEABLE)
+    errors = stats.count(_compiler_cache_launcher.STAT_ERROR)
+    cacheable = hits + misses
+    if cacheable + uncacheable + errors == 0:
+        return
+    hit_rate = hits / cacheable * 100 if cacheable > 0 else 0.0
+    log.info(f"Compiler cache: {hits} hits, {misses} misses ({hit_rate:.1f}% hit rate), {uncacheable} uncacheable, {errors} errors")
+
+def evict(workspace_dir: str, max_size: int | None = None):
+    # Least recently used entries go first, hits touch entry directory
+    max_size = _get_max_size() if max_size is None else max_size
+    entries_dir = f'{get_cache_dir(workspace_dir)}/{_compiler_cache_launcher.ENTRIES_DIR_NAME}'
+    if not os.path.isdir(entries_dir):
+        return
+    entries: list[tuple[float, int, str]] = []
+    total_size = 0
+    for bucket in os.scandir(entries_dir):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if not entry.is_dir():
+                continue
+            entry_size = sum(file.stat().st_size for file in os.scandir(entry.path) if file.is_file())
+            entries.append((entry.stat().st_mtime, entry_size, entry.path))
+            total_size += entry_size
+    if total_size <= max_size:
+        return
+    entries.sort()
+    removed_count = 0
+    for _, entry_size, entry_path in entries:
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_size -= entry_size
+        removed_count += 1
+    log.info(f"Compiler cache: evicted {removed_count} entries, {total_size / (1024 * 1024):.0f} MiB left")
@@ -1,14 +1,20 @@
 import configparser
+import json
 import os
-import zipfile
 import platform
 import shutil
-import urllib.request
-import tarfile
+import threading
 
+from . import archive
+from . import cache
 from . import log
 from . import commons
+from . import install
+from . import jobserver
+from . import process
 from . import config
+from . import resources
+from . import trace
 
 """
 conan default structure for this configuration looks like this:
@@ -25,8 +31,21 @@ LINUX:
         - bin/
             - internal
             - conan
+
+With BUILD_TOOLS_CONAN_SHARED_CACHE=ON package storage (packages and their
+database) of every workspace is moved to CACHE_DIR/conan/storage (see
+cache.get_cache_dir()) through core.cache:storage_path of global.conf, so
+packages built with '--build missing' by one project are reused by others.
+Profiles, settings and install outputs stay in conan home of the workspace.
+Conan cache is not safe for concurrent use, installs hold file lock of
+storage, parallel runs in different workspaces wait for each other.
 """
 
+_SHARED_CACHE_CONF = 'core.cache:storage_path'
+
+# Modes built at once install one by one, before any of them waits for file lock of storage
+_conan_cache_lock = threading.Lock()
+
 def _conan_2_23_0_get_exec_path(workspace_dir: str) -> str:
     if commons.is_windows():
         return f'{workspace_dir}/conan/conan.exe'
@@ -40,27 +59,15 @@ def _conan_2_23_0_download(workspace_dir: str) -> str:
 
     system_string = "windows" if commons.is_windows() else "linux"
     archive_ext = "zip" if commons.is_windows() else "tgz"
-    link = f"https://github.com/conan-io/conan/releases/download/2.23.0/conan-2.23.0-{system_string}-x86_64.{archive_ext}"
+    link = f"{commons.get_github_url()}/conan-io/conan/releases/download/2.23.0/conan-2.23.0-{system_string}-x86_64.{archive_ext}"
     extract_path = f'{workspace_dir}/conan'
-    archive_path = f'{workspace_dir}/conan-2.23.0.{archive_ext}'
 
-    if os.path.exists(extract_path):
-        log.info("Previous conan download exists. Deleting...")
-        commons.delete_dir(extract_path)
-
-    log.info("Downloading conan...")
-    urllib.request.urlretrieve(link, archive_path)
-    log.info("Conan downloaded")
-
-    log.info("Unpacking conan...")
-    if platform.system() == "Windows":  
-        with zipfile.ZipFile(archive_path, 'r') as zip_file:
-            zip_file.extractall(extract_path)
-    else:
-        with tarfile.open(archive_path, 'r:gz') as tar_file:
-            tar_file.extractall(extract_path)
+    exec_relative_path = 'conan.exe' if commons.is_windows() else 'bin/conan'
 
-    log.info("Conan unpacked")
+    log.info("Downloading and unpacking conan...")
+    with install.staged_install(workspace_dir, extract_path, [exec_relative_path]) as staging_dir:
+        archive.stream_extract(link, staging_dir, archive_ext)
+    log.info("Conan downloaded and unpacked")
     return f'{extract_path}'
 
 def _get_conan_home(workspace_dir: str) -> str:
@@ -72,13 +79,51 @@ def _get_conan_profiles_path(workspace_dir: str) -> str:
 def _get_conan_dependencies_path(workspace_dir: str) -> str:
     return f'{_get_conan_home(workspace_dir)}/dependencies'
 
-def _execute_process(command: list[str], project_dir: str, workspace_dir: str, ninja_exe: str | None = None):
+def _is_shared_cache_enabled() -> bool:
+    return os.environ.get('BUILD_TOOLS_CONAN_SHARED_CACHE', 'OFF').upper() in ['ON', '1', 'TRUE']
+
+def _get_shared_storage_path() -> str | None:
+    if not _is_shared_cache_enabled():
+        return None
+    cache_dir = cache.get_cache_dir()
+    if cache_dir is None:
+        log.warn("BUILD_TOOLS_CONAN_SHARED_CACHE is set, but build_tools cache is disabled. Conan cache stays in workspace.")
+        return None
+    return f'{cache_dir}/conan/storage'
+
+def _get_storage_lock_path(workspace_dir: str) -> str:
+    storage_path = _get_shared_storage_path()
+    return f'{_get_conan_home(workspace_dir) if storage_path is None else storage_path}/.build_tools.lock'
+
+def _write_storage_conf(workspace_dir: str):
+    # Only storage line of global.conf is managed, everything else in it is left as is
+    global_conf_path = f'{_get_conan_home(workspace_dir)}/global.conf'
+    lines: list[str] = []
+    if os.path.exists(global_conf_path):
+        with open(global_conf_path, "r", encoding="UTF-8") as file:
+            lines = [line for line in file.read().splitlines() if not line.strip().startswith(_SHARED_CACHE_CONF)]
+    storage_path = _get_shared_storage_path()
+    if storage_path is not None:
+        lines.append(f'{_SHARED_CACHE_CONF}={storage_path}')
+    content = ''.join(f'{line}\n' for line in lines)
+    if os.path.exists(global_conf_path):
+        with open(global_conf_path, "r", encoding="UTF-8") as file:
+            if file.read() == content:
+                return
+    elif content == '':
+        return
+    os.makedirs(_get_conan_home(workspace_dir), exist_ok=True)
+    with open(global_conf_path, "w", encoding="UTF-8") as file:
+        file.write(content)
+
+def _execute_process(command: list[str], project_dir: str, workspace_dir: str, ninja_exe: str | None = None) -> process.ProcessResult:
+    _write_storage_conf(workspace_dir)
     env = os.environ.copy()
     env['CONAN_HOME'] = _get_conan_home(workspace_dir)
     if ninja_exe is not None:
         # Value of type variable "AnyOrLiteralStr" of "dirname" cannot be "str | None". REASON: But it can actually.
         env['PATH'] = os.path.dirname(ninja_exe) + os.pathsep + env['PATH'] # type: ignore
-    commons.execute_process(command, project_dir, env)
+    return commons.run_process(command, project_dir, env)
 
 def download_conan(workspace_dir: str) -> str:
     return _conan_2_23_0_download(workspace_dir)
@@ -87,24 +132,62 @@ def is_conan_systemwide_installed() -> bool:
     return shutil.which("conan") is not None
 
 def is_conan_in_workspace_toolset(workspace_dir: str) -> bool:
-    return os.path.exists(_conan_2_23_0_get_exec_path(workspace_dir))
+    return install.is_installed(f'{workspace_dir}/conan')
 
 def get_toolset_conan_exe_path(workspace_dir: str) -> str:
     return _conan_2_23_0_get_exec_path(workspace_dir)
 
-def get_toolchain_filepath(mode: str, workspace_dir: str, ninja_generator: bool = True) -> str:
-    file_path = f'{_get_conan_dependencies_path(workspace_dir)}/{mode.lower()}/build'
-    if not commons.is_windows() or ninja_generator:
+def _get_output_folder(mode: str, workspace_dir: str, multi_config: bool = False) -> str:
+    # Multi config installs of all modes share one folder, its toolchain and CMakeDeps files cover all of them
+    return f'{_get_conan_dependencies_path(workspace_dir)}/{"multi" if multi_config else mode.lower()}'
+
+def get_toolchain_filepath(mode: str, workspace_dir: str, ninja_generator: bool = True, multi_config: bool = False) -> str:
+    file_path = f'{_get_output_folder(mode, workspace_dir, multi_config)}/build'
+    if not multi_config and (not commons.is_windows() or ninja_generator):
         file_path += f'/{mode.capitalize()}'
     return f'{file_path}/generators/conan_toolchain.cmake'
 
+def _get_exe_identity(exe: str) -> list:
+    # Changes with every conan or cmake update, without running them
+    exe_path = shutil.which(exe) or exe
+    exe_stat = os.stat(exe_path)
+    return [commons.realpath(exe_path), exe_stat.st_size, exe_stat.st_mtime_ns]
+
+def _get_files_fingerprint(paths: list[str]) -> dict[str, str | None]:
+    return {path: cache.file_sha256(path) if os.path.isfile(path) else None for path in paths}
+
+def _read_fingerprint(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="UTF-8") as file:
+        return json.load(file)
+
+def _write_fingerprint(path: str, fingerprint: dict):
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(fingerprint, file, indent=4)
+
+def _get_profiles_fingerprint(config: config.BuildToolsConfig) -> dict:
+    assert(config.conan_exe is not None)
+    return {
+        'conan': _get_exe_identity(config.conan_exe),
+        'cmake': config.cmake_exe,
+        'ninja': config.is_ninja_set(),
+    }
+
+@trace.traced("conan.create_profiles")
 def create_profiles(config: config.BuildToolsConfig):
     if config.conan_exe is None: log.error("conan.create_profiles(): config.conan_exe must be set"); exit(-1)
-    
-    _execute_process([f"{config.conan_exe}", "profile", "detect", "--force"], config.project_dir, config.workspace_dir)
 
     conan_profiles_path = _get_conan_profiles_path(config.workspace_dir)
+    fingerprint_path = f'{conan_profiles_path}/build_tools_profiles.json'
+    fingerprint = _get_profiles_fingerprint(config)
+    profiles_exist = all(os.path.exists(f'{conan_profiles_path}/{name}') for name in ['default', 'debug', 'release'])
+    if profiles_exist and _read_fingerprint(fingerprint_path) == fingerprint:
+        log.info("Conan profiles are up to date, skipping profile detection")
+        return
     
+    _execute_process([f"{config.conan_exe}", "profile", "detect", "--force"], config.project_dir, config.workspace_dir)
+
     conan_profile = configparser.ConfigParser()
     conan_profile.read(f'{conan_profiles_path}/default')
 
@@ -122,15 +205,61 @@ def create_profiles(config: config.BuildToolsConfig):
     conan_profile['settings']['build_type'] = "Debug"
     with open(f'{conan_profiles_path}/debug', "w", encoding="UTF-8") as file:
         conan_profile.write(file)
+    _write_fingerprint(fingerprint_path, fingerprint)
+
+def _get_install_fingerprint(config: config.BuildToolsConfig, install_args: list[str], lockfile_path: str) -> dict:
+    assert(config.conan_exe is not None)
+    profiles_path = _get_conan_profiles_path(config.workspace_dir)
+    return {
+        'args': install_args,
+        'conan': _get_exe_identity(config.conan_exe),
+        # Packages of other storage are not there
+        'storage': _get_shared_storage_path(),
+        'files': _get_files_fingerprint([
+            f'{config.project_dir}/conanfile.txt',
+            f'{config.project_dir}/conanfile.py',
+            f'{config.project_dir}/conan.lock',
+            # Host profile and default one, which is build profile
+            f'{profiles_path}/{config.build_mode.lower()}',
+            f'{profiles_path}/default',
+            lockfile_path,
+        ]),
+    }
 
-def download_dependencies(config: config.BuildToolsConfig):
+@trace.traced("conan.download_dependencies")
+def download_dependencies(config: config.BuildToolsConfig, multi_config: bool = False, force: bool = False, job_share: float = 1.0):
     if config.conan_exe is None: log.error("conan.download_dependencies(): config.conan_exe must be set"); exit(-1)
 
-    _execute_process([
-        config.conan_exe,
+    # Install is skipped when conanfile, profiles, conan and lockfile written by the last install are unchanged.
+    # Multi config installs of all modes share output folder, fingerprint is kept per mode
+    output_folder = _get_output_folder(config.build_mode, config.workspace_dir, multi_config)
+    lockfile_path = f'{output_folder}/build_tools_{config.build_mode.lower()}.lock'
+    fingerprint_path = f'{output_folder}/build_tools_install_{config.build_mode.lower()}.json'
+    install_args = [
         f'install',
         f'.',
         f'--build', 'missing',
         f'--profile', config.build_mode.lower(),
-        f'--output-folder', f'{_get_conan_dependencies_path(config.workspace_dir)}/{config.build_mode.lower()}',
-    ], config.project_dir, config.workspace_dir, config.ninja_exe)
+        f'--output-folder', output_folder,
+        f'--lockfile-out', lockfile_path,
+        *(['--conf', 'tools.cmake.cmaketoolchain:generator=Ninja Multi-Config'] if multi_config else []),
+    ]
+    toolchain_path = get_toolchain_filepath(config.build_mode, config.workspace_dir, config.is_ninja_set(), multi_config)
+    if not force and os.path.exists(toolchain_path) and _read_fingerprint(fingerprint_path) == _get_install_fingerprint(config, install_args, lockfile_path):
+        log.info(f"Conan dependencies for '{config.build_mode}' are up to date, skipping install")
+        return
+
+    # Job count is not part of profiles, it would change them (and fingerprint) with every change of free memory.
+    # With jobserver 0 means no explicit job count, builds draw jobs from jobserver
+    # (vcpkg running alongside reserves its jobs there). Without it share of budget is explicit
+    if jobserver.get_active() is not None:
+        jobs = 0
+    else:
+        jobs = max(int(resources.get_job_count(config.workspace_dir, resources.CONAN) * job_share), 1)
+    with _conan_cache_lock, commons.file_lock(_get_storage_lock_path(config.workspace_dir), "conan cache"):
+        result = _execute_process(
+            [config.conan_exe, *install_args, '--conf', f'tools.build:jobs={jobs}'],
+            config.project_dir, config.workspace_dir, config.ninja_exe
+        )
+    resources.record_peak_rss(config.workspace_dir, resources.CONAN, result.peak_rss)
+    _write_fingerprint(fingerprint_path, _get_install_fingerprint(config, install_args, lockfile_path))
@@ -0,0 +1,337 @@
+import contextlib
+import http.client
+import os
+import threading
+import time
+import typing
+import urllib.parse
+import urllib.request
+
+from . import log
+from . import trace
+
+"""
+HTTP downloader used by every tool module instead of urllib.request.urlretrieve.
+
+- connections are kept alive and reused per host (github redirects every
+  download to its asset host, so all downloads end up on the same connection)
+- dropped transfers are resumed with HTTP Range from the last received byte,
+  guarded with If-Range (ETag or Last-Modified of the first response), so
+  content that changed upstream is never spliced with the old one
+- partial files (<file>.part with validator in <file>.part.validator) are
+  resumed by the next run, or restarted when url content changed since
+- failed requests are retried with exponential backoff
+- time to first byte and throughput of every download are logged
+
+Proxies from environment (https_proxy, http_proxy, no_proxy) are honored.
+"""
+
+_MAX_REDIRECTS = 10
+_MAX_ATTEMPTS = 6
+_BACKOFF_START_SECONDS = 0.5
+_BACKOFF_MAX_SECONDS = 16.0
+_TIMEOUT_SECONDS = 60.0
+_COPY_CHUNK_SIZE = 1024 * 1024
+_RETRYABLE_STATUSES = [408, 429, 500, 502, 503, 504]
+_REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+
+_ConnectionKey = tuple[str, str, int]
+
+class _ConnectionPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle: dict[_ConnectionKey, list[http.client.HTTPConnection]] = {}
+
+    def acquire(self, scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            if len(idle) > 0:
+                return idle.pop()
+        return _create_connection(scheme, host, port)
+
+    def release(self, scheme: str, host: str, port: int, connection: http.client.HTTPConnection):
+        with self._lock:
+            self._idle.setdefault((scheme, host, port), []).append(connection)
+
+_pool = _ConnectionPool()
+
+def _create_connection(scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+    proxy = None if urllib.request.proxy_bypass(host) else urllib.request.getproxies().get(scheme)
+    if proxy is None:
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=_TIMEOUT_SECONDS)
+        return http.client.HTTPConnection(host, port, timeout=_TIMEOUT_SECONDS)
+
+    proxy_url = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+    proxy_port = proxy_url.port or 80
+    if scheme == "https":
+        connection = http.client.HTTPSConnection(proxy_url.hostname, proxy_port, timeout=_TIMEOUT_SECONDS)
+        connection.set_tunnel(host, port)
+        return connection
+    return _PlainProxyConnection(proxy_url.hostname, proxy_port, timeout=_TIMEOUT_SECONDS)
+
+class _PlainProxyConnection(http.client.HTTPConnection):
+    # Plain http through proxy just sends absolute url as request target
+    pass
+
+def _error_log_and_die(msg: str) -> typing.NoReturn:
+    log.error(msg)
+    exit(-1)
+
+class _RetryableError(Exception):
+    pass
+
+def _get_validator(response: http.client.HTTPResponse) -> str | None:
+    # Weak ETags can't be used in If-Range
+    etag = response.getheader("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return response.getheader("Last-Modified")
+
+class ResumableStream:
+    """
+    Readable stream of url content. Broken transfer is transparently resumed
+    from current offset, so reader sees one continuous stream of bytes.
+    """
+
+    def __init__(self, url: str, offset: int = 0, validator: str | None = None, max_attempts: int = _MAX_ATTEMPTS):
+        # Offset is resumed only with validator (ETag or Last-Modified) of content received so far
+        self.url = url
+        self.total_size: int | None = None
+        self.validator = validator
+        offset = offset if validator is not None else 0
+        self._offset = offset
+        self._start_offset = offset
+        self._max_attempts = max_attempts
+        self._attempt = 0
+        self._retries = 0
+        self._response: http.client.HTTPResponse | None = None
+        self._connection: tuple[str, str, int, http.client.HTTPConnection] | None = None
+        self._start_time = time.perf_counter()
+        self._first_byte_time: float | None = None
+        self._finished = False
+        self._connect_with_retries()
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    def _backoff(self, reason: str):
+        self._attempt += 1
+        self._retries += 1
+        if self._attempt >= self._max_attempts:
+            _error_log_and_die(f"Downloading '{self.url}' failed after {self._attempt} attempts. Last error: {reason}")
+        delay = min(_BACKOFF_START_SECONDS * (2 ** (self._attempt - 1)), _BACKOFF_MAX_SECONDS)
+        log.warn(f"Download of '{self.url}' interrupted at {self._offset} bytes ({reason}). Retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+    def _drop_connection(self):
+        if self._connection is not None:
+            self._connection[3].close()
+        self._connection = None
+        self._response = None
+
+    def _connect_with_retries(self):
+        while True:
+            try:
+                self._connect()
+                return
+            except (_RetryableError, OSError, http.client.HTTPException) as error:
+                self._drop_connection()
+                self._backoff(str(error))
+
+    def _connect(self):
+        url = self.url
+        for _ in range(_MAX_REDIRECTS):
+            split_url = urllib.parse.urlsplit(url)
+            scheme = split_url.scheme
+            port = split_url.port or (443 if scheme == "https" else 80)
+            host = split_url.hostname or ""
+            connection = _pool.acquire(scheme, host, port)
+
+            target = url if isinstance(connection, _PlainProxyConnection) else urllib.parse.urlunsplit(("", "", split_url.path or "/", split_url.query, ""))
+            headers = {"User-Agent": "build_tools", "Accept-Encoding": "identity"}
+            if self._offset > 0:
+                headers["Range"] = f"bytes={self._offset}-"
+                if self.validator is not None:
+                    # Full content (200) instead of range when it changed
+                    headers["If-Range"] = self.validator
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException):
+                # Reused keep-alive connection could have been closed by server in the meantime
+                connection.close()
+                raise
+            if self._first_byte_time is None:
+                self._first_byte_time = time.perf_counter()
+
+            if response.status in _REDIRECT_STATUSES:
+                location = response.getheader("Location")
+                response.read()
+                _pool.release(scheme, host, port, connection)
+                if location is None:
+                    _error_log_and_die(f"Redirect without location while downloading '{self.url}'")
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if response.status in _RETRYABLE_STATUSES:
+                connection.close()
+                raise _RetryableError(f"HTTP {response.status} {response.reason}")
+            if response.status == 416:
+                content_range = response.getheader("Content-Range", "")
+                total = content_range[content_range.rfind('/') + 1:]
+                response.read()
+                _pool.release(scheme, host, port, connection)
+                if total.isdigit() and self._offset == int(total):
+                    # Everything was already received
+                    self.total_size = int(total)
+                    self._on_finished()
+                    return
+                _error_log_and_die(f"Server rejected resuming '{self.url}' from {self._offset} bytes. Remove partial file and try again.")
+            if response.status not in [200, 206]:
+                connection.close()
+                _error_log_and_die(f"Downloading '{self.url}' failed with HTTP {response.status} {response.reason}")
+
+            response_validator = _get_validator(response)
+            if response.status == 200:
+                length = response.getheader("Content-Length")
+                self.total_size = int(length) if length is not None else None
+                if self._offset > 0 and self.validator is not None and response_validator != self.validator:
+                    if self._offset != self._start_offset:
+                        connection.close()
+                        _error_log_and_die(f"'{self.url}' changed while it was downloaded. Try again.")
+                    # Partial content of previous run is stale, caller starts over from offset 0
+                    log.warn(f"'{self.url}' changed since it was partially downloaded. Downloading it again.")
+                    self._offset = 0
+                    self._start_offset = 0
+                elif self._offset > 0:
+                    # Server ignored range, skip what was already received
+                    log.warn(f"Server doesn't support resuming '{self.url}'. Skipping first {self._offset} bytes.")
+                    self._skip(response, self._offset)
+            else:
+                content_range = response.getheader("Content-Range", "")
+                total = content_range[content_range.rfind('/') + 1:]
+                self.total_size = int(total) if total.isdigit() else None
+            if self.validator is None:
+                self.validator = response_validator
+            self._response = response
+            self._connection = (scheme, host, port, connection)
+            return
+        _error_log_and_die(f"Too many redirects while downloading '{self.url}'")
+
+    @property
+    def start_offset(self) -> int:
+        # Offset the stream started from, 0 when partial content had to be dropped
+        return self._start_offset
+
+    def _skip(self, response: http.client.HTTPResponse, count: int):
+        while count > 0:
+            data = response.read(min(count, _COPY_CHUNK_SIZE))
+            if len(data) == 0:
+                raise _RetryableError("connection closed while skipping received data")
+            count -= len(data)
+
+    def _on_finished(self):
+        self._finished = True
+        if self._connection is not None:
+            scheme, host, port, connection = self._connection
+            if self._response is not None and not self._response.will_close:
+                _pool.release(scheme, host, port, connection)
+            else:
+                connection.close()
+        self._connection = None
+        self._response = None
+
+        end_time = time.perf_counter()
+        elapsed = end_time - self._start_time
+        received = self._offset - self._start_offset
+        ttfb = ((self._first_byte_time or self._start_time) - self._start_time) * 1000
+        speed = received / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+        log.info(
+            f"Downloaded '{self.url}': {received / (1024 * 1024):.2f} MiB in {elapsed:.2f}s "
+            f"({speed:.2f} MiB/s, TTFB {ttfb:.0f} ms, retries {self._retries})"
+        )
+        trace.add_span(
+            f"download {os.path.basename(urllib.parse.urlsplit(self.url).path)}", 'download', self._start_time, end_time,
+            {'url': self.url, 'bytes': received, 'ttfb_ms': round(ttfb), 'retries': self._retries}
+        )
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._finished:
+            try:
+                if self._response is None:
+                    raise _RetryableError("no connection")
+                data = self._response.read(size if size >= 0 else None)
+                if len(data) > 0:
+                    self._offset += len(data)
+                    self._attempt = 0
+                    if self.total_size is not None and self._offset >= self.total_size:
+                        self._response.read()
+                        self._on_finished()
+                    return data
+                if self.total_size is not None and self._offset < self.total_size:
+                    raise _RetryableError(f"connection closed after {self._offset} of {self.total_size} bytes")
+                self._on_finished()
+            except (_RetryableError, OSError, http.client.HTTPException) as error:
+                self._drop_connection()
+                self._backoff(str(error))
+                self._connect_with_retries()
+        return b''
+
+    def close(self):
+        if not self._finished:
+            self._drop_connection()
+            self._finished = True
+
+    def __enter__(self) -> "ResumableStream":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_url(url: str) -> ResumableStream:
+    return ResumableStream(url)
+
+def _get_validator_path(partial_path: str) -> str:
+    return f'{partial_path}.validator'
+
+def _read_partial_state(partial_path: str, url: str) -> tuple[int, str | None]:
+    # Size of partial file and validator of content it holds. Without validator it can't be resumed
+    validator_path = _get_validator_path(partial_path)
+    if not os.path.exists(partial_path) or not os.path.exists(validator_path):
+        return 0, None
+    with open(validator_path, "r", encoding="UTF-8") as file:
+        lines = file.read().splitlines()
+    if len(lines) != 2 or lines[0] != url:
+        return 0, None
+    return os.path.getsize(partial_path), lines[1]
+
+@contextlib.contextmanager
+def open_partial(url: str, partial_path: str) -> typing.Iterator[tuple[ResumableStream, typing.BinaryIO]]:
+    # Stream of url content from the end of partial file, and partial file to append it to.
+    # Interrupted partial file is kept and resumed by the next call, while url content is unchanged
+    os.makedirs(os.path.dirname(partial_path) or ".", exist_ok=True)
+    offset, validator = _read_partial_state(partial_path, url)
+    if offset > 0:
+        log.info(f"Resuming download of '{url}' from {offset} bytes")
+    validator_path = _get_validator_path(partial_path)
+    with ResumableStream(url, offset, validator) as stream:
+        if stream.validator is None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(validator_path)
+        else:
+            with open(validator_path, "w", encoding="UTF-8") as file:
+                file.write(f'{url}\n{stream.validator}\n')
+        with open(partial_path, 'ab' if stream.start_offset > 0 else 'wb') as partial_file:
+            yield stream, partial_file
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(validator_path)
+
+def download_file(url: str, file_path: str):
+    # Partially downloaded file is kept next to the target and resumed on next call
+    partial_path = f'{file_path}.part'
+    with open_partial(url, partial_path) as (stream, file):
+        while chunk := stream.read(_COPY_CHUNK_SIZE):
+            file.write(chunk)
+    os.replace(partial_path, file_path)
@@ -0,0 +1,148 @@
+import dataclasses
+import json
+import os
+import re
+import shlex
+
+from . import commons
+from . import config
+from . import log
+from . import process
+
+"""
+Include graph of the project, for passes that tune compilation (pch.py, unity.py).
+
+Two sources are used:
+- 'ninja -t deps' of the last build: every header (transitively) read by every
+  object file, exactly as compiler saw it
+- '#include' directives scanned from sources, when there was no build yet
+compile_commands.json (CMAKE_EXPORT_COMPILE_COMMANDS) maps objects to sources
+and gives compile commands to run preprocessor with.
+"""
+
+_INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"]+)[>"]', re.MULTILINE)
+_TARGET_PATTERN = re.compile(r'(?:^|/)CMakeFiles/([^/]+)\.dir/')
+_DEPS_HEADER_PATTERN = re.compile(r'^(?P<output>\S.*): #deps \d+, deps mtime \d+ \((?P<state>[A-Z]+)\)$')
+
+@dataclasses.dataclass(frozen=True)
+class Include:
+    name: str
+    is_angled: bool
+
+@dataclasses.dataclass(frozen=True)
+class CompileCommand:
+    directory: str
+    arguments: list[str]
+    source: str
+    output: str
+
+    @property
+    def target(self) -> str | None:
+        return get_target_of_object(self.output)
+
+def get_target_of_object(object_path: str) -> str | None:
+    # CMake puts objects of target into CMakeFiles/<target>.dir/
+    match = _TARGET_PATTERN.search(commons.normalize_path(object_path))
+    return None if match is None else match.group(1)
+
+def scan_includes(source_path: str) -> list[Include]:
+    # Conditional includes are taken as well, it's scan, not preprocessing
+    with open(source_path, "r", encoding="UTF-8", errors="replace") as file:
+        text = file.read()
+    return [Include(match.group(2).strip(), match.group(1) == '<') for match in _INCLUDE_PATTERN.finditer(text)]
+
+def parse_ninja_deps(deps_text: str) -> dict[str, list[str]]:
+    # Object path mapped to its dependencies, first of them is the source. Stale entries are skipped
+    deps: dict[str, list[str]] = {}
+    current: list[str] | None = None
+    for line in deps_text.splitlines():
+        header_match = _DEPS_HEADER_PATTERN.match(line)
+        if header_match is not None:
+            current = [] if header_match['state'] == 'VALID' else None
+            if current is not None:
+                deps[header_match['output']] = current
+            continue
+        if current is not None and line.startswith('    '):
+            current.append(commons.normalize_path(line.strip()))
+    return deps
+
+def load_ninja_deps(build_dir: str, toolset_config: config.BuildToolsConfig) -> dict[str, list[str]]:
+    if not toolset_config.is_ninja_set() or not os.path.exists(f'{build_dir}/.ninja_deps'):
+        return {}
+    deps_text = commons.execute_process([str(toolset_config.ninja_exe), '-t', 'deps'], build_dir, return_stdout=True)
+    return parse_ninja_deps(deps_text or '')
+
+def _get_output_argument(arguments: list[str]) -> str:
+    # Older CMake versions don't write 'output' field
+    for index, argument in enumerate(arguments):
+        if argument == '-o' and index + 1 < len(arguments):
+            return arguments[index + 1]
+        if argument.startswith('/Fo') or argument.startswith('-Fo'):
+            return argument[3:]
+    return ''
+
+def load_compile_commands(build_dir: str) -> list[CompileCommand]:
+    commands_path = f'{build_dir}/compile_commands.json'
+    if not os.path.exists(commands_path):
+        return []
+    with open(commands_path, "r", encoding="UTF-8") as file:
+        entries = json.load(file)
+    commands: list[CompileCommand] = []
+    for entry in entries:
+        arguments = entry.get('arguments')
+        if arguments is None:
+            arguments = shlex.split(entry['command'], posix=not commons.is_windows())
+        directory = commons.normalize_path(entry['directory'])
+        source = entry['file'] if os.path.isabs(entry['file']) else f"{directory}/{entry['file']}"
+        output = entry.get('output', _get_output_argument(arguments))
+        commands.append(CompileCommand(directory, arguments, commons.normalize_path(source), commons.normalize_path(output)))
+    return commands
+
+def resolve_include(include: Include, dependencies: list[str]) -> str | None:
+    # Finds header that include directive resolved to, among dependencies of object from the last build
+    suffix = '/' + include.name.replace('\\', '/').lstrip('./')
+    for dependency in dependencies:
+        if dependency.endswith(suffix):
+            return dependency
+    return None
+
+def is_project_file(path: str, toolset_config: config.BuildToolsConfig) -> bool:
+    # Project headers change often. Workspace lives inside project, but everything in it is external
+    path = commons.normalize_path(os.path.abspath(path))
+    project_dir = commons.normalize_path(os.path.abspath(toolset_config.project_dir)) + '/'
+    workspace_dir = commons.normalize_path(os.path.abspath(toolset_config.workspace_dir)) + '/'
+    return path.startswith(project_dir) and not path.startswith(workspace_dir)
+
+def get_preprocessed_size(command: CompileCommand, include_line: str) -> int | None:
+    # Size of preprocessor output of a file with single include line, compiled like given source.
+    # Not available for MSVC style compilers
+    compiler_name = os.path.basename(command.arguments[0]).lower()
+    if compiler_name in ['cl', 'cl.exe', 'clang-cl', 'clang-cl.exe']:
+        return None
+    # Output, dependency file and already applied precompiled header are dropped
+    arguments: list[str] = [command.arguments[0]]
+    index = 1
+    while index < len(command.arguments):
+        argument = command.arguments[index]
+        if argument in ['-o', '-MF', '-MT', '-MQ']:
+            index += 2
+            continue
+        if argument == '-include' and index + 1 < len(command.arguments) and 'cmake_pch' in command.arguments[index + 1]:
+            index += 2
+            continue
+        if argument not in ['-c', '-MD', '-MMD', '-MP'] and commons.normalize_path(argument) != command.source and not argument.endswith(command.source):
+            arguments.append(argument)
+        index += 1
+    extension = os.path.splitext(command.source)[1]
+    stub_path = f'{command.directory}/build_tools_include_probe{extension}'
+    with open(stub_path, "w", encoding="UTF-8") as file:
+        file.write(f'{include_line}\n')
+    try:
+        # Failure is not fatal, so process runner is used directly instead of commons
+        preprocess = process.run(process.Command(arguments + ['-E', stub_path], command.directory, capture_stdout=True), check=False)
+    finally:
+        os.remove(stub_path)
+    if preprocess.exit_code != 0:
+        log.warn(f"Preprocessing '{include_line}' failed, its size is unknown")
+        return None
+    return len(preprocess.stdout.encode('utf-8', errors='replace'))
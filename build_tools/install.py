@@ -0,0 +1,158 @@
+import contextlib
+import json
+import os
+import re
+import tempfile
+import threading
+import typing
+
+from . import commons
+from . import log
+
+"""
+Staged installs of workspace tools.
+
+Tool is unpacked into WORKSPACE_DIR/.staging/<name>-<random> and gets completion
+marker listing size and mtime of its key files. Only then it's renamed into place.
+Previous install is renamed into WORKSPACE_DIR/.trash and removed by background
+thread, so nothing waits for it. Interrupted install never reaches final location,
+and leftovers of staging and trash are removed on the next install. Entries
+carry PID of their owner in the name, entries of processes still running
+(another build.py in the same workspace) are left alone.
+
+is_installed() checks marker against key files with a few stat() calls, which
+detects installs that were interrupted or damaged without hashing anything.
+"""
+
+_MARKER_NAME = '.build_tools_install.json'
+# <name>-<pid>-<random> of staging and trash entries
+_OWNER_PID_PATTERN = re.compile(r'-(\d+)-[^-]+$')
+
+def _get_staging_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/.staging'
+
+def _get_trash_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/.trash'
+
+def _get_marker_path(install_dir: str) -> str:
+    return f'{install_dir}/{_MARKER_NAME}'
+
+def _stat_key_file(install_dir: str, key_file: str) -> list[int] | None:
+    try:
+        file_stat = os.stat(f'{install_dir}/{key_file}')
+    except OSError:
+        return None
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+def _write_marker(install_dir: str, key_files: list[str]):
+    files: dict[str, list[int]] = {}
+    for key_file in key_files:
+        key_file_stat = _stat_key_file(install_dir, key_file)
+        if key_file_stat is None:
+            log.error(f"install: key file '{key_file}' is missing in '{install_dir}'")
+            exit(-1)
+        files[key_file] = key_file_stat
+    with open(_get_marker_path(install_dir), "w", encoding="UTF-8") as file:
+        json.dump({'key_files': files}, file, indent=4)
+
+def is_installed(install_dir: str) -> bool:
+    marker_path = _get_marker_path(install_dir)
+    if not os.path.exists(marker_path):
+        return False
+    try:
+        with open(marker_path, "r", encoding="UTF-8") as file:
+            key_files: dict[str, list[int]] = json.load(file)['key_files']
+    except (OSError, ValueError, KeyError):
+        log.warn(f"Install marker '{marker_path}' is corrupted")
+        return False
+    for key_file, expected_stat in key_files.items():
+        if _stat_key_file(install_dir, key_file) != expected_stat:
+            log.warn(f"Install '{install_dir}' is damaged: '{key_file}' changed since it was installed")
+            return False
+    return True
+
+_cleanup_lock = threading.Lock()
+_cleaned_workspaces: set[str] = set()
+
+def _cleanup_leftovers(workspace_dir: str):
+    # Staging and trash entries of interrupted runs. Done once per process, before any
+    # install of this process creates its own staging directory, tools are installed concurrently
+    with _cleanup_lock:
+        if workspace_dir in _cleaned_workspaces:
+            return
+        _cleaned_workspaces.add(workspace_dir)
+        _move_leftovers_to_trash(workspace_dir)
+
+def _is_process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if commons.is_windows():
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid) # type: ignore
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        alive = bool(ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == STILL_ACTIVE # type: ignore
+        ctypes.windll.kernel32.CloseHandle(handle) # type: ignore
+        return alive
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _is_owner_alive(entry: str) -> bool:
+    match = _OWNER_PID_PATTERN.search(entry)
+    return match is not None and _is_process_alive(int(match[1]))
+
+def _make_entry_path(parent_dir: str, name: str) -> str:
+    # Unique path, not created, with PID of this process in the name
+    entry_path = tempfile.mkdtemp(prefix=f'{name}-{os.getpid()}-', dir=parent_dir)
+    os.rmdir(entry_path)
+    return entry_path
+
+def _move_leftovers_to_trash(workspace_dir: str):
+    for leftovers_dir in [_get_staging_dir(workspace_dir), _get_trash_dir(workspace_dir)]:
+        if not os.path.isdir(leftovers_dir):
+            continue
+        for entry in os.listdir(leftovers_dir):
+            # Another process may be unpacking into it or removing it right now
+            if _is_owner_alive(entry):
+                continue
+            leftover_path = f'{leftovers_dir}/{entry}'
+            trash_path = _make_entry_path(_get_trash_dir(workspace_dir), _OWNER_PID_PATTERN.sub('', entry))
+            try:
+                os.replace(leftover_path, trash_path)
+            except OSError:
+                continue
+            commons.remove_tree_in_background(trash_path)
+
+@contextlib.contextmanager
+def staged_install(workspace_dir: str, install_dir: str, key_files: list[str]) -> typing.Iterator[str]:
+    # Yields staging directory to unpack tool into. key_files are relative to it
+    os.makedirs(_get_staging_dir(workspace_dir), exist_ok=True)
+    os.makedirs(_get_trash_dir(workspace_dir), exist_ok=True)
+    _cleanup_leftovers(workspace_dir)
+
+    install_name = os.path.basename(install_dir)
+    staging_dir = commons.normalize_path(tempfile.mkdtemp(prefix=f'{install_name}-{os.getpid()}-', dir=_get_staging_dir(workspace_dir)))
+    # mkdtemp creates private directory, installed tools are regular directories
+    os.chmod(staging_dir, 0o755)
+    try:
+        yield staging_dir
+        _write_marker(staging_dir, key_files)
+    except BaseException:
+        commons.remove_tree_in_background(staging_dir)
+        raise
+
+    if os.path.exists(install_dir):
+        log.info(f"Replacing previous install in '{install_dir}'. It will be removed in background.")
+        trash_path = _make_entry_path(_get_trash_dir(workspace_dir), install_name)
+        os.replace(install_dir, trash_path)
+        commons.remove_tree_in_background(trash_path)
+    os.makedirs(os.path.dirname(install_dir), exist_ok=True)
+    os.replace(staging_dir, install_dir)
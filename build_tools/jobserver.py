@@ -0,0 +1,127 @@
+import atexit
+import contextlib
+import functools
+import os
+import re
+import tempfile
+import typing
+
+from . import commons
+from . import log
+
+"""
+GNU make compatible jobserver shared by every build started through commons.
+
+Token pool is a named FIFO (or named semaphore on windows) holding one token
+less than job budget, every client has one implicit job of its own. It is
+passed to children in MAKEFLAGS (--jobserver-auth), so make, ninja 1.13+ and
+conan builds started at the same time draw from one pool and compiler
+processes never exceed the budget, however many builds run.
+
+Clients use the pool only when they get no explicit -j, callers leave job count
+out when jobserver is active. Ninja older than 1.13 doesn't know jobserver,
+it gets -l (load limit) of the budget instead. Tools that can't be clients
+(vcpkg runs port builds with its own job count and environment) run with
+tokens of their job count reserved from the pool.
+"""
+
+_NINJA_JOBSERVER_VERSION = (1, 13)
+
+class Jobserver:
+    def __init__(self, jobs: int):
+        self.jobs = max(jobs, 1)
+        tokens = self.jobs - 1
+        if commons.is_windows():
+            import ctypes
+            self.auth = f'build_tools_jobserver_{os.getpid()}'
+            self._handle = ctypes.windll.kernel32.CreateSemaphoreW(None, tokens, max(tokens, 1), self.auth) # type: ignore
+            if not self._handle:
+                raise OSError(f"Creating jobserver semaphore '{self.auth}' failed")
+            return
+        self._dir = tempfile.mkdtemp(prefix='build_tools_jobserver_')
+        self._fifo_path = f'{self._dir}/fifo'
+        os.mkfifo(self._fifo_path, 0o600)
+        # Kept open for reading and writing, so FIFO never reports end of file to clients
+        self._fd = os.open(self._fifo_path, os.O_RDWR)
+        os.write(self._fd, b'+' * tokens)
+        self.auth = f'fifo:{self._fifo_path}'
+
+    @property
+    def makeflags(self) -> str:
+        return f' -j{self.jobs} --jobserver-auth={self.auth}'
+
+    @contextlib.contextmanager
+    def reserve(self, jobs: int) -> typing.Iterator[None]:
+        # Tool runs as a client of its own, one of its jobs is implicit. Waits until other clients give tokens back
+        tokens: list[bytes] = []
+        try:
+            for _ in range(min(jobs, self.jobs) - 1):
+                tokens.append(self._acquire())
+            yield
+        finally:
+            for token in tokens:
+                self._release(token)
+
+    def _acquire(self) -> bytes:
+        if commons.is_windows():
+            import ctypes
+            ctypes.windll.kernel32.WaitForSingleObject(self._handle, 0xFFFFFFFF) # type: ignore
+            return b'+'
+        return os.read(self._fd, 1)
+
+    def _release(self, token: bytes):
+        if commons.is_windows():
+            import ctypes
+            ctypes.windll.kernel32.ReleaseSemaphore(self._handle, 1, None) # type: ignore
+            return
+        # Clients get back the token they gave, whatever it was
+        os.write(self._fd, token)
+
+    def close(self):
+        if commons.is_windows():
+            import ctypes
+            ctypes.windll.kernel32.CloseHandle(self._handle) # type: ignore
+            return
+        os.close(self._fd)
+        os.remove(self._fifo_path)
+        os.rmdir(self._dir)
+
+_active: Jobserver | None = None
+
+def start(jobs: int) -> Jobserver:
+    global _active
+    if _active is not None:
+        return _active
+    _active = Jobserver(jobs)
+    atexit.register(stop)
+    log.info(f"Jobserver with {_active.jobs} jobs started ({_active.auth})")
+    return _active
+
+def stop():
+    global _active
+    if _active is not None:
+        _active.close()
+        _active = None
+
+def get_active() -> Jobserver | None:
+    return _active
+
+def apply(env: dict[str, str] | None) -> dict[str, str] | None:
+    # Environment of child with MAKEFLAGS pointing at active jobserver
+    if _active is None:
+        return env
+    env = dict(os.environ if env is None else env)
+    # Job count and jobserver options of outer make are replaced, other flags stay
+    makeflags = re.sub(r'(^|\s)(-j\d*|--jobserver-(auth|fds)=\S+)', '', env.get('MAKEFLAGS', '')).strip()
+    env['MAKEFLAGS'] = f'{makeflags}{_active.makeflags}'.strip()
+    return env
+
+@functools.cache
+def is_ninja_client(ninja_exe: str) -> bool:
+    try:
+        version_output = commons.execute_process([ninja_exe, '--version'], os.getcwd(), return_stdout=True)
+    except OSError:
+        return False
+    assert(version_output is not None)
+    match = re.match(r'(\d+)\.(\d+)', version_output.strip())
+    return match is not None and (int(match[1]), int(match[2])) >= _NINJA_JOBSERVER_VERSION
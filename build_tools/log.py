@@ -1,13 +1,28 @@
 import datetime
+import sys
+import threading
+import typing
+
+# Tools can be set up from multiple threads, lines must not interleave
+_print_lock = threading.Lock()
 
 def _now_str() -> str:
     return datetime.datetime.now().isoformat(sep=" ", timespec='milliseconds')
 
+def _print(line: str):
+    with _print_lock:
+        print(line, flush=True)
+
+def output(line: str, stream: typing.TextIO = sys.stdout):
+    # Undecorated line of child process output
+    with _print_lock:
+        print(line, file=stream, flush=True)
+
 def error(msg: str):
-    print(f"[BUILD_TOOLS][{_now_str()}][ERROR] {msg}")
+    _print(f"[BUILD_TOOLS][{_now_str()}][ERROR] {msg}")
 
 def info(msg: str):
-    print(f"[BUILD_TOOLS][{_now_str()}][INFO] {msg}")
+    _print(f"[BUILD_TOOLS][{_now_str()}][INFO] {msg}")
 
 def warn(msg: str):
-    print(f"[BUILD_TOOLS][{_now_str()}][WARNING] {msg}")
+    _print(f"[BUILD_TOOLS][{_now_str()}][WARNING] {msg}")
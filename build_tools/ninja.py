@@ -1,11 +1,9 @@
-import os
 import shutil
-import urllib
-import zipfile
 import platform
-import urllib.request
 
+from . import archive
 from . import commons
+from . import install
 from . import log
 
 
@@ -32,25 +30,16 @@ def _ninja_1_13_2_download(workspace_dir: str) -> str:
         exit(-1)
 
     system_string = "win" if commons.is_windows() else "linux"
-    link = f"https://github.com/ninja-build/ninja/releases/download/v1.13.2/ninja-{system_string}.zip"
+    link = f"{commons.get_github_url()}/ninja-build/ninja/releases/download/v1.13.2/ninja-{system_string}.zip"
     
     extract_path = f'{workspace_dir}/ninja'
-    archive_path = f'{workspace_dir}/ninja-1.13.2.zip'
-
-    if os.path.exists(extract_path):
-        log.info("Previous ninja download exists. Deleting...")
-        commons.delete_dir(extract_path)
-
-    log.info("Downloading ninja executable...")
-    urllib.request.urlretrieve(link, archive_path)
-    log.info("Ninja downloaded.")
+    exe_ext = ".exe" if commons.is_windows() else ""
 
-    log.info("Unpacking ninja executable...")
-    with zipfile.ZipFile(archive_path, 'r') as zip_file:
-        zip_file.extractall(extract_path)
-    log.info("Unpacked ninja executable.")
+    log.info("Downloading and unpacking ninja executable...")
+    with install.staged_install(workspace_dir, extract_path, [f'ninja{exe_ext}']) as staging_dir:
+        archive.stream_extract(link, staging_dir, "zip")
+    log.info("Ninja downloaded and unpacked.")
 
-    exe_ext = ".exe" if commons.is_windows() else ""
     return f'{extract_path}/ninja{exe_ext}'
 
 def download_ninja(workspace_dir: str) -> str:
@@ -60,7 +49,7 @@ def is_ninja_systemwide_installed() -> bool:
     return shutil.which("ninja") is not None
 
 def is_ninja_in_workspace_toolset(workspace_dir: str) -> bool:
-    return os.path.exists(_ninja_1_13_2_get_exec_path(workspace_dir))
+    return install.is_installed(f'{workspace_dir}/ninja')
 
 def get_toolset_ninja_exe_path(workspace_dir: str) -> str:
     return _ninja_1_13_2_get_exec_path(workspace_dir)
@@ -0,0 +1,205 @@
+import dataclasses
+import json
+import math
+import os
+
+from . import build_report
+from . import cmake
+from . import commons
+from . import config
+from . import includes
+from . import log
+from . import trace
+
+"""
+Precompiled headers generated from include statistics of the project.
+
+External headers (everything outside project directory, workspace included) that
+project sources include directly are ranked by number of translation units
+including them times their preprocessed size. Headers resolved from 'ninja -t deps'
+of the last build are exact, without build every angled include is a candidate.
+Best ones become precompiled header of their target, wired with
+target_precompile_headers() in cmake file included into configuration (see
+cmake.get_project_include_dir()).
+
+WORKSPACE_DIR/pch:
+    - <target>.hpp      - generated header of target
+    - baseline.json     - compile times of the last build without generated headers,
+                          compared with current ones in build report
+"""
+
+_MAX_HEADERS = 16
+# Header has to be included by at least that part of target sources
+_MIN_INCLUDE_FRACTION = 0.25
+# Precompiling small headers doesn't pay off
+_MIN_PREPROCESSED_SIZE = 16 * 1024
+_CXX_SOURCE_EXTENSIONS = ['.cpp', '.cc', '.cxx', '.c++', '.C']
+_CMAKE_INCLUDE_NAME = 'build_tools_pch.cmake'
+_PCH_OUTPUT_SUFFIXES = ['cmake_pch.hxx.gch', 'cmake_pch.hxx.pch', 'cmake_pch.pch']
+
+@dataclasses.dataclass
+class HeaderCandidate:
+    include: includes.Include
+    count: int = 0
+    size: int | None = None
+
+    @property
+    def score(self) -> int:
+        return self.count * (1 if self.size is None else self.size)
+
+def get_pch_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/pch'
+
+def _get_cmake_include_path(workspace_dir: str) -> str:
+    return f'{cmake.get_project_include_dir(workspace_dir)}/{_CMAKE_INCLUDE_NAME}'
+
+def _get_baseline_path(workspace_dir: str) -> str:
+    return f'{get_pch_dir(workspace_dir)}/baseline.json'
+
+def _collect_candidates(
+    commands: list[includes.CompileCommand],
+    deps: dict[str, list[str]],
+    toolset_config: config.BuildToolsConfig
+) -> dict[str, tuple[int, list[HeaderCandidate]]]:
+    # Target mapped to number of its C++ sources and candidates
+    targets: dict[str, tuple[list[includes.CompileCommand], dict[str, HeaderCandidate]]] = {}
+    for command in commands:
+        target = command.target
+        if target is None or os.path.splitext(command.source)[1] not in _CXX_SOURCE_EXTENSIONS:
+            continue
+        target_commands, candidates = targets.setdefault(target, ([], {}))
+        target_commands.append(command)
+        object_deps = deps.get(command.output)
+        seen: set[str] = set()
+        for include in includes.scan_includes(command.source):
+            if include.name in seen:
+                continue
+            seen.add(include.name)
+            if object_deps is not None:
+                header_path = includes.resolve_include(include, object_deps)
+                # Not resolved means it is under #if that wasn't taken
+                if header_path is None or includes.is_project_file(header_path, toolset_config):
+                    continue
+            elif not include.is_angled:
+                continue
+            candidates.setdefault(include.name, HeaderCandidate(include)).count += 1
+
+    result: dict[str, tuple[int, list[HeaderCandidate]]] = {}
+    for target, (target_commands, candidates) in targets.items():
+        min_count = max(1, math.ceil(len(target_commands) * _MIN_INCLUDE_FRACTION))
+        selected = [candidate for candidate in candidates.values() if candidate.count >= min_count]
+        for candidate in selected:
+            open_bracket, close_bracket = ('<', '>') if candidate.include.is_angled else ('"', '"')
+            candidate.size = includes.get_preprocessed_size(target_commands[0], f'#include {open_bracket}{candidate.include.name}{close_bracket}')
+        selected = [candidate for candidate in selected if candidate.size is None or candidate.size >= _MIN_PREPROCESSED_SIZE]
+        selected.sort(key=lambda candidate: candidate.score, reverse=True)
+        result[target] = (len(target_commands), selected[:_MAX_HEADERS])
+    return result
+
+def _write_header(header_path: str, target: str, sources_count: int, candidates: list[HeaderCandidate]):
+    lines = [
+        f'// Generated by build_tools (pch.py) for target {target}, do not edit.',
+        f'// Ranked by number of sources including header (of {sources_count}) times its preprocessed size.',
+        '#pragma once',
+    ]
+    for candidate in candidates:
+        open_bracket, close_bracket = ('<', '>') if candidate.include.is_angled else ('"', '"')
+        size = 'unknown size' if candidate.size is None else f'{candidate.size / 1024:.0f} KiB'
+        lines.append(f'#include {open_bracket}{candidate.include.name}{close_bracket} // {candidate.count} sources, {size}')
+    with open(header_path, "w", encoding="UTF-8") as file:
+        file.write('\n'.join(lines) + '\n')
+
+def _write_cmake_include(cmake_include_path: str, headers: dict[str, str]):
+    body_lines: list[str] = []
+    for target, header_path in sorted(headers.items()):
+        body_lines += [
+            f'if(TARGET {target})',
+            f'    target_precompile_headers({target} PRIVATE "$<$<COMPILE_LANGUAGE:CXX>:{header_path}>")',
+            'endif()',
+        ]
+    cmake.write_deferred_project_include(cmake_include_path, 'pch', body_lines)
+
+def _read_baselines(workspace_dir: str) -> dict[str, dict[str, int]]:
+    baseline_path = _get_baseline_path(workspace_dir)
+    if not os.path.exists(baseline_path):
+        return {}
+    with open(baseline_path, "r", encoding="UTF-8") as file:
+        return json.load(file)
+
+def _save_baseline(workspace_dir: str, build_dir: str, objects: set[str]):
+    # Only the first generation sees build without generated headers, later ones keep it
+    baselines = _read_baselines(workspace_dir)
+    log_path = f'{build_dir}/.ninja_log'
+    if build_dir in baselines or not os.path.exists(log_path):
+        return
+    baselines[build_dir] = {
+        edge.outputs[0]: edge.duration
+        for edge in build_report.parse_ninja_log(log_path)
+        if edge.outputs[0] in objects
+    }
+    with open(_get_baseline_path(workspace_dir), "w", encoding="UTF-8") as file:
+        json.dump(baselines, file, indent=4)
+
+@trace.traced("pch.generate")
+def generate(cmake_config: cmake.Config, toolset_config: config.BuildToolsConfig):
+    build_dir = cmake.get_config_files_path(cmake_config)
+    commands = includes.load_compile_commands(build_dir)
+    if len(commands) == 0:
+        log.warn(f"pch: no compile_commands.json in '{build_dir}'. Configure project first.")
+        return
+    deps = includes.load_ninja_deps(build_dir, toolset_config)
+    if len(deps) == 0:
+        log.info("pch: no dependencies of previous build, ranking headers scanned from sources")
+
+    pch_dir = get_pch_dir(toolset_config.workspace_dir)
+    os.makedirs(pch_dir, exist_ok=True)
+    headers: dict[str, str] = {}
+    for target, (sources_count, candidates) in _collect_candidates(commands, deps, toolset_config).items():
+        if len(candidates) == 0:
+            log.info(f"pch: no header worth precompiling for target '{target}'")
+            continue
+        header_path = f'{pch_dir}/{target}.hpp'
+        _write_header(header_path, target, sources_count, candidates)
+        headers[target] = header_path
+        log.info(f"pch: target '{target}' precompiles {', '.join(candidate.include.name for candidate in candidates)}")
+
+    if len(headers) == 0:
+        remove(toolset_config.workspace_dir)
+        return
+    _save_baseline(toolset_config.workspace_dir, build_dir, {command.output for command in commands})
+    _write_cmake_include(_get_cmake_include_path(toolset_config.workspace_dir), headers)
+
+def remove(workspace_dir: str):
+    cmake_include_path = _get_cmake_include_path(workspace_dir)
+    if os.path.exists(cmake_include_path):
+        os.remove(cmake_include_path)
+    if os.path.isdir(get_pch_dir(workspace_dir)):
+        commons.remove_tree(get_pch_dir(workspace_dir))
+
+def log_comparison(cmake_config: cmake.Config, toolset_config: config.BuildToolsConfig):
+    # Compile times of objects built both in baseline and in the last build
+    build_dir = cmake.get_config_files_path(cmake_config)
+    baseline = _read_baselines(toolset_config.workspace_dir).get(build_dir)
+    log_path = f'{build_dir}/.ninja_log'
+    if baseline is None or not os.path.exists(log_path):
+        return
+    edges = build_report.parse_ninja_log(log_path)
+    before = 0
+    after = 0
+    count = 0
+    pch_time = 0
+    for edge in edges:
+        if any(edge.outputs[0].endswith(suffix) for suffix in _PCH_OUTPUT_SUFFIXES):
+            pch_time += edge.duration
+        elif edge.outputs[0] in baseline:
+            before += baseline[edge.outputs[0]]
+            after += edge.duration
+            count += 1
+    if count == 0:
+        log.info("Precompiled headers: no sources were rebuilt since headers were generated")
+        return
+    change = (before - after) / before * 100 if before > 0 else 0.0
+    log.info(
+        f"Precompiled headers: {count} sources compiled in {after / 1000:.2f}s, "
+        f"{before / 1000:.2f}s before ({change:.1f}% faster), building headers took {pch_time / 1000:.2f}s"
+    )
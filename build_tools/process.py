@@ -0,0 +1,347 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import typing
+
+from . import commons
+from . import log
+from . import trace
+
+"""
+Process runner built on asyncio.
+
+stdout and stderr of every process are read line by line as they arrive,
+echoed (prefixed, when several processes run at once) and kept in bounded
+ring buffers, so failure can be reported with its last lines of output without
+holding whole build log in memory. Process running alone, with no prefix and
+nothing captured, inherits stdout and stderr instead, so it keeps terminal
+(colored diagnostics, ninja status line) and no tail is kept. Wall time, CPU time and peak RSS of every
+process are measured (CPU time and peak RSS come from wait4(), they are not
+available on windows). Failures raise ProcessError instead of exiting.
+
+Children are started in their own process group with stdin closed, and the
+whole group is terminated when runner is interrupted or when another process
+of run_all() fails.
+
+run_tasks() runs python callables (whole pipelines starting many processes) on
+threads, each with its own output prefix. Failure of one of them terminates
+processes of the others.
+"""
+
+_DEFAULT_RING_LINES = 200
+_READ_CHUNK_SIZE = 64 * 1024
+_TERMINATE_GRACE_SECONDS = 5.0
+
+_output_prefix: contextvars.ContextVar[str | None] = contextvars.ContextVar('build_tools_output_prefix', default=None)
+
+_T = typing.TypeVar('_T')
+
+class _TaskGroup:
+    # Processes started by one task of run_tasks(), so they can be terminated from other thread.
+    # Groups of run_tasks() nested in a task are its children and are cancelled with it
+    def __init__(self, parent: '_TaskGroup | None' = None):
+        self.lock = threading.Lock()
+        self.popens: set[subprocess.Popen] = set()
+        self.children: list[_TaskGroup] = []
+        self.cancelled = False
+        if parent is not None:
+            parent.add_child(self)
+
+    def add_child(self, child: '_TaskGroup'):
+        with self.lock:
+            self.children.append(child)
+            cancelled = self.cancelled
+        if cancelled:
+            child.cancel()
+
+    def add(self, popen: subprocess.Popen):
+        with self.lock:
+            self.popens.add(popen)
+            cancelled = self.cancelled
+        if cancelled:
+            _terminate(popen)
+
+    def discard(self, popen: subprocess.Popen):
+        with self.lock:
+            self.popens.discard(popen)
+
+    def cancel(self, force: bool = False):
+        with self.lock:
+            self.cancelled = True
+            popens = list(self.popens)
+            children = list(self.children)
+        for popen in popens:
+            _terminate(popen, force)
+        for child in children:
+            child.cancel(force)
+
+_task_group: contextvars.ContextVar[_TaskGroup | None] = contextvars.ContextVar('build_tools_task_group', default=None)
+
+@dataclasses.dataclass(frozen=True)
+class Command:
+    args: str | list[str]
+    cwd: str
+    env: dict[str, str] | None = None
+    # Prefix of echoed output lines. Defaults to output_prefix() of the caller
+    name: str | None = None
+    # Whole stdout is returned in ProcessResult.stdout instead of being echoed
+    capture_stdout: bool = False
+    # Whole stdout is returned in ProcessResult.stdout and echoed as well
+    keep_stdout: bool = False
+
+@dataclasses.dataclass(frozen=True)
+class ProcessResult:
+    command: Command
+    exit_code: int
+    wall_time: float
+    user_time: float | None
+    system_time: float | None
+    # In bytes, largest of the process and its waited-for descendants
+    peak_rss: int | None
+    stdout: str
+    stdout_tail: list[str]
+    stderr_tail: list[str]
+
+    @property
+    def cpu_time(self) -> float | None:
+        if self.user_time is None or self.system_time is None:
+            return None
+        return self.user_time + self.system_time
+
+class ProcessError(Exception):
+    def __init__(self, result: ProcessResult):
+        self.result = result
+        super().__init__(f"Command: {_get_command_string(result.command)} failed with code: {result.exit_code}")
+
+    def get_output_tail(self) -> list[str]:
+        return self.result.stderr_tail if len(self.result.stderr_tail) > 0 else self.result.stdout_tail
+
+@contextlib.contextmanager
+def output_prefix(prefix: str | None) -> typing.Iterator[None]:
+    # Processes started inside (in this context) prefix their output lines with '[prefix] '
+    token = _output_prefix.set(prefix)
+    try:
+        yield
+    finally:
+        _output_prefix.reset(token)
+
+def _get_command_string(command: Command) -> str:
+    return command.args if type(command.args) == str else ' '.join(command.args)
+
+def _get_span_name(command: Command) -> str:
+    executable = command.args[0] if type(command.args) == list else command.args.split(' ', 1)[0]
+    return os.path.basename(executable)
+
+class _OutputSink:
+    def __init__(self, prefix: str | None, stream: typing.TextIO | None, ring_lines: int, keep_all: bool):
+        self._prefix = '' if prefix is None else f'[{prefix}] '
+        self._stream = stream
+        self._pending = b''
+        self.tail: collections.deque[str] = collections.deque(maxlen=ring_lines)
+        self.all_chunks: list[bytes] | None = [] if keep_all else None
+
+    def _emit(self, raw_line: bytes):
+        line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+        self.tail.append(line)
+        if self._stream is not None:
+            log.output(f'{self._prefix}{line}', self._stream)
+
+    def feed(self, data: bytes):
+        if self.all_chunks is not None:
+            self.all_chunks.append(data)
+        self._pending += data
+        *lines, self._pending = self._pending.split(b'\n')
+        for raw_line in lines:
+            self._emit(raw_line)
+
+    def close(self):
+        if len(self._pending) > 0:
+            self._emit(self._pending)
+            self._pending = b''
+
+async def _pump(pipe: typing.BinaryIO, sink: _OutputSink):
+    loop = asyncio.get_running_loop()
+    if commons.is_windows():
+        # Anonymous pipes of Popen cannot be registered in windows event loop
+        while data := await loop.run_in_executor(None, pipe.read1, _READ_CHUNK_SIZE): # type: ignore
+            sink.feed(data)
+    else:
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        try:
+            while data := await reader.read(_READ_CHUNK_SIZE):
+                sink.feed(data)
+        finally:
+            transport.close()
+    sink.close()
+
+def _reap(popen: subprocess.Popen) -> tuple[int, float | None, float | None, int | None]:
+    # Blocking, runs in executor. Returns exit code, user time, system time and peak RSS
+    if commons.is_windows():
+        return popen.wait(), None, None, None
+    _, status, usage = os.wait4(popen.pid, 0)
+    exit_code = os.waitstatus_to_exitcode(status)
+    # Popen must not try to wait for it again
+    popen.returncode = exit_code
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return exit_code, usage.ru_utime, usage.ru_stime, peak_rss
+
+def _terminate(popen: subprocess.Popen, force: bool = False):
+    if popen.returncode is not None:
+        return
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        if commons.is_windows():
+            popen.kill()
+        else:
+            os.killpg(popen.pid, signal.SIGKILL if force else signal.SIGTERM)
+
+def _spawn(command: Command, piped: bool) -> subprocess.Popen:
+    # New session makes the child leader of its own process group (process_group argument needs python 3.11)
+    return subprocess.Popen(
+        args = command.args,
+        cwd = command.cwd,
+        shell = type(command.args) == str,
+        env = command.env,
+        stdin = subprocess.DEVNULL,
+        stdout = subprocess.PIPE if piped else None,
+        stderr = subprocess.PIPE if piped else None,
+        start_new_session = not commons.is_windows()
+    )
+
+async def run_async(command: Command, check: bool = True, ring_lines: int = _DEFAULT_RING_LINES) -> ProcessResult:
+    loop = asyncio.get_running_loop()
+    prefix = command.name if command.name is not None else _output_prefix.get()
+    stdout_sink = _OutputSink(prefix, None if command.capture_stdout else sys.stdout, ring_lines, command.capture_stdout or command.keep_stdout)
+    stderr_sink = _OutputSink(prefix, sys.stderr, ring_lines, False)
+    # Output is read only when it has to be prefixed or kept
+    piped = prefix is not None or command.capture_stdout or command.keep_stdout
+
+    with trace.span(_get_span_name(command), 'process', {'command': _get_command_string(command), 'cwd': command.cwd}) as span_args:
+        start_time = time.perf_counter()
+        popen = _spawn(command, piped)
+        reap_future = loop.run_in_executor(None, _reap, popen)
+        task_group = _task_group.get()
+        if task_group is not None:
+            task_group.add(popen)
+        try:
+            if popen.stdout is not None and popen.stderr is not None:
+                await asyncio.gather(_pump(popen.stdout, stdout_sink), _pump(popen.stderr, stderr_sink))
+            exit_code, user_time, system_time, peak_rss = await asyncio.shield(reap_future)
+        except BaseException:
+            # Interrupted or cancelled by failure of a sibling, process must not outlive runner
+            _terminate(popen)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.shield(reap_future), _TERMINATE_GRACE_SECONDS)
+            _terminate(popen, force=True)
+            await asyncio.shield(reap_future)
+            raise
+        finally:
+            if task_group is not None:
+                task_group.discard(popen)
+            if popen.stdout is not None and popen.stderr is not None:
+                popen.stdout.close()
+                popen.stderr.close()
+        wall_time = time.perf_counter() - start_time
+        span_args.update({'exit_code': exit_code, 'cpu_s': None if user_time is None or system_time is None else user_time + system_time, 'peak_rss': peak_rss})
+
+    result = ProcessResult(
+        command = command,
+        exit_code = exit_code,
+        wall_time = wall_time,
+        user_time = user_time,
+        system_time = system_time,
+        peak_rss = peak_rss,
+        stdout = b''.join(stdout_sink.all_chunks or []).decode('utf-8', errors='replace'),
+        stdout_tail = list(stdout_sink.tail),
+        stderr_tail = list(stderr_sink.tail),
+    )
+    if check and exit_code != 0:
+        raise ProcessError(result)
+    return result
+
+def run(command: Command, check: bool = True, ring_lines: int = _DEFAULT_RING_LINES) -> ProcessResult:
+    return asyncio.run(run_async(command, check, ring_lines))
+
+async def run_all_async(commands: list[Command], max_parallel: int | None = None, check: bool = True) -> list[ProcessResult]:
+    # Results are in order of commands. With check, first failure terminates all other processes
+    semaphore = asyncio.Semaphore(len(commands) if max_parallel is None else max(max_parallel, 1))
+    async def _run_limited(command: Command) -> ProcessResult:
+        async with semaphore:
+            return await run_async(command, check)
+
+    tasks = [asyncio.create_task(_run_limited(command)) for command in commands]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def run_all(commands: list[Command], max_parallel: int | None = None, check: bool = True) -> list[ProcessResult]:
+    # Commands without name get numbered output prefixes, so interleaved lines can be told apart
+    outer_prefix = _output_prefix.get()
+    outer_prefix = '' if outer_prefix is None else f'{outer_prefix}/'
+    commands = [
+        command if command.name is not None else dataclasses.replace(command, name=f'{outer_prefix}{index}:{_get_span_name(command)}')
+        for index, command in enumerate(commands)
+    ]
+    return asyncio.run(run_all_async(commands, max_parallel, check))
+
+def run_tasks(tasks: dict[str, typing.Callable[[], _T]]) -> dict[str, _T]:
+    # Every task runs on its own thread, processes it starts prefix their output with task name.
+    # First failure (exit() of commons included) terminates processes of other tasks and is re-raised
+    outer_prefix = _output_prefix.get()
+    outer_prefix = '' if outer_prefix is None else f'{outer_prefix}/'
+    groups = {name: _TaskGroup(_task_group.get()) for name in tasks.keys()}
+    results: dict[str, _T] = {}
+    failures: list[tuple[str, BaseException]] = []
+    failures_lock = threading.Lock()
+
+    def _run_task(name: str, task: typing.Callable[[], _T]):
+        _output_prefix.set(f'{outer_prefix}{name}')
+        _task_group.set(groups[name])
+        try:
+            results[name] = task()
+        except BaseException as exception:
+            with failures_lock:
+                failures.append((name, exception))
+            for other_name, group in groups.items():
+                if other_name != name:
+                    group.cancel()
+
+    threads = [
+        # Context copy carries context variables of the caller (trace, prefixes) to the thread
+        threading.Thread(target=contextvars.copy_context().run, args=(_run_task, name, task), name=name, daemon=True)
+        for name, task in tasks.items()
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        for group in groups.values():
+            group.cancel()
+        deadline = time.monotonic() + _TERMINATE_GRACE_SECONDS
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        for group in groups.values():
+            group.cancel(force=True)
+        raise
+
+    if len(failures) > 0:
+        # Tasks terminated because of the first failure fail as well, only the first one matters
+        name, exception = failures[0]
+        log.error(f"Task '{name}' failed, other tasks were stopped")
+        raise exception
+    return results
@@ -0,0 +1,170 @@
+import json
+import os
+import tempfile
+import threading
+
+from . import commons
+from . import log
+
+"""
+Job counts of builds (project, conan, vcpkg), derived from machine resources.
+
+CPU budget is number of usable CPUs (affinity) limited by cgroup CPU quota.
+Memory budget is available memory (MemAvailable) limited by what is left under
+cgroup memory limit. Every job is expected to take as much memory as the biggest
+process of previous builds of the same kind (peak RSS of build process and its
+children, recorded after every build), or _DEFAULT_JOB_MEMORY when there is no
+history yet. Job count is the smaller of both budgets.
+
+BUILD_TOOLS_JOBS overrides the computed count.
+
+WORKSPACE_DIR/resources.json:
+    - peak RSS of the last builds of every kind
+"""
+
+PROJECT = 'project'
+CONAN = 'conan'
+VCPKG = 'vcpkg'
+
+_DEFAULT_JOB_MEMORY = 1024 * 1024 * 1024
+# Part of available memory given to jobs, the rest is left for linker spikes, IDE and system
+_MEMORY_SAFETY_FACTOR = 0.85
+_PEAK_HISTORY_LENGTH = 5
+_CGROUP_ROOT = '/sys/fs/cgroup'
+
+_history_lock = threading.Lock()
+
+def _read_file(path: str) -> str | None:
+    try:
+        with open(path, "r", encoding="UTF-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def _get_cgroup_dirs() -> list[str]:
+    # Cgroup of this process (cgroup v2 unified hierarchy) first, then root, which is the cgroup inside containers
+    dirs: list[str] = []
+    cgroup_text = _read_file('/proc/self/cgroup') or ''
+    for line in cgroup_text.splitlines():
+        if line.startswith('0::') and line[3:] not in ['', '/']:
+            dirs.append(f'{_CGROUP_ROOT}{line[3:]}')
+    dirs.append(_CGROUP_ROOT)
+    return dirs
+
+def _get_cgroup_cpu_quota() -> float | None:
+    for cgroup_dir in _get_cgroup_dirs():
+        cpu_max = _read_file(f'{cgroup_dir}/cpu.max')
+        if cpu_max is not None:
+            quota, period = (cpu_max.split() + ['100000'])[:2]
+            return None if quota == 'max' else int(quota) / int(period)
+    # cgroup v1
+    quota = _read_file(f'{_CGROUP_ROOT}/cpu/cpu.cfs_quota_us')
+    period = _read_file(f'{_CGROUP_ROOT}/cpu/cpu.cfs_period_us')
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+def _get_cgroup_available_memory() -> int | None:
+    for cgroup_dir in _get_cgroup_dirs():
+        memory_max = _read_file(f'{cgroup_dir}/memory.max')
+        if memory_max is None:
+            continue
+        memory_current = _read_file(f'{cgroup_dir}/memory.current')
+        if memory_max == 'max' or memory_current is None:
+            return None
+        # Inactive page cache is reclaimed before anything gets killed
+        inactive_file = 0
+        for line in (_read_file(f'{cgroup_dir}/memory.stat') or '').splitlines():
+            if line.startswith('inactive_file '):
+                inactive_file = int(line.split()[1])
+        return max(int(memory_max) - int(memory_current) + inactive_file, 0)
+    # cgroup v1, no limit is reported as huge number
+    limit = _read_file(f'{_CGROUP_ROOT}/memory/memory.limit_in_bytes')
+    usage = _read_file(f'{_CGROUP_ROOT}/memory/memory.usage_in_bytes')
+    if limit is None or usage is None or int(limit) >= 2 ** 60:
+        return None
+    return max(int(limit) - int(usage), 0)
+
+def _get_windows_available_memory() -> int | None:
+    import ctypes
+    class _MemoryStatusEx(ctypes.Structure):
+        _fields_ = [
+            ('dwLength', ctypes.c_ulong),
+            ('dwMemoryLoad', ctypes.c_ulong),
+            ('ullTotalPhys', ctypes.c_ulonglong),
+            ('ullAvailPhys', ctypes.c_ulonglong),
+            ('ullTotalPageFile', ctypes.c_ulonglong),
+            ('ullAvailPageFile', ctypes.c_ulonglong),
+            ('ullTotalVirtual', ctypes.c_ulonglong),
+            ('ullAvailVirtual', ctypes.c_ulonglong),
+            ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+        ]
+    status = _MemoryStatusEx()
+    status.dwLength = ctypes.sizeof(_MemoryStatusEx)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)): # type: ignore
+        return None
+    return status.ullAvailPhys
+
+def get_cpu_count() -> int:
+    cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    if commons.is_linux():
+        quota = _get_cgroup_cpu_quota()
+        if quota is not None:
+            cpu_count = min(cpu_count, max(int(quota), 1))
+    return cpu_count
+
+def get_available_memory() -> int | None:
+    # In bytes, None when it can't be read
+    if commons.is_windows():
+        return _get_windows_available_memory()
+    available: int | None = None
+    for line in (_read_file('/proc/meminfo') or '').splitlines():
+        if line.startswith('MemAvailable:'):
+            available = int(line.split()[1]) * 1024
+    cgroup_available = _get_cgroup_available_memory()
+    if cgroup_available is not None:
+        available = cgroup_available if available is None else min(available, cgroup_available)
+    return available
+
+def _get_history_path(workspace_dir: str) -> str:
+    return f'{workspace_dir}/resources.json'
+
+def _read_history(workspace_dir: str) -> dict[str, list[int]]:
+    history_text = _read_file(_get_history_path(workspace_dir))
+    if history_text is None:
+        return {}
+    try:
+        return json.loads(history_text)
+    except json.JSONDecodeError:
+        return {}
+
+def record_peak_rss(workspace_dir: str, kind: str, peak_rss: int | None):
+    if peak_rss is None or peak_rss <= 0:
+        return
+    with _history_lock:
+        history = _read_history(workspace_dir)
+        history[kind] = (history.get(kind, []) + [peak_rss])[-_PEAK_HISTORY_LENGTH:]
+        os.makedirs(workspace_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=workspace_dir, suffix='.tmp', delete=False, encoding="UTF-8") as file:
+            json.dump(history, file, indent=4)
+        os.replace(file.name, _get_history_path(workspace_dir))
+
+def get_job_memory(workspace_dir: str, kind: str) -> int:
+    peaks = _read_history(workspace_dir).get(kind, [])
+    return max(peaks) if len(peaks) > 0 else _DEFAULT_JOB_MEMORY
+
+def get_job_count(workspace_dir: str, kind: str = PROJECT) -> int:
+    jobs_override = os.environ.get('BUILD_TOOLS_JOBS')
+    if jobs_override is not None:
+        return max(int(jobs_override), 1)
+    cpu_count = get_cpu_count()
+    available_memory = get_available_memory()
+    if available_memory is None:
+        log.info(f"Jobs for {kind}: {cpu_count} ({cpu_count} CPUs, available memory unknown)")
+        return cpu_count
+    job_memory = get_job_memory(workspace_dir, kind)
+    memory_jobs = max(int(available_memory * _MEMORY_SAFETY_FACTOR // job_memory), 1)
+    jobs = min(cpu_count, memory_jobs)
+    gib = 1024 * 1024 * 1024
+    log.info(f"Jobs for {kind}: {jobs} ({cpu_count} CPUs, {available_memory / gib:.1f} GiB available, {job_memory / gib:.2f} GiB per job)")
+    return jobs
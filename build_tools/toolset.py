@@ -0,0 +1,122 @@
+import concurrent.futures
+import dataclasses
+import functools
+import os
+import time
+import typing
+
+from . import cmake
+from . import conan
+from . import vcpkg
+from . import ninja
+from . import log
+from . import config
+from . import process
+from . import trace
+
+"""
+Bootstrap of workspace toolset. Every tool is downloaded and unpacked into
+its own directory inside workspace, so missing ones can be installed at the
+same time. Fresh workspace waits only for the slowest tool.
+
+Conan and vcpkg dependency trees are independent as well, they are installed
+at once and split job budget between them.
+"""
+
+@dataclasses.dataclass(frozen=True)
+class _Tool:
+    name: str
+    is_in_workspace: typing.Callable[[str], bool]
+    # Called with workspace_dir and project_dir
+    download: typing.Callable[[str, str | None], typing.Any]
+    get_exe_path: typing.Callable[[str], str]
+
+_TOOLS: dict[str, _Tool] = {
+    "cmake": _Tool("cmake", cmake.is_cmake_in_workspace_toolset, lambda workspace_dir, _: cmake.download_cmake(workspace_dir), cmake.get_toolset_cmake_exe_path),
+    "conan": _Tool("conan", conan.is_conan_in_workspace_toolset, lambda workspace_dir, _: conan.download_conan(workspace_dir), conan.get_toolset_conan_exe_path),
+    "vcpkg": _Tool("vcpkg", vcpkg.is_vcpkg_in_workspace_toolset, vcpkg.download_vcpkg, vcpkg.get_toolset_vcpkg_exe_path),
+    "ninja": _Tool("ninja", ninja.is_ninja_in_workspace_toolset, lambda workspace_dir, _: ninja.download_ninja(workspace_dir), ninja.get_toolset_ninja_exe_path),
+}
+
+def _error_log_and_die(msg: str) -> typing.NoReturn:
+    log.error(msg)
+    exit(-1)
+
+def _download_tool(tool: _Tool, workspace_dir: str, project_dir: str | None) -> float:
+    log.info(f"[{tool.name}] Installing into workspace...")
+    start = time.perf_counter()
+    with trace.span(f"install {tool.name}", 'toolset'):
+        tool.download(workspace_dir, project_dir)
+    elapsed = time.perf_counter() - start
+    log.info(f"[{tool.name}] Installed in {elapsed:.2f}s")
+    return elapsed
+
+def get_missing_tools(workspace_dir: str, tools: list[str] | None = None) -> list[str]:
+    tools = list(_TOOLS.keys()) if tools is None else tools
+    for name in tools:
+        if name not in _TOOLS:
+            _error_log_and_die(f"toolset.get_missing_tools(): unknown tool '{name}'. Known tools: {list(_TOOLS.keys())}")
+    with trace.span("toolset check", 'toolset'):
+        return [name for name in tools if not _TOOLS[name].is_in_workspace(workspace_dir)]
+
+def install_missing_tools(
+    workspace_dir: str,
+    tools: list[str] | None = None,
+    max_workers: int | None = None,
+    project_dir: str | None = None
+) -> list[str]:
+    # project_dir enables lazy vcpkg ports mode, only ports needed by project are unpacked
+    missing_tools = get_missing_tools(workspace_dir, tools)
+    if len(missing_tools) == 0:
+        log.info("All tools are present in workspace toolset.")
+        return []
+
+    os.makedirs(workspace_dir, exist_ok=True)
+    max_workers = len(missing_tools) if max_workers is None else max_workers
+    log.info(f"Installing missing tools: {', '.join(missing_tools)} (workers: {max_workers})")
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="toolset") as executor:
+        futures = {
+            name: executor.submit(_download_tool, _TOOLS[name], workspace_dir, project_dir)
+            for name in missing_tools
+        }
+        # Result rethrows whatever happened in the worker, including exit() of tool modules
+        for name, future in futures.items():
+            future.result()
+    log.info(f"Missing tools installed in {time.perf_counter() - start:.2f}s")
+    return missing_tools
+
+def download_dependencies(
+    mode_toolset_configs: list[config.BuildToolsConfig],
+    multi_config: bool = False,
+    concurrent_pipelines: int = 1
+):
+    # Multi config installs conan packages of all modes into one folder and vcpkg ones for one triplet.
+    # concurrent_pipelines is number of these calls running at once (modes built at the same time).
+    # Conan installs of all of them wait for each other on conan cache lock, vcpkg ones don't,
+    # so at most one conan and concurrent_pipelines vcpkg installs share job budget
+    job_share = 1.0 / (concurrent_pipelines + 1)
+    def _download_conan_dependencies():
+        for mode_toolset_config in mode_toolset_configs:
+            conan.download_dependencies(mode_toolset_config, multi_config=multi_config, job_share=job_share)
+    process.run_tasks({
+        'conan': _download_conan_dependencies,
+        'vcpkg': functools.partial(vcpkg.download_dependencies, mode_toolset_configs[0], multi_config=multi_config, job_share=job_share),
+    })
+
+def setup_toolset(
+    workspace_dir: str,
+    project_dir: str,
+    build_mode: str,
+    max_workers: int | None = None
+) -> config.BuildToolsConfig:
+    install_missing_tools(workspace_dir, max_workers=max_workers, project_dir=project_dir)
+    return config.BuildToolsConfig(
+        _TOOLS["cmake"].get_exe_path(workspace_dir),
+        _TOOLS["conan"].get_exe_path(workspace_dir),
+        _TOOLS["vcpkg"].get_exe_path(workspace_dir),
+        _TOOLS["ninja"].get_exe_path(workspace_dir),
+        workspace_dir,
+        project_dir,
+        build_mode
+    )
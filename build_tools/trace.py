@@ -0,0 +1,127 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import typing
+
+from . import log
+
+"""
+Phase level tracing of build_tools runs in Chrome trace event format.
+Output file can be opened in chrome://tracing or https://ui.perfetto.dev
+
+Enabled with BUILD_TOOLS_TRACE=<output json path> environment variable or
+trace.enable(). Spans are recorded for build phases, downloads, unpacking and
+every child process. At exit trace is written and summary table is logged.
+When tracing is disabled spans cost one function call.
+"""
+
+_lock = threading.Lock()
+_events: list[dict] = []
+_thread_ids: dict[int, int] = {}
+_output_path: str | None = None
+_origin = time.perf_counter()
+
+def enable(output_path: str):
+    global _output_path
+    with _lock:
+        register_exit_handler = _output_path is None
+        _output_path = os.path.abspath(output_path)
+    if register_exit_handler:
+        atexit.register(_on_exit)
+
+def is_enabled() -> bool:
+    return _output_path is not None
+
+def _to_microseconds(perf_counter_time: float) -> float:
+    return round((perf_counter_time - _origin) * 1_000_000, 3)
+
+def _get_thread_id() -> int:
+    # Called under _lock. Small sequential ids read better in trace viewers than native ones
+    ident = threading.get_ident()
+    thread_id = _thread_ids.get(ident)
+    if thread_id is None:
+        thread_id = len(_thread_ids) + 1
+        _thread_ids[ident] = thread_id
+        _events.append({
+            'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id,
+            'args': {'name': threading.current_thread().name}
+        })
+    return thread_id
+
+def add_span(name: str, category: str, start: float, end: float, args: dict | None = None):
+    # start and end are time.perf_counter() values
+    if not is_enabled():
+        return
+    with _lock:
+        _events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': _to_microseconds(start),
+            'dur': round((end - start) * 1_000_000, 3),
+            'pid': os.getpid(),
+            'tid': _get_thread_id(),
+            'args': {} if args is None else args,
+        })
+
+@contextlib.contextmanager
+def span(name: str, category: str = 'phase', args: dict | None = None) -> typing.Iterator[dict]:
+    # Yields args of the span, so results can be attached to it before it ends
+    args = {} if args is None else args
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        add_span(name, category, start, time.perf_counter(), args)
+
+_Function = typing.TypeVar('_Function', bound=typing.Callable)
+
+def traced(name: str, category: str = 'phase') -> typing.Callable[[_Function], _Function]:
+    def _decorator(function: _Function) -> _Function:
+        @functools.wraps(function)
+        def _wrapper(*args, **kwargs):
+            with span(name, category):
+                return function(*args, **kwargs)
+        return typing.cast(_Function, _wrapper)
+    return _decorator
+
+def _write_trace(output_path: str, events: list[dict]):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="UTF-8") as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+def _log_summary(events: list[dict]):
+    # Spans with the same name are aggregated. Nested spans are counted in their parents too
+    totals: dict[tuple[str, str], list[float]] = {}
+    for event in events:
+        if event['ph'] != 'X':
+            continue
+        total = totals.setdefault((event['cat'], event['name']), [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += event['dur']
+        total[2] = max(total[2], event['dur'])
+    rows = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+
+    name_width = max([len('Name')] + [len(name) for (_, name) in totals.keys()])
+    category_width = max([len('Category')] + [len(category) for (category, _) in totals.keys()])
+    log.info(f"Trace summary (wall time: {time.perf_counter() - _origin:.2f}s):")
+    log.info(f"{'Category':<{category_width}} | {'Name':<{name_width}} | {'Count':>5} | {'Total [s]':>9} | {'Max [s]':>9}")
+    for (category, name), (count, total_us, max_us) in rows:
+        log.info(f"{category:<{category_width}} | {name:<{name_width}} | {count:>5} | {total_us / 1_000_000:>9.2f} | {max_us / 1_000_000:>9.2f}")
+
+def _on_exit():
+    with _lock:
+        events = list(_events)
+        output_path = _output_path
+    if output_path is None:
+        return
+    _write_trace(output_path, events)
+    _log_summary(events)
+    log.info(f"Trace written to '{output_path}'")
+
+if os.environ.get('BUILD_TOOLS_TRACE'):
+    enable(os.environ['BUILD_TOOLS_TRACE'])
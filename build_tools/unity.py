@@ -0,0 +1,295 @@
+import collections
+import dataclasses
+import json
+import os
+import re
+
+from . import build_report
+from . import cmake
+from . import commons
+from . import config
+from . import includes
+from . import log
+from . import trace
+
+"""
+Unity build with batches chosen by build_tools instead of fixed batch size.
+
+Sources of every target (and language) are clustered greedily by similarity
+(Jaccard index) of their include sets, so batch shares most of its headers and
+they are parsed once. Include sets are all headers read by object in the last
+build ('ninja -t deps'), or '#include' directives scanned from sources when it
+isn't known. Batch is capped by estimated preprocessed size: union of sizes of
+files read by its sources. Sources edited recently are never batched, edit
+compile loop recompiles just them, not the whole batch. Recent is relative to
+the last build (.ninja_log), not to wall clock, so fresh clone batches
+everything: source modified after the last build, or recompiled by it when it
+didn't compile everything (incremental build), is being edited.
+
+Batches are wired with UNITY_BUILD_MODE GROUP and UNITY_GROUP of sources from
+cmake file in project include dir (see cmake.get_project_include_dir()).
+Sources without group compile on their own. Batches apply only when cmake is
+configured with cmake.Config(unity_build=True).
+
+WORKSPACE_DIR/unity:
+    - baseline.json     - compile times of targets in the last build without
+                          batches, compared with batched ones in build report
+"""
+
+_MAX_BATCH_PREPROCESSED_SIZE = 8 * 1024 * 1024
+_MIN_SIMILARITY = 0.2
+_LANGUAGE_EXTENSIONS: dict[str, list[str]] = {
+    'CXX': ['.cpp', '.cc', '.cxx', '.c++', '.C'],
+    'C': ['.c'],
+}
+_CMAKE_INCLUDE_NAME = 'build_tools_unity.cmake'
+# CMake writes batches as CMakeFiles/<target>.dir/Unity/unity_<group>_<language>.<extension>
+_UNITY_SOURCE_PATTERN = re.compile(r'/Unity/unity_[^/]+$')
+
+@dataclasses.dataclass
+class UnitySource:
+    command: includes.CompileCommand
+    include_set: frozenset[str]
+    # Files read when compiling the source mapped to their sizes
+    files: dict[str, int]
+
+    @property
+    def size(self) -> int:
+        return sum(self.files.values())
+
+def get_unity_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/unity'
+
+def _get_cmake_include_path(workspace_dir: str) -> str:
+    return f'{cmake.get_project_include_dir(workspace_dir)}/{_CMAKE_INCLUDE_NAME}'
+
+def _get_baseline_path(workspace_dir: str) -> str:
+    return f'{get_unity_dir(workspace_dir)}/baseline.json'
+
+def _is_unity_source(source_path: str) -> bool:
+    return _UNITY_SOURCE_PATTERN.search(source_path) is not None
+
+def _get_language(source_path: str) -> str | None:
+    extension = os.path.splitext(source_path)[1]
+    for language, extensions in _LANGUAGE_EXTENSIONS.items():
+        if extension in extensions:
+            return language
+    return None
+
+def _expand_unity_commands(commands: list[includes.CompileCommand]) -> list[includes.CompileCommand]:
+    # Sources already batched by previous configuration are compiled like their batch
+    expanded: list[includes.CompileCommand] = []
+    for command in commands:
+        if not _is_unity_source(command.source):
+            expanded.append(command)
+            continue
+        for include in includes.scan_includes(command.source):
+            member = commons.normalize_path(include.name)
+            arguments = [
+                member if commons.normalize_path(os.path.join(command.directory, argument)) == command.source else argument
+                for argument in command.arguments
+            ]
+            expanded.append(includes.CompileCommand(command.directory, arguments, member, command.output))
+    return expanded
+
+def _get_file_sizes(paths: list[str], size_cache: dict[str, int]) -> dict[str, int]:
+    files: dict[str, int] = {}
+    for path in paths:
+        if path not in size_cache:
+            size_cache[path] = os.path.getsize(path) if os.path.isfile(path) else 0
+        files[path] = size_cache[path]
+    return files
+
+def _get_edited_sources(build_dir: str, commands: list[includes.CompileCommand]) -> set[str]:
+    # Sources modified after the last build and ones its incremental build recompiled
+    log_path = f'{build_dir}/.ninja_log'
+    if not os.path.exists(log_path):
+        return set()
+    last_build_time = os.path.getmtime(log_path)
+    edited = {command.source for command in commands if os.path.exists(command.source) and os.path.getmtime(command.source) > last_build_time}
+    # Log keeps outputs of the last build that did anything
+    rebuilt = {output for edge in build_report.parse_ninja_log(log_path) for output in edge.outputs}
+    if not all(command.output in rebuilt for command in commands):
+        # Rebuilt batch doesn't tell which of its sources was edited
+        sources_per_output = collections.Counter(command.output for command in commands)
+        edited |= {command.source for command in commands if command.output in rebuilt and sources_per_output[command.output] == 1}
+    return edited
+
+def _collect_sources(
+    commands: list[includes.CompileCommand],
+    deps: dict[str, list[str]],
+    edited_sources: set[str]
+) -> dict[tuple[str, str], list[UnitySource]]:
+    # Target and language mapped to sources that can be batched
+    grouped: dict[tuple[str, str], list[includes.CompileCommand]] = {}
+    seen: set[tuple[str, str]] = set()
+    for command in commands:
+        target = command.target
+        language = _get_language(command.source)
+        # Multi config build tree compiles every source once per configuration
+        if target is None or language is None or (target, command.source) in seen or not os.path.exists(command.source):
+            continue
+        seen.add((target, command.source))
+        if command.source in edited_sources:
+            log.info(f"unity: '{command.source}' was edited since the last build, it is not batched")
+            continue
+        grouped.setdefault((target, language), []).append(command)
+
+    size_cache: dict[str, int] = {}
+    result: dict[tuple[str, str], list[UnitySource]] = {}
+    for key, group_commands in grouped.items():
+        # First dependency of object is its source, objects of batches don't tell what their sources read
+        group_deps = [deps.get(command.output) for command in group_commands]
+        if all(object_deps is not None and len(object_deps) > 0 and object_deps[0] == command.source for object_deps, command in zip(group_deps, group_commands)):
+            result[key] = [
+                UnitySource(command, frozenset(object_deps[1:]), _get_file_sizes(object_deps, size_cache)) # type: ignore
+                for object_deps, command in zip(group_deps, group_commands)
+            ]
+            continue
+        sources: list[UnitySource] = []
+        for command in group_commands:
+            size = includes.get_preprocessed_size(command, f'#include "{command.source}"')
+            sources.append(UnitySource(
+                command,
+                frozenset(include.name for include in includes.scan_includes(command.source)),
+                {command.source: os.path.getsize(command.source) if size is None else size}
+            ))
+        result[key] = sources
+    return result
+
+def _get_similarity(first: frozenset[str] | set[str], second: frozenset[str] | set[str]) -> float:
+    union_size = len(first | second)
+    return 0.0 if union_size == 0 else len(first & second) / union_size
+
+def cluster(
+    sources: list[UnitySource],
+    max_size: int = _MAX_BATCH_PREPROCESSED_SIZE,
+    min_similarity: float = _MIN_SIMILARITY
+) -> list[list[UnitySource]]:
+    # Biggest source seeds the batch, then the most similar source that fits joins it, until none does.
+    # Order is deterministic, unchanged sources keep their batches and aren't rebuilt
+    remaining = sorted(sources, key=lambda source: (-source.size, source.command.source))
+    batches: list[list[UnitySource]] = []
+    while len(remaining) > 0:
+        seed = remaining.pop(0)
+        batch = [seed]
+        batch_includes = set(seed.include_set)
+        batch_files = dict(seed.files)
+        batch_size = seed.size
+        while True:
+            best: UnitySource | None = None
+            best_similarity = min_similarity
+            best_added_size = 0
+            for candidate in remaining:
+                similarity = _get_similarity(candidate.include_set, batch_includes)
+                if similarity < best_similarity or (best is not None and similarity == best_similarity):
+                    continue
+                added_size = sum(size for path, size in candidate.files.items() if path not in batch_files)
+                if batch_size + added_size > max_size:
+                    continue
+                best, best_similarity, best_added_size = candidate, similarity, added_size
+            if best is None:
+                break
+            remaining.remove(best)
+            batch.append(best)
+            batch_includes |= best.include_set
+            batch_files.update(best.files)
+            batch_size += best_added_size
+        batches.append(batch)
+    return batches
+
+def _write_cmake_include(cmake_include_path: str, groups: dict[str, dict[str, list[str]]]):
+    body_lines: list[str] = []
+    for target, target_groups in sorted(groups.items()):
+        body_lines += [
+            f'if(TARGET {target})',
+            f'    set_target_properties({target} PROPERTIES UNITY_BUILD ON UNITY_BUILD_MODE GROUP)',
+        ]
+        for group, sources in sorted(target_groups.items()):
+            quoted_sources = ' '.join(f'"{source}"' for source in sources)
+            body_lines.append(f'    set_source_files_properties({quoted_sources} TARGET_DIRECTORY {target} PROPERTIES UNITY_GROUP "{group}")')
+        body_lines.append('endif()')
+    cmake.write_deferred_project_include(cmake_include_path, 'unity', body_lines, 'BUILD_TOOLS_UNITY_BUILD')
+
+def _get_target_compile_times(edges: list[build_report.LogEdge], commands: list[includes.CompileCommand]) -> dict[str, int]:
+    # Sum of compile times of targets which had all their objects built in the last build.
+    # Partially rebuilt targets can't be compared
+    durations = {output: edge.duration for edge in edges for output in edge.outputs}
+    objects: dict[str, set[str]] = {}
+    for command in commands:
+        if command.target is not None:
+            objects.setdefault(command.target, set()).add(command.output)
+    return {
+        target: sum(durations[output] for output in target_objects)
+        for target, target_objects in objects.items()
+        if all(output in durations for output in target_objects)
+    }
+
+def _read_baselines(workspace_dir: str) -> dict[str, dict[str, int]]:
+    baseline_path = _get_baseline_path(workspace_dir)
+    if not os.path.exists(baseline_path):
+        return {}
+    with open(baseline_path, "r", encoding="UTF-8") as file:
+        return json.load(file)
+
+def _save_baseline(workspace_dir: str, build_dir: str, commands: list[includes.CompileCommand]):
+    # Newer build without batches replaces times of targets it built completely
+    log_path = f'{build_dir}/.ninja_log'
+    if any(_is_unity_source(command.source) for command in commands) or not os.path.exists(log_path):
+        return
+    target_times = _get_target_compile_times(build_report.parse_ninja_log(log_path), commands)
+    if len(target_times) == 0:
+        return
+    baselines = _read_baselines(workspace_dir)
+    baselines.setdefault(build_dir, {}).update(target_times)
+    with open(_get_baseline_path(workspace_dir), "w", encoding="UTF-8") as file:
+        json.dump(baselines, file, indent=4)
+
+@trace.traced("unity.generate")
+def generate(cmake_config: cmake.Config, toolset_config: config.BuildToolsConfig):
+    build_dir = cmake.get_config_files_path(cmake_config)
+    commands = includes.load_compile_commands(build_dir)
+    if len(commands) == 0:
+        log.warn(f"unity: no compile_commands.json in '{build_dir}'. Batches are generated on the next configure.")
+        return
+    os.makedirs(get_unity_dir(toolset_config.workspace_dir), exist_ok=True)
+    _save_baseline(toolset_config.workspace_dir, build_dir, commands)
+
+    deps = includes.load_ninja_deps(build_dir, toolset_config)
+    groups: dict[str, dict[str, list[str]]] = {}
+    expanded_commands = _expand_unity_commands(commands)
+    edited_sources = _get_edited_sources(build_dir, expanded_commands)
+    for (target, language), sources in sorted(_collect_sources(expanded_commands, deps, edited_sources).items()):
+        batches = [batch for batch in cluster(sources) if len(batch) > 1]
+        for index, batch in enumerate(batches):
+            groups.setdefault(target, {})[f'{language.lower()}{index}'] = sorted(source.command.source for source in batch)
+        batched_count = sum(len(batch) for batch in batches)
+        log.info(f"unity: target '{target}' ({language}) has {batched_count} of {len(sources)} sources in {len(batches)} batches")
+
+    if len(groups) == 0:
+        remove(toolset_config.workspace_dir)
+        return
+    _write_cmake_include(_get_cmake_include_path(toolset_config.workspace_dir), groups)
+
+def remove(workspace_dir: str):
+    cmake_include_path = _get_cmake_include_path(workspace_dir)
+    if os.path.exists(cmake_include_path):
+        os.remove(cmake_include_path)
+
+def log_comparison(cmake_config: cmake.Config, toolset_config: config.BuildToolsConfig):
+    # Compile times of targets built completely both without batches and with them in the last build
+    build_dir = cmake.get_config_files_path(cmake_config)
+    baseline = _read_baselines(toolset_config.workspace_dir).get(build_dir)
+    log_path = f'{build_dir}/.ninja_log'
+    commands = includes.load_compile_commands(build_dir)
+    if baseline is None or not os.path.exists(log_path) or not any(_is_unity_source(command.source) for command in commands):
+        return
+    target_times = _get_target_compile_times(build_report.parse_ninja_log(log_path), commands)
+    compared = sorted(target for target in target_times.keys() if target in baseline)
+    if len(compared) == 0:
+        log.info("Unity build: no target was built completely since batches were generated")
+        return
+    for target in compared:
+        before, after = baseline[target], target_times[target]
+        change = (before - after) / before * 100 if before > 0 else 0.0
+        log.info(f"Unity build: target '{target}' compiled in {after / 1000:.2f}s, {before / 1000:.2f}s without batches ({change:.1f}% faster)")
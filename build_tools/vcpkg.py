@@ -1,14 +1,21 @@
 import platform
 import typing
-import zipfile
 import os
+import re
 import shutil
-import urllib.request
 import json
+import zipfile
+import contextlib
 
+from . import archive
+from . import cache
 from . import commons
+from . import install
+from . import jobserver
 from . import log
+from . import resources
 from . import config
+from . import trace
 
 """
 vcpkg default structure for this configuration looks like this:
@@ -18,11 +25,39 @@ WORKSPACE_DIR/vcpkg:
     - vcpkg.exe/elf
     - vcpkg-triplets
         - <github repo>
-    - buildtrees
-    - install
-    - packages
+    - triplets                      - overlay triplets generated for build modes
+    - buildtrees/<triplet>
+    - install/<triplet>
+        - build_tools_index.json    - ports of installed database (vcpkg/status)
+                                      with their dependencies and cmake config dirs
+    - packages/<triplet>
+
+Release modes get release only triplet (VCPKG_BUILD_TYPE release), debug and
+multi config builds get triplet with both build types. Both include default
+triplet of the system and add options from environment:
+    - BUILD_TOOLS_VCPKG_LTO=ON      - link time optimization of release builds
+    - BUILD_TOOLS_VCPKG_MARCH=<cpu> - -march (/arch on windows) of all builds
+
+Built packages are kept in vcpkg binary cache (files provider) and downloaded
+sources in downloads cache, both under CACHE_DIR/vcpkg (see cache.get_cache_dir()),
+so they are shared by every workspace and survive removal of install dir.
+With cache disabled they are kept in WORKSPACE_DIR/vcpkg instead:
+    - archives                      - zipped packages by ABI hash, evicted least
+                                      recently installed first when they grow over
+                                      BUILD_TOOLS_VCPKG_CACHE_MAX_SIZE_MB (default 10240)
+    - downloads                     - source archives and tools
 """
 
+_DEFAULT_BINARY_CACHE_MAX_SIZE_MB = 10240
+_RELEASE_MODES = ['release', 'relwithdebinfo', 'minsizerel']
+_MACHINE_ARCHITECTURES = {'amd64': 'x64', 'x86_64': 'x64', 'arm64': 'arm64', 'aarch64': 'arm64'}
+# Install output lines naming port and triplet, features in brackets and version are ignored
+_SPEC_PATTERN = r'(?P<spec>[^\s:\[@]+)(?:\[[^\]]*\])?:(?P<triplet>[^\s@.:]+)'
+_INSTALLING_PATTERN = re.compile(rf'^Installing \d+/\d+ {_SPEC_PATTERN}')
+_BUILDING_PATTERN = re.compile(rf'^Building {_SPEC_PATTERN}')
+_ELAPSED_PATTERN = re.compile(rf'^Elapsed time to handle {_SPEC_PATTERN}: (?P<time>.+)$')
+_RESTORED_PATTERN = re.compile(r'^Restored (?P<count>\d+) package\(s\) from .* in (?P<time>.+?)\. ')
+
 def _error_log_and_die(msg: str) -> typing.NoReturn:
     log.error(msg)
     exit(-1)
@@ -40,124 +75,485 @@ def _vcpkg_2025_11_19_exec_download(workspace_dir: str) -> str:
         exit(-1)
 
     if commons.is_windows():
-        link = f"https://github.com/microsoft/vcpkg-tool/releases/download/2025-11-19/vcpkg.exe"
+        link = f"{commons.get_github_url()}/microsoft/vcpkg-tool/releases/download/2025-11-19/vcpkg.exe"
     else:
-        link = "https://github.com/microsoft/vcpkg-tool/releases/download/2025-11-19/vcpkg-glibc"
+        link = f"{commons.get_github_url()}/microsoft/vcpkg-tool/releases/download/2025-11-19/vcpkg-glibc"
     extract_path = f'{workspace_dir}/vcpkg'
     exe_ext = ".exe" if commons.is_windows() else ""
     exec_path = f'{extract_path}/vcpkg{exe_ext}'
 
+    # Executable is swapped in with a single rename, so it is never seen half-written
     log.info("Downloading vcpkg executable...")
-    os.makedirs(os.path.dirname(exec_path), exist_ok=True)
-    urllib.request.urlretrieve(link, exec_path)
+    staging_path = f'{exec_path}.staging'
+    cache.install_file(link, staging_path, executable=True)
+    os.replace(staging_path, exec_path)
     log.info("vcpkg executable downloaded")
 
     return exec_path
 
-def _vcpkg_2025_10_17_triplets_download(workspace_dir: str):
-    link = f"https://github.com/microsoft/vcpkg/archive/refs/tags/2025.10.17.zip"
-    downloaded_archive_path = f'{workspace_dir}/vcpkg-triplets-2025.10.17.zip'
-    files_output_path = f'{workspace_dir}/vcpkg'
-    archive_root_folder_name = 'vcpkg-2025.10.17'
-    renamed_archive_dir_path = f'{workspace_dir}/vcpkg/vcpkg-triplets'
-    
-
-    if os.path.exists(files_output_path):
-        log.info("Previous vcpkg download exists. Deleting...")
-        commons.delete_dir(files_output_path)
-
-    log.info("Downloading vcpkg triples...")
-    urllib.request.urlretrieve(link, downloaded_archive_path)
-    log.info("vcpkg triples downloaded.")
-
-    log.info("Unpacking vcpkg triples...")
-    with zipfile.ZipFile(downloaded_archive_path, 'r') as zip_file:
-        for file in zip_file.filelist:
-            if file.is_dir():
+def _vcpkg_2025_10_17_get_archive_link() -> str:
+    return f"{commons.get_github_url()}/microsoft/vcpkg/archive/refs/tags/2025.10.17.zip"
+
+_VCPKG_2025_10_17_ARCHIVE_ROOT_FOLDER_NAME = 'vcpkg-2025.10.17'
+
+def _vcpkg_2025_10_17_triplets_download(workspace_dir: str, project_dir: str | None = None):
+    # Only registry is replaced. Installed packages and buildtrees are kept,
+    # vcpkg checks their ABI hashes against new registry on next install
+    link = _vcpkg_2025_10_17_get_archive_link()
+    renamed_archive_dir_path = _vcpkg_2025_10_17_get_triplets_path(workspace_dir)
+    key_files = ['scripts/buildsystems/vcpkg.cmake']
+
+    log.info("Downloading and unpacking vcpkg triples...")
+    with install.staged_install(workspace_dir, renamed_archive_dir_path, key_files) as staging_dir:
+        # Without manifest there is nothing to resolve ports from, whole registry is unpacked
+        if project_dir is None or not os.path.exists(f'{project_dir}/vcpkg.json'):
+            # Tens of thousands of small port files, unpacking them is much faster on multiple threads
+            archive.stream_extract(link, staging_dir, "zip", archive.PathFilter(_VCPKG_2025_10_17_ARCHIVE_ROOT_FOLDER_NAME), parallel=True)
+        else:
+            with archive.local_copy(link) as zip_path:
+                archive.extract_zip_file(zip_path, staging_dir, _lazy_ports_path_filter(set()), parallel=True)
+                _write_lazy_ports_marker(staging_dir, [])
+                _extract_missing_ports(staging_dir, project_dir, zip_path)
+    log.info("vcpkg triples downloaded and unpacked")
+
+"""
+Lazy ports mode.
+Whole vcpkg registry is tens of thousands of files, project usually needs a handful.
+In lazy mode only top-level files, scripts/ and triplets/ are unpacked at first,
+then ports reachable from project vcpkg.json. Dependencies of ports are read from
+their vcpkg.json files inside archive, without unpacking it. Ports that are missing
+are unpacked at the beginning of download_dependencies().
+Unpacked ports are listed in LAZY_PORTS_MARKER file, its presence means lazy mode.
+"""
+
+_LAZY_PORTS_MARKER_NAME = '.build_tools_lazy_ports.json'
+
+def _get_lazy_ports_marker_path(triplets_dir: str) -> str:
+    return f'{triplets_dir}/{_LAZY_PORTS_MARKER_NAME}'
+
+def _read_lazy_ports_marker(triplets_dir: str) -> tuple[set[str], str | None] | None:
+    # Returns unpacked ports and hash of project vcpkg.json they were resolved for
+    marker_path = _get_lazy_ports_marker_path(triplets_dir)
+    if not os.path.exists(marker_path):
+        return None
+    with open(marker_path, "r", encoding="UTF-8") as file:
+        marker = json.load(file)
+    return set(marker['ports']), marker.get('manifest_sha256')
+
+def _write_lazy_ports_marker(triplets_dir: str, ports: list[str], manifest_sha256: str | None = None):
+    with open(_get_lazy_ports_marker_path(triplets_dir), "w", encoding="UTF-8") as file:
+        json.dump({'ports': sorted(ports), 'manifest_sha256': manifest_sha256}, file, indent=4)
+
+def _lazy_ports_path_filter(ports: set[str], only_ports: bool = False) -> archive.PathMapper:
+    root_filter = archive.PathFilter(_VCPKG_2025_10_17_ARCHIVE_ROOT_FOLDER_NAME)
+    def _mapper(member_path: str) -> str | None:
+        relative_path = root_filter(member_path)
+        if relative_path is None:
+            return None
+        parts = relative_path.split('/', 2)
+        if len(parts) == 1 or parts[0] in ['scripts', 'triplets']:
+            return None if only_ports else relative_path
+        if parts[0] == 'ports' and len(parts) == 3 and parts[1] in ports:
+            return relative_path
+        return None
+    return _mapper
+
+def _get_names(entries: list) -> set[str]:
+    # Dependencies and features are either plain names or objects with 'name'
+    names: set[str] = set()
+    for entry in entries:
+        if type(entry) == str:
+            names.add(entry)
+        elif type(entry) == dict and type(entry.get('name')) == str:
+            names.add(entry['name'])
+    return names
+
+def _get_manifest_features(manifest: dict) -> dict[str, dict]:
+    # Manifests keep features in object, older port manifests in list of objects with 'name'
+    features = manifest.get('features', {})
+    if type(features) == dict:
+        return {name: feature for name, feature in features.items() if type(feature) == dict}
+    return {feature['name']: feature for feature in features if type(feature) == dict and type(feature.get('name')) == str}
+
+def _get_manifest_dependency_names(manifest: dict) -> set[str]:
+    # All features are taken into account, it is cheaper to unpack port too much than to miss one
+    names = _get_names(manifest.get('dependencies', []))
+    for feature in _get_manifest_features(manifest).values():
+        names |= _get_names(feature.get('dependencies', []))
+    return names
+
+def _get_manifest_default_dependency_names(manifest: dict) -> set[str]:
+    # What install of manifest brings in: its dependencies and ones of its default features
+    names = _get_names(manifest.get('dependencies', []))
+    features = _get_manifest_features(manifest)
+    for feature_name in _get_names(manifest.get('default-features', [])):
+        names |= _get_names(features.get(feature_name, {}).get('dependencies', []))
+    return names
+
+def _resolve_ports_closure(zip_path: str, project_dir: str) -> set[str]:
+    with open(f'{project_dir}/vcpkg.json', "r", encoding="UTF-8") as file:
+        to_visit = _get_manifest_dependency_names(json.load(file))
+
+    resolved: set[str] = set()
+    with zipfile.ZipFile(zip_path, 'r') as zip_file:
+        archive_names = set(zip_file.namelist())
+        while len(to_visit) > 0:
+            port_name = to_visit.pop()
+            if port_name in resolved:
                 continue
-            output_path = f'{renamed_archive_dir_path}/{file.filename[len(archive_root_folder_name) + 1:]}'
-            output_path = os.path.dirname(output_path)
-            file.filename = os.path.basename(file.filename)
-            zip_file.extract(file, output_path)
-    log.info("vcpkg triples unpacked")
+            port_manifest_path = f'{_VCPKG_2025_10_17_ARCHIVE_ROOT_FOLDER_NAME}/ports/{port_name}/vcpkg.json'
+            if port_manifest_path not in archive_names:
+                log.warn(f"Port '{port_name}' not found in vcpkg registry archive. Skipping it.")
+                continue
+            resolved.add(port_name)
+            to_visit |= _get_manifest_dependency_names(json.loads(zip_file.read(port_manifest_path)))
+    return resolved
+
+def _extract_missing_ports(triplets_dir: str, project_dir: str, zip_path: str | None = None):
+    marker = _read_lazy_ports_marker(triplets_dir)
+    if marker is None:
+        return
+    extracted_ports, resolved_manifest_sha256 = marker
+    # Project without manifest needs no ports
+    if not os.path.exists(f'{project_dir}/vcpkg.json'):
+        return
+    # Unchanged vcpkg.json cannot require new ports, no need to open archive at all
+    manifest_sha256 = cache.file_sha256(f'{project_dir}/vcpkg.json')
+    if manifest_sha256 == resolved_manifest_sha256:
+        return
+
+    def _extract(zip_path: str):
+        required_ports = _resolve_ports_closure(zip_path, project_dir)
+        missing_ports = required_ports - extracted_ports
+        if len(missing_ports) == 0:
+            log.info("All vcpkg ports required by project are unpacked.")
+        else:
+            log.info(f"Unpacking vcpkg ports: {', '.join(sorted(missing_ports))}")
+            archive.extract_zip_file(
+                zip_path,
+                triplets_dir,
+                _lazy_ports_path_filter(missing_ports, only_ports=True),
+                parallel=True
+            )
+        _write_lazy_ports_marker(triplets_dir, list(extracted_ports | missing_ports), manifest_sha256)
+
+    if zip_path is not None:
+        _extract(zip_path)
+        return
+    with archive.local_copy(_vcpkg_2025_10_17_get_archive_link()) as zip_path:
+        _extract(zip_path)
 
 def _get_triplets_path(workspace_dir: str) -> str:
     return _vcpkg_2025_10_17_get_triplets_path(workspace_dir)
 
-def _get_buildtrees_dir(workspace_dir: str) -> str:
-    return f'{workspace_dir}/vcpkg/buildtrees/'
+def _get_overlay_triplets_dir(workspace_dir: str) -> str:
+    return f'{workspace_dir}/vcpkg/triplets'
+
+# Every triplet has its own roots, manifest install removes packages of other triplets from its install root
+def _get_buildtrees_dir(workspace_dir: str, triplet: str) -> str:
+    return f'{workspace_dir}/vcpkg/buildtrees/{triplet}/'
+
+def _get_packages_dir(workspace_dir: str, triplet: str) -> str:
+    return f'{workspace_dir}/vcpkg/packages/{triplet}/'
+
+def _get_install_dir(workspace_dir: str, triplet: str) -> str:
+    return f'{workspace_dir}/vcpkg/install/{triplet}/'
+
+def _get_base_triplet() -> str:
+    architecture = _MACHINE_ARCHITECTURES.get(platform.machine().lower(), 'x64')
+    return f'{architecture}-{platform.system().lower()}'
+
+def get_triplet(config: config.BuildToolsConfig, multi_config: bool = False) -> str:
+    # Multi config build tree needs debug and release packages at once
+    release_only = not multi_config and config.build_mode.lower() in _RELEASE_MODES
+    return f'{_get_base_triplet()}-build-tools{"-release" if release_only else ""}'
+
+def _get_triplet_lines(release_only: bool) -> list[str]:
+    # Paths of workspace are kept out, triplet content is part of ABI and binary cache is shared by workspaces
+    lines = [f'include("${{VCPKG_ROOT_DIR}}/triplets/{_get_base_triplet()}.cmake")']
+    if release_only:
+        lines.append('set(VCPKG_BUILD_TYPE release)')
+    march = os.environ.get('BUILD_TOOLS_VCPKG_MARCH', '')
+    if march != '':
+        march_flag = f'/arch:{march}' if commons.is_windows() else f'-march={march}'
+        lines += [
+            f'string(APPEND VCPKG_C_FLAGS " {march_flag}")',
+            f'string(APPEND VCPKG_CXX_FLAGS " {march_flag}")',
+        ]
+    if os.environ.get('BUILD_TOOLS_VCPKG_LTO', 'OFF').upper() in ['ON', '1', 'TRUE']:
+        compile_flag, link_flag = ('/GL', '/LTCG') if commons.is_windows() else ('-flto', '-flto')
+        lines += [
+            f'string(APPEND VCPKG_C_FLAGS_RELEASE " {compile_flag}")',
+            f'string(APPEND VCPKG_CXX_FLAGS_RELEASE " {compile_flag}")',
+            f'string(APPEND VCPKG_LINKER_FLAGS_RELEASE " {link_flag}")',
+        ]
+    return lines
+
+def _write_overlay_triplet(workspace_dir: str, triplet: str):
+    # Rewritten only when changed, content of triplet is part of ABI hash of every package
+    content = '\n'.join(_get_triplet_lines(triplet.endswith('-release'))) + '\n'
+    triplet_path = f'{_get_overlay_triplets_dir(workspace_dir)}/{triplet}.cmake'
+    if os.path.exists(triplet_path):
+        with open(triplet_path, "r", encoding="UTF-8") as file:
+            if file.read() == content:
+                return
+    os.makedirs(_get_overlay_triplets_dir(workspace_dir), exist_ok=True)
+    with open(triplet_path, "w", encoding="UTF-8") as file:
+        file.write(content)
+
+def _get_shared_dir(workspace_dir: str) -> str:
+    cache_dir = cache.get_cache_dir()
+    return f'{workspace_dir}/vcpkg' if cache_dir is None else f'{cache_dir}/vcpkg'
+
+def _get_binary_cache_dir(workspace_dir: str) -> str:
+    return f'{_get_shared_dir(workspace_dir)}/archives'
+
+def _get_downloads_dir(workspace_dir: str) -> str:
+    return f'{_get_shared_dir(workspace_dir)}/downloads'
+
+def _get_binary_cache_max_size() -> int:
+    return int(os.environ.get('BUILD_TOOLS_VCPKG_CACHE_MAX_SIZE_MB', _DEFAULT_BINARY_CACHE_MAX_SIZE_MB)) * 1024 * 1024
 
-def _get_packages_dir(workspace_dir: str) -> str:
-    return f'{workspace_dir}/vcpkg/packages/'
+def _read_status_paragraphs(workspace_dir: str, triplet: str) -> list[dict[str, str]]:
+    # Installed database is status file with incremental updates applied in order,
+    # later paragraph of the same package, architecture and feature replaces earlier one
+    database_dir = f'{_get_install_dir(workspace_dir, triplet)}/vcpkg'
+    paths = [f'{database_dir}/status']
+    updates_dir = f'{database_dir}/updates'
+    if os.path.isdir(updates_dir):
+        paths += [f'{updates_dir}/{name}' for name in sorted(os.listdir(updates_dir)) if name.isdigit()]
+    paragraphs: dict[tuple[str, str, str], dict[str, str]] = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path, "r", encoding="UTF-8") as file:
+            for block in re.split(r'\n\s*\n', file.read()):
+                fields: dict[str, str] = {}
+                for line in block.splitlines():
+                    key, separator, value = line.partition(':')
+                    if separator != '' and not line.startswith(' '):
+                        fields[key.strip()] = value.strip()
+                if 'Package' in fields:
+                    paragraphs[(fields['Package'], fields.get('Architecture', ''), fields.get('Feature', ''))] = fields
+    return [fields for fields in paragraphs.values() if fields.get('Status', '').endswith(' installed')]
 
-def _get_install_dir(workspace_dir: str) -> str:
-    return f'{workspace_dir}/vcpkg/install/'
+def _touch_installed_archives(workspace_dir: str, triplet: str):
+    # Files provider doesn't mark restored archives, installed ones are marked used here
+    binary_cache_dir = _get_binary_cache_dir(workspace_dir)
+    for fields in _read_status_paragraphs(workspace_dir, triplet):
+        abi = fields.get('Abi')
+        if abi is None:
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(f'{binary_cache_dir}/{abi[:2]}/{abi}.zip')
 
-def _get_cmake_configs_dir(workspace_dir: str) -> str:
-    return f'{_get_install_dir(workspace_dir)}/x64-{platform.system().lower()}/share/'
+def evict_binary_cache(workspace_dir: str, max_size: int | None = None):
+    max_size = _get_binary_cache_max_size() if max_size is None else max_size
+    binary_cache_dir = _get_binary_cache_dir(workspace_dir)
+    if not os.path.isdir(binary_cache_dir):
+        return
+    archives: list[tuple[float, int, str]] = []
+    total_size = 0
+    for bucket in os.scandir(binary_cache_dir):
+        if not bucket.is_dir():
+            continue
+        for archive_entry in os.scandir(bucket.path):
+            if not archive_entry.is_file():
+                continue
+            archive_stat = archive_entry.stat()
+            archives.append((archive_stat.st_mtime, archive_stat.st_size, archive_entry.path))
+            total_size += archive_stat.st_size
+    if total_size <= max_size:
+        return
+    archives.sort()
+    removed_count = 0
+    for _, archive_size, archive_path in archives:
+        if total_size <= max_size:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(archive_path)
+        total_size -= archive_size
+        removed_count += 1
+    log.info(f"vcpkg binary cache: evicted {removed_count} packages, {total_size / (1024 * 1024):.0f} MiB left")
+
+def _log_install_summary(stdout: str):
+    # Packages installed by this run, each either restored from binary cache or built
+    installed: list[str] = []
+    built: set[str] = set()
+    elapsed: dict[str, str] = {}
+    restore_time: str | None = None
+    for line in stdout.splitlines():
+        line = line.strip()
+        if (match := _INSTALLING_PATTERN.match(line)) is not None:
+            installed.append(f'{match["spec"]}:{match["triplet"]}')
+        elif (match := _BUILDING_PATTERN.match(line)) is not None:
+            built.add(f'{match["spec"]}:{match["triplet"]}')
+        elif (match := _ELAPSED_PATTERN.match(line)) is not None:
+            elapsed[f'{match["spec"]}:{match["triplet"]}'] = match["time"]
+        elif (match := _RESTORED_PATTERN.match(line)) is not None and int(match["count"]) > 0:
+            restore_time = match["time"]
+    if len(installed) == 0:
+        log.info("vcpkg: all packages are already installed")
+        return
+    restored = [spec for spec in installed if spec not in built]
+    if len(restored) > 0:
+        restore_info = '' if restore_time is None else f' in {restore_time}'
+        log.info(f"vcpkg: restored {len(restored)} packages from binary cache{restore_info}: {', '.join(restored)}")
+    for spec in installed:
+        if spec in built:
+            log.info(f"vcpkg: built '{spec}' in {elapsed.get(spec, 'unknown time')}")
 
 def is_vcpkg_systemwide_installed() -> bool:
     return shutil.which("vcpkg") is not None
 
 def is_vcpkg_in_workspace_toolset(workspace_dir: str) -> bool:
     exe_present = os.path.exists(_vcpkg_2025_11_19_get_exec_path(workspace_dir))
-    triplets_present = os.path.exists(_vcpkg_2025_10_17_get_triplets_path(workspace_dir))
+    triplets_present = install.is_installed(_vcpkg_2025_10_17_get_triplets_path(workspace_dir))
     return exe_present and triplets_present
 
 def get_toolset_vcpkg_exe_path(workspace_dir: str) -> str:
     return _vcpkg_2025_11_19_get_exec_path(workspace_dir)
 
-def download_vcpkg(workspace_dir: str):
-    _vcpkg_2025_10_17_triplets_download(workspace_dir)
+def download_vcpkg(workspace_dir: str, project_dir: str | None = None):
+    # With project_dir set only ports needed by its vcpkg.json are unpacked (lazy ports mode)
+    _vcpkg_2025_10_17_triplets_download(workspace_dir, project_dir)
     return _vcpkg_2025_11_19_exec_download(workspace_dir)
 
-def try_to_find_dependencies(config: config.BuildToolsConfig) -> list[str]:
-    json_path = f'{config.project_dir}/vcpkg.json'
-    with open(json_path, "r", encoding="UTF-8") as file:
-        json_string = file.read()
-    deps_json = json.loads(json_string)
-
-    json_deps_array: list[dict] = deps_json['dependencies']
-    if type(json_deps_array) != list:
-        _error_log_and_die("vcpkg.json have invalid format. 'dependencies' must be an list of dicts")
-    
-    deps_to_look_for: set[str] = set()
-    for json_dep in json_deps_array:
-        if type(json_dep) != dict:
-            _error_log_and_die("vcpkg.json have invalid format. 'dependencies' must be an list of dicts")
-        json_dep_name = json_dep['name']
-        if json_dep_name == None:
-            _error_log_and_die("vcpkg.json have invalid format. 'dependencies/name' must be present and type str")
-        deps_to_look_for.add(json_dep_name)
-
-    vcpkg_deps_dir = _get_cmake_configs_dir(config.workspace_dir)
-    def _find_deps() -> set[str]:
-        deps_found: set[str] = set()
-        for dependency_folder in os.listdir(vcpkg_deps_dir):
-            if dependency_folder in deps_to_look_for:
-                deps_found.add(commons.realpath(f"{vcpkg_deps_dir}/{dependency_folder}/"))
-                deps_to_look_for.remove(dependency_folder)
-        return deps_found
-    return list(_find_deps())
-
-
-def download_dependencies(config: config.BuildToolsConfig):
+def _get_database_stamp(workspace_dir: str, triplet: str) -> list | None:
+    # Every install writes status file or adds update file next to it
+    database_dir = f'{_get_install_dir(workspace_dir, triplet)}/vcpkg'
+    try:
+        status_mtime = os.stat(f'{database_dir}/status').st_mtime_ns
+    except FileNotFoundError:
+        return None
+    updates_dir = f'{database_dir}/updates'
+    updates = sorted(name for name in os.listdir(updates_dir) if name.isdigit()) if os.path.isdir(updates_dir) else []
+    return [status_mtime, updates[-1] if len(updates) > 0 else None]
+
+def _get_dependency_names(depends: str) -> list[str]:
+    # 'fmt, zlib[core]:x64-linux' -> ['fmt', 'zlib'], host dependencies are listed with their triplet too
+    return [re.split(r'[\[:]', dependency.strip(), maxsplit=1)[0] for dependency in depends.split(',') if dependency.strip() != '']
+
+def _get_config_dirs(info_dir: str, package: str, triplet: str) -> list[str]:
+    # Directories of package with '<name>Config.cmake' or '<name>-config.cmake', file list paths are relative to install root
+    config_dirs: set[str] = set()
+    if not os.path.isdir(info_dir):
+        return []
+    for list_name in os.listdir(info_dir):
+        if not list_name.startswith(f'{package}_') or not list_name.endswith(f'_{triplet}.list'):
+            continue
+        with open(f'{info_dir}/{list_name}', "r", encoding="UTF-8") as file:
+            for line in file.read().splitlines():
+                file_name = line.rsplit('/', 1)[-1].lower()
+                if file_name.endswith('config.cmake'):
+                    config_dirs.add(line.rsplit('/', 1)[0])
+    return sorted(config_dirs)
+
+def _build_index(workspace_dir: str, triplet: str) -> dict[str, dict[str, list[str]]]:
+    # Port of the triplet mapped to its dependencies and directories with its cmake configs
+    info_dir = f'{_get_install_dir(workspace_dir, triplet)}/vcpkg/info'
+    index: dict[str, dict[str, list[str]]] = {}
+    for fields in _read_status_paragraphs(workspace_dir, triplet):
+        if fields.get('Architecture') != triplet:
+            continue
+        package = fields['Package']
+        entry = index.setdefault(package, {'depends': [], 'config_dirs': []})
+        # Features add their own dependencies
+        entry['depends'] = sorted(set(entry['depends']) | set(_get_dependency_names(fields.get('Depends', ''))) - {package})
+        if 'Feature' not in fields:
+            entry['config_dirs'] = _get_config_dirs(info_dir, package, triplet)
+    return index
+
+def _load_index(workspace_dir: str, triplet: str) -> dict[str, dict[str, list[str]]]:
+    # Index is rebuilt only when installed database changes
+    stamp = _get_database_stamp(workspace_dir, triplet)
+    if stamp is None:
+        return {}
+    index_path = f'{_get_install_dir(workspace_dir, triplet)}/build_tools_index.json'
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="UTF-8") as file:
+            with contextlib.suppress(ValueError):
+                stored = json.load(file)
+                if stored.get('stamp') == stamp:
+                    return stored['ports']
+    index = _build_index(workspace_dir, triplet)
+    with open(index_path, "w", encoding="UTF-8") as file:
+        json.dump({'stamp': stamp, 'ports': index}, file, indent=4)
+    return index
+
+@trace.traced("vcpkg.try_to_find_dependencies")
+def try_to_find_dependencies(config: config.BuildToolsConfig, multi_config: bool = False) -> list[str]:
+    # CMake config directories of dependencies of the project and everything they depend on
+    # Dependencies of optional features are installed only when enabled, they aren't expected
+    with open(f'{config.project_dir}/vcpkg.json', "r", encoding="UTF-8") as file:
+        direct_dependencies = _get_manifest_default_dependency_names(json.load(file))
+
+    triplet = get_triplet(config, multi_config)
+    index = _load_index(config.workspace_dir, triplet)
+    if len(index) == 0:
+        log.warn(f"vcpkg dependencies for '{config.build_mode}' are not installed, download them first")
+        return []
+
+    install_dir = _get_install_dir(config.workspace_dir, triplet)
+    config_dirs: set[str] = set()
+    visited: set[str] = set()
+    to_visit = set(direct_dependencies)
+    while len(to_visit) > 0:
+        package = to_visit.pop()
+        if package in visited:
+            continue
+        visited.add(package)
+        entry = index.get(package)
+        if entry is None:
+            if package in direct_dependencies:
+                log.warn(f"vcpkg dependency '{package}' is not installed for '{triplet}'")
+            continue
+        config_dirs |= {commons.realpath(f'{install_dir}/{config_dir}') for config_dir in entry['config_dirs']}
+        to_visit |= set(entry['depends'])
+    # Sorted, prefix paths are part of configure fingerprint
+    return sorted(config_dirs)
+
+
+@trace.traced("vcpkg.download_dependencies")
+def download_dependencies(config: config.BuildToolsConfig, multi_config: bool = False, job_share: float = 1.0):
     if config.vcpkg_exe is None: log.error("vcpkg.download_dependencies(): config.vcpkg_exe must be set"); exit(-1)
 
-    os.makedirs(_get_install_dir(config.workspace_dir), exist_ok=True)
-    os.makedirs(_get_buildtrees_dir(config.workspace_dir), exist_ok=True)
-    os.makedirs(_get_packages_dir(config.workspace_dir), exist_ok=True)
+    # Installs running at once share ports directory and its marker, first one unpacks, the rest find ports in place
+    with commons.file_lock(f'{config.workspace_dir}/vcpkg/.build_tools_ports.lock', "vcpkg ports"):
+        _extract_missing_ports(_vcpkg_2025_10_17_get_triplets_path(config.workspace_dir), config.project_dir)
+
+    triplet = get_triplet(config, multi_config)
+    _write_overlay_triplet(config.workspace_dir, triplet)
+    os.makedirs(_get_install_dir(config.workspace_dir, triplet), exist_ok=True)
+    os.makedirs(_get_buildtrees_dir(config.workspace_dir, triplet), exist_ok=True)
+    os.makedirs(_get_packages_dir(config.workspace_dir, triplet), exist_ok=True)
+    os.makedirs(_get_binary_cache_dir(config.workspace_dir), exist_ok=True)
+    os.makedirs(_get_downloads_dir(config.workspace_dir), exist_ok=True)
 
     env = os.environ.copy()
     env['VCPKG_ROOT'] = _get_triplets_path(config.workspace_dir)
+    # Share of job budget, when vcpkg builds alongside other tools
+    jobs = max(int(resources.get_job_count(config.workspace_dir, resources.VCPKG) * job_share), 1)
+    env['VCPKG_MAX_CONCURRENCY'] = str(jobs)
+    # Packages are restored from binary cache instead of being built again, sources aren't downloaded again
+    env['VCPKG_BINARY_SOURCES'] = f'clear;files,{_get_binary_cache_dir(config.workspace_dir)},readwrite'
+    env['VCPKG_DOWNLOADS'] = _get_downloads_dir(config.workspace_dir)
 
-    commons.execute_process([
-        config.vcpkg_exe, "install", 
-        "--x-install-root", _get_install_dir(config.workspace_dir),
-        "--x-buildtrees-root", _get_buildtrees_dir(config.workspace_dir),
-        "--x-packages-root", _get_packages_dir(config.workspace_dir),
-        "--clean-downloads-after-build",
-        "--clean-buildtrees-after-build",
-        "--clean-after-build",
-        "--clean-packages-after-build"
-    ], config.project_dir, env)
+    # vcpkg doesn't pass jobserver to port builds, its jobs are taken out of the pool while it runs
+    active_jobserver = jobserver.get_active()
+    with active_jobserver.reserve(jobs) if active_jobserver is not None else contextlib.nullcontext():
+        result = commons.run_process([
+            config.vcpkg_exe, "install", 
+            "--triplet", triplet,
+            "--overlay-triplets", _get_overlay_triplets_dir(config.workspace_dir),
+            "--x-install-root", _get_install_dir(config.workspace_dir, triplet),
+            "--x-buildtrees-root", _get_buildtrees_dir(config.workspace_dir, triplet),
+            "--x-packages-root", _get_packages_dir(config.workspace_dir, triplet),
+            # Build intermediates are useless once package is in binary cache
+            "--clean-buildtrees-after-build",
+            "--clean-packages-after-build"
+        ], config.project_dir, env, keep_stdout=True)
+    resources.record_peak_rss(config.workspace_dir, resources.VCPKG, result.peak_rss)
+    _log_install_summary(result.stdout or '')
+    _touch_installed_archives(config.workspace_dir, triplet)
+    evict_binary_cache(config.workspace_dir)
@@ -1,22 +1,22 @@
 import os
-import urllib.request
 import glob
 import pickle
 
+from . import cache
 from . import commons
 from . import log
+from . import trace
 
 def _get_vswhere_dir(workspace_dir: str):
     return f'{workspace_dir}/vswhere'
 
 def _download_vswhere(workspace_dir: str) -> str:
-    link = "https://github.com/microsoft/vswhere/releases/download/3.1.7/vswhere.exe"
+    link = f"{commons.get_github_url()}/microsoft/vswhere/releases/download/3.1.7/vswhere.exe"
     downloaded_exe = f'{_get_vswhere_dir(workspace_dir)}/vswhere.exe'
-    os.makedirs(os.path.dirname(downloaded_exe), exist_ok=True)
 
     if not os.path.exists(downloaded_exe):
         log.info("Downloading vswhere executable...")
-        urllib.request.urlretrieve(link, downloaded_exe)
+        cache.install_file(link, downloaded_exe)
         log.info("vswhere downloaded.")
     else:
         log.info("vswhere already present. Won't download.")
@@ -118,6 +118,7 @@ def _pickle_and_save_environment(env_dict: dict[str, str], file_path: str):
     with open(file_path, 'wb') as file:
         pickle.dump(env_dict, file, protocol=pickle.HIGHEST_PROTOCOL)
 
+@trace.traced("vcvarsall.load_vcvarsall_env_if_possible")
 def load_vcvarsall_env_if_possible(workspace_dir: str, project_dir: str) -> bool:
     if not commons.is_windows():
         log.warn("vcvarsall.bat can be only found on windows. Won't event try to do anything, as we are not on windows")
@@ -22,21 +22,18 @@ sys.path.append(f'{WORKSPACE_DIR}/build_tools/')
 
 import shutil
 import argparse
+import dataclasses
+import functools
 import build_tools #type: ignore
 
 def setup_toolset(args: argparse.Namespace) -> build_tools.BuildToolsConfig:
     os.makedirs(WORKSPACE_DIR, exist_ok=True)
     # If you want all tools to be downloaded, or some to be downloaded this is 
     # the fragment you want to mess with. It is default for this script
-    if not build_tools.cmake.is_cmake_in_workspace_toolset(WORKSPACE_DIR):
-        build_tools.cmake.download_cmake(WORKSPACE_DIR)
-    if not build_tools.conan.is_conan_in_workspace_toolset(WORKSPACE_DIR):
-        build_tools.conan.download_conan(WORKSPACE_DIR)
-    if not build_tools.vcpkg.is_vcpkg_in_workspace_toolset(WORKSPACE_DIR):
-        build_tools.vcpkg.download_vcpkg(WORKSPACE_DIR)
-    if not build_tools.ninja.is_ninja_in_workspace_toolset(WORKSPACE_DIR):
-        build_tools.ninja.download_ninja(WORKSPACE_DIR)
-        
+    # Missing tools are downloaded concurrently, remove names you don't want
+    # With project_dir vcpkg unpacks only ports reachable from vcpkg.json, remove it to get all of them
+    build_tools.toolset.install_missing_tools(WORKSPACE_DIR, tools=["cmake", "conan", "vcpkg", "ninja"], project_dir=PROJECT_DIR)
+
     cmake_exe = build_tools.cmake.get_toolset_cmake_exe_path(WORKSPACE_DIR)
     conan_exe = build_tools.conan.get_toolset_conan_exe_path(WORKSPACE_DIR)
     vcpkg_exe = build_tools.vcpkg.get_toolset_vcpkg_exe_path(WORKSPACE_DIR)
@@ -63,42 +60,98 @@ def main():
     parser.add_argument('-c', '--config', default=False, action='store_true', help="Build cmake config.")
     parser.add_argument('-b', '--build', default=False, action='store_true', help="CMake build.")
     parser.add_argument('-r', '--rebuild', default=False, action='store_true', help="CMake delete cache and rebuild.")
-    parser.add_argument('-m', '--mode', default="debug", help="Build mode. [debug, release, ...]")
+    parser.add_argument('-m', '--mode', default="debug", help="Build mode, comma separated modes are built at once. [debug, release, debug,release, ...]")
+    parser.add_argument('--all-modes', default=False, action='store_true', help="Build debug and release at once. Same as -m debug,release")
     parser.add_argument('-d', '--dependencies', default=False, action='store_true', help="Download dependencies")
+    parser.add_argument('--multi-config', default=False, action='store_true', help="One 'Ninja Multi-Config' build tree for all modes, configured and built once")
     parser.add_argument('--clion', default=False, action='store_true', help="Create CLion configurations for the project")
+    parser.add_argument('--pch', default=False, action='store_true', help="Generate precompiled headers from include statistics of the last build and reconfigure")
+    parser.add_argument('--pch-remove', default=False, action='store_true', help="Remove generated precompiled headers and reconfigure")
+    parser.add_argument('--unity', default=False, action='store_true', help="Unity build with sources batched by similarity of their includes, batches are regenerated on configure")
+    parser.add_argument('--build-report', default=False, action='store_true', help="Report slowest compile and link steps, critical path and parallelism of the last build")
+    parser.add_argument('--trace', default=None, help="Write Chrome trace of the run to given json file and print time summary at exit")
     args = parser.parse_args()
 
+    if args.trace is not None:
+        build_tools.trace.enable(args.trace)
+
+    # Several modes are built at once, sharing one job budget
+    modes = ["debug", "release"] if args.all_modes else [mode.strip() for mode in args.mode.split(',') if mode.strip() != ""]
     toolset_config = setup_toolset(args)
-    cmake_config = build_tools.cmake.Config(
-        build_dir = f'{toolset_config.workspace_dir}/cmake/build',
-        list_dir = f'{toolset_config.project_dir}',
-        build_type = args.mode,
-        prefix_paths = [] # If you want some, put some
-    )
-    
+    if args.dependencies or args.build or args.rebuild:
+        # Every build started from here shares one job budget
+        build_tools.jobserver.start(build_tools.resources.get_job_count(toolset_config.workspace_dir))
+    toolset_configs = [dataclasses.replace(toolset_config, build_mode=mode) for mode in modes]
+    cmake_configs = [
+        build_tools.cmake.Config(
+            build_dir = f'{toolset_config.workspace_dir}/cmake/build',
+            list_dir = f'{toolset_config.project_dir}',
+            build_type = mode,
+            prefix_paths = [], # If you want some, put some
+            unity_build = args.unity,
+            multi_config_types = modes if args.multi_config else None
+        )
+        # Multi config tree is one for all modes
+        for mode in (modes[:1] if args.multi_config else modes)
+    ]
+
     if args.dependencies:
         build_tools.conan.create_profiles(toolset_config)
-        build_tools.conan.download_dependencies(toolset_config)
-        build_tools.vcpkg.download_dependencies(toolset_config)
 
-    vcpkg_dependencies: list[str] = []
-    if args.config or args.rebuild or args.clion:
-        vcpkg_dependencies = build_tools.vcpkg.try_to_find_dependencies(toolset_config)
-
-    if args.rebuild or args.config or args.build:
+    # Generated headers are wired into cmake configuration, so both need it
+    reconfigure = args.config or args.rebuild or args.pch or args.pch_remove
+    for cmake_config, mode_toolset_config in zip(cmake_configs, toolset_configs):
+        if args.pch:
+            build_tools.pch.generate(cmake_config, mode_toolset_config)
+        # Batches come from the last build, before rebuild deletes it
+        if reconfigure and args.unity:
+            build_tools.unity.generate(cmake_config, mode_toolset_config)
+    if args.pch_remove:
+        build_tools.pch.remove(toolset_config.workspace_dir)
+
+    if reconfigure or args.build:
         build_tools.vcvarsall.load_vcvarsall_env_if_possible(WORKSPACE_DIR, PROJECT_DIR)
 
-    if args.rebuild:
-        build_tools.cmake.delete_cache(cmake_config)
-
-    if args.config or args.rebuild:
-        build_tools.cmake.configure(cmake_config, toolset_config, vcpkg_dependencies)
-
-    if args.build or args.rebuild:
-        build_tools.cmake.build_project(cmake_config, toolset_config)
+    def _run_mode_pipeline(cmake_config: build_tools.cmake.Config, mode_toolset_config: build_tools.BuildToolsConfig):
+        if args.dependencies and not args.multi_config:
+            # Installs of every mode built at once share job budget
+            build_tools.toolset.download_dependencies([mode_toolset_config], concurrent_pipelines=len(modes))
+        # vcpkg packages of every mode are installed for its own triplet
+        vcpkg_dependencies: list[str] = []
+        if reconfigure:
+            vcpkg_dependencies = build_tools.vcpkg.try_to_find_dependencies(mode_toolset_config, args.multi_config)
+        # Cache is deleted only when configuration is out of date, otherwise rebuild just cleans
+        if args.rebuild and build_tools.cmake.get_configure_change(cmake_config, mode_toolset_config, vcpkg_dependencies) is not None:
+            build_tools.cmake.delete_cache(cmake_config)
+        if reconfigure:
+            # Headers generated or removed just now always get configured, whatever the fingerprint says
+            build_tools.cmake.configure(cmake_config, mode_toolset_config, vcpkg_dependencies, force=args.pch or args.pch_remove)
+        if args.build or args.rebuild:
+            build_tools.cmake.build_project(cmake_config, mode_toolset_config, clean_first=args.rebuild)
+
+    if args.multi_config:
+        # Conan installs of all modes go to one folder, tree is configured and built once for all of them
+        if args.dependencies:
+            build_tools.toolset.download_dependencies(toolset_configs, multi_config=True)
+        _run_mode_pipeline(cmake_configs[0], toolset_configs[0])
+    elif len(modes) == 1:
+        _run_mode_pipeline(cmake_configs[0], toolset_configs[0])
+    else:
+        # Output of processes of every mode is prefixed with its name
+        build_tools.process.run_tasks({
+            mode: functools.partial(_run_mode_pipeline, cmake_config, mode_toolset_config)
+            for mode, cmake_config, mode_toolset_config in zip(modes, cmake_configs, toolset_configs)
+        })
+
+    if args.build_report:
+        for cmake_config, mode_toolset_config in zip(cmake_configs, toolset_configs):
+            build_tools.build_report.report(cmake_config, mode_toolset_config)
+            build_tools.pch.log_comparison(cmake_config, mode_toolset_config)
+            build_tools.unity.log_comparison(cmake_config, mode_toolset_config)
 
     if args.clion:
-        build_tools.clion.create_build_tools_configurations(cmake_config, toolset_config, vcpkg_dependencies)
+        vcpkg_dependencies = build_tools.vcpkg.try_to_find_dependencies(toolset_configs[0], args.multi_config)
+        build_tools.clion.create_build_tools_configurations(cmake_configs[0], toolset_configs[0], vcpkg_dependencies)
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,9 @@
 import os
+import hashlib
+import platform
+import re
 import shutil
+import tempfile
 import urllib.request
 import zipfile
 import argparse
@@ -17,6 +21,76 @@ DEFAULT_WORKSPACE_NAME = ".workspace"
 def log(msg: str):
     print(f"[BUILD_TOOLS][SETUP.PY] {msg}", flush=True)
 
+def _get_cache_dir() -> str | None:
+    # Same download cache that build_tools use (see build_tools/cache.py). It has to
+    # be duplicated here, as this script works before build_tools are downloaded
+    cache_dir = os.environ.get('BUILD_TOOLS_CACHE_DIR')
+    if cache_dir is not None:
+        return None if len(cache_dir) == 0 else cache_dir.replace('\\', '/')
+    if platform.system() == "Windows":
+        base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~/AppData/Local'))
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return f'{base_dir}/build_tools'.replace('\\', '/')
+
+def _file_sha256(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(1024 * 1024):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def _resolve_branch_archive(zip_link: str, zip_prefix: str) -> tuple[str, str]:
+    # Branch archive changes over time, archive of its current commit never does and can be cached.
+    # Commit comes from git ref advertisement (what 'git ls-remote' reads), it has no API rate limit.
+    # Release setup.py downloads tag archive (see _create_release.py), it is cached as it is
+    match = re.fullmatch(r'(?P<repo>.+)/archive/refs/heads/(?P<branch>.+)\.zip', zip_link)
+    if match is None:
+        return zip_link, zip_prefix
+    try:
+        with urllib.request.urlopen(f'{match["repo"]}.git/info/refs?service=git-upload-pack', timeout=30) as response:
+            refs = response.read()
+    except OSError as error:
+        log(f"Resolving commit of '{match['branch']}' failed ({error}), downloading branch archive")
+        return zip_link, zip_prefix
+    commit_match = re.search(rb'([0-9a-f]{40}) refs/heads/' + re.escape(match["branch"].encode("UTF-8")) + rb'[\0\n]', refs)
+    if commit_match is None:
+        log(f"Commit of '{match['branch']}' not found, downloading branch archive")
+        return zip_link, zip_prefix
+    commit = commit_match[1].decode("UTF-8")
+    # Archive root folder is named after repository and commit instead of branch
+    return f'{match["repo"]}/archive/{commit}.zip', f'{zip_prefix[:-len(match["branch"]) - 1]}{commit}/'
+
+def _cached_download(url: str, file_path: str):
+    cache_dir = _get_cache_dir()
+    # Branch archives change over time, only archives of tags and commits can be cached
+    if cache_dir is None or '/refs/heads/' in url:
+        urllib.request.urlretrieve(url, file_path)
+        return
+
+    downloads_dir = f'{cache_dir}/downloads'
+    entry_path = f'{downloads_dir}/urls/{hashlib.sha256(url.encode("UTF-8")).hexdigest()}'
+    if os.path.exists(entry_path):
+        with open(entry_path, "r", encoding="UTF-8") as file:
+            object_path = f'{downloads_dir}/objects/{file.readline().strip()}'
+        if os.path.exists(object_path) and _file_sha256(object_path) == os.path.basename(object_path):
+            log(f"Using cached '{url}'")
+            os.utime(object_path)
+            shutil.copyfile(object_path, file_path)
+            return
+
+    urllib.request.urlretrieve(url, file_path)
+    object_hash = _file_sha256(file_path)
+    for dir_name in ['objects', 'urls', 'tmp']:
+        os.makedirs(f'{downloads_dir}/{dir_name}', exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=f'{downloads_dir}/tmp', delete=False) as object_file:
+        with open(file_path, 'rb') as file:
+            shutil.copyfileobj(file, object_file)
+    os.replace(object_file.name, f'{downloads_dir}/objects/{object_hash}')
+    with tempfile.NamedTemporaryFile("w", dir=f'{downloads_dir}/tmp', delete=False, encoding="UTF-8") as entry_file:
+        entry_file.write(f'{object_hash}\n{url}\n')
+    os.replace(entry_file.name, entry_path)
+
 def setup_build_tools(workspace_folder: str, workspace_name: str, working_dir: str, generate_project: bool, overwrite_files: bool):
     zip_path = f"{workspace_folder}/build_tools.zip"
     extract_path = f"{workspace_folder}/build_tools"
@@ -34,14 +108,21 @@ def setup_build_tools(workspace_folder: str, workspace_name: str, working_dir: s
     log('Downloading the build_tools files...')
     os.makedirs(workspace_folder, exist_ok=True)
     os.makedirs(extract_path, exist_ok=True)
-    urllib.request.urlretrieve(RELEASE_ZIP_LINK, zip_path)
+    zip_link, zip_prefix = _resolve_branch_archive(RELEASE_ZIP_LINK, GITHUB_ZIP_PREFIX)
+    _cached_download(zip_link, zip_path)
+    # Same single pass as build_tools/archive.py extract_zip(), which cannot be imported yet
     with zipfile.ZipFile(zip_path, 'r') as zip_file:
-        zip_infos = zip_file.infolist()
-        for zip_info in zip_infos:
-            if zip_info.filename == GITHUB_ZIP_PREFIX:
+        created_dirs: set[str] = set()
+        for zip_info in zip_file.infolist():
+            if zip_info.is_dir() or not zip_info.filename.startswith(zip_prefix):
                 continue
-            zip_info.filename = zip_info.filename.replace(GITHUB_ZIP_PREFIX, '')
-            zip_file.extract(zip_info, extract_path)
+            output_path = f'{extract_path}/{zip_info.filename[len(zip_prefix):]}'
+            output_dir = os.path.dirname(output_path)
+            if output_dir not in created_dirs:
+                os.makedirs(output_dir, exist_ok=True)
+                created_dirs.add(output_dir)
+            with zip_file.open(zip_info, 'r') as source, open(output_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
     os.remove(zip_path)
     #END: Downloading the build_tools files
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import build_tools from the repository and helpers from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
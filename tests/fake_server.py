@@ -0,0 +1,97 @@
+import hashlib
+import http.server
+import re
+import threading
+import time
+
+"""
+Local HTTP server standing in for github in tests.
+
+Serves files from memory with ETag and Range/If-Range support. Failures are
+injected per path: HTTP statuses returned before content and connections
+dropped after given number of body bytes. Responses of paths with delay are
+held back, so downloads running at once can be told from sequential ones.
+"""
+
+class FakeServer:
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.fail_statuses: dict[str, list[int]] = {}
+        self.drop_after: dict[str, list[int]] = {}
+        self.delays: dict[str, float] = {}
+        self.requests: list[tuple[str, dict[str, str]]] = []
+        self._lock = threading.Lock()
+        server = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_empty(self, status: int, headers: dict[str, str] | None = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append((self.path, dict(self.headers.items())))
+                    statuses = server.fail_statuses.get(self.path, [])
+                    status = statuses.pop(0) if len(statuses) > 0 else None
+                    drops = server.drop_after.get(self.path, [])
+                    drop_after = drops.pop(0) if len(drops) > 0 else None
+                    data = server.files.get(self.path)
+                    delay = server.delays.get(self.path, 0.0)
+                time.sleep(delay)
+                if status is not None:
+                    self._send_empty(status)
+                    return
+                if data is None:
+                    self._send_empty(404)
+                    return
+                etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+                start = 0
+                range_header = self.headers.get('Range')
+                if_range = self.headers.get('If-Range')
+                if range_header is not None and (if_range is None or if_range == etag):
+                    start = int(re.match(r'bytes=(\d+)-', range_header)[1]) # type: ignore
+                    if start >= len(data):
+                        self._send_empty(416, {'Content-Range': f'bytes */{len(data)}'})
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+                else:
+                    self.send_response(200)
+                body = data[start:]
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if drop_after is not None:
+                    self.wfile.write(body[:drop_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        class _Server(http.server.ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                # Clients dropping connections on purpose are not errors
+                pass
+
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def __enter__(self) -> 'FakeServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from build_tools import cache
+from build_tools import commons
+
+from fake_server import FakeServer
+
+_CONTENT = bytes(range(256)) * 4096
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.server.files['/file.bin'] = _CONTENT
+        self.url = f'{self.server.url}/file.bin'
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        patcher = unittest.mock.patch.dict(os.environ, {'BUILD_TOOLS_CACHE_DIR': f'{self.temp_dir}/cache'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_second_fetch_is_cache_hit(self):
+        first_path = cache.fetch(self.url)
+        self.assertEqual(cache.fetch(self.url), first_path)
+        with open(first_path, 'rb') as file:
+            self.assertEqual(file.read(), _CONTENT)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_object_bigger_than_cache_is_kept_for_caller(self):
+        with unittest.mock.patch.dict(os.environ, {'BUILD_TOOLS_CACHE_MAX_SIZE_MB': '0'}):
+            cached_path = cache.fetch(self.url)
+            with open(cached_path, 'rb') as file:
+                self.assertEqual(file.read(), _CONTENT)
+
+    @unittest.skipIf(commons.is_windows(), "no unix permissions")
+    def test_executable_install_leaves_cached_object_mode(self):
+        cache.install_file(self.url, f'{self.temp_dir}/data.bin')
+        cache.install_file(self.url, f'{self.temp_dir}/tool', executable=True)
+        cached_path = cache.lookup(self.url)
+        assert cached_path is not None
+        self.assertTrue(os.access(f'{self.temp_dir}/tool', os.X_OK))
+        self.assertFalse(os.access(cached_path, os.X_OK))
+        self.assertFalse(os.access(f'{self.temp_dir}/data.bin', os.X_OK))
+
+if __name__ == '__main__':
+    unittest.main()
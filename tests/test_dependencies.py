@@ -0,0 +1,152 @@
+import dataclasses
+import functools
+import inspect
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from build_tools import commons
+from build_tools import config
+from build_tools import jobserver
+from build_tools import process
+from build_tools import toolset
+
+def _count_free_tokens(auth: str) -> int:
+    # Tokens left in jobserver pool, taken and given back at once
+    fd = os.open(auth[len('fifo:'):], os.O_RDWR | os.O_NONBLOCK)
+    try:
+        tokens = os.read(fd, 1024)
+    except BlockingIOError:
+        tokens = b''
+    os.write(fd, tokens)
+    os.close(fd)
+    return len(tokens)
+
+# Stand-in for conan and vcpkg: sleeps, fails when asked to, creates conan output folder and logs its start, end, job count, triplet and free jobserver tokens
+_FAKE_TOOL = '''\
+import json, os, sys, time
+name = os.path.basename(sys.argv[0])
+record = {
+    'tool': name,
+    'jobs': next((int(arg.split('=')[1]) for arg in sys.argv if arg.startswith('tools.build:jobs=')), None) if name == 'conan'
+        else int(os.environ['VCPKG_MAX_CONCURRENCY']),
+    'triplet': sys.argv[sys.argv.index('--triplet') + 1] if '--triplet' in sys.argv else None,
+    'start': time.time(),
+}
+auth = next((flag.split('=', 1)[1] for flag in os.environ.get('MAKEFLAGS', '').split() if flag.startswith('--jobserver-auth=')), None)
+if auth is not None:
+    record['free_tokens'] = _count_free_tokens(auth)
+time.sleep(float(os.environ.get(f'FAKE_{name.upper()}_SECONDS', '0.5')))
+if os.environ.get(f'FAKE_{name.upper()}_FAIL') is not None:
+    sys.exit(1)
+if '--output-folder' in sys.argv:
+    os.makedirs(sys.argv[sys.argv.index('--output-folder') + 1], exist_ok=True)
+record['end'] = time.time()
+with open(os.environ['FAKE_TOOLS_LOG'], 'a') as file:
+    file.write(json.dumps(record) + '\\n')
+'''
+
+@unittest.skipIf(commons.is_windows(), "fake tools are python scripts with shebang")
+class DownloadDependenciesTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.workspace_dir = f'{temp_dir.name}/workspace'
+        self.project_dir = f'{temp_dir.name}/project'
+        os.makedirs(self.workspace_dir)
+        os.makedirs(self.project_dir)
+        self.log_path = f'{temp_dir.name}/tools.log'
+        tools = {}
+        for name in ['conan', 'vcpkg']:
+            tools[name] = f'{temp_dir.name}/bin/{name}'
+            os.makedirs(os.path.dirname(tools[name]), exist_ok=True)
+            with open(tools[name], 'w', encoding='UTF-8') as file:
+                file.write(f'#!{sys.executable}\nimport os\n{inspect.getsource(_count_free_tokens)}{_FAKE_TOOL}')
+            os.chmod(tools[name], 0o755)
+        self.config = config.BuildToolsConfig('cmake', tools['conan'], tools['vcpkg'], None, self.workspace_dir, self.project_dir, 'debug')
+        patcher = unittest.mock.patch.dict(os.environ, {
+            'FAKE_TOOLS_LOG': self.log_path,
+            'BUILD_TOOLS_JOBS': '12',
+            'BUILD_TOOLS_CACHE_DIR': f'{temp_dir.name}/cache',
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read_records(self) -> list[dict]:
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path, encoding='UTF-8') as file:
+            return [json.loads(line) for line in file]
+
+    def _download_modes(self, modes: list[str]):
+        # Same as build_user_file, every mode installs its dependencies in its own task
+        process.run_tasks({
+            mode: functools.partial(toolset.download_dependencies, [dataclasses.replace(self.config, build_mode=mode)], concurrent_pipelines=len(modes))
+            for mode in modes
+        })
+
+    def test_conan_and_vcpkg_install_at_once(self):
+        start = time.monotonic()
+        toolset.download_dependencies([self.config])
+        elapsed = time.monotonic() - start
+        records = {record['tool']: record for record in self._read_records()}
+        self.assertEqual(set(records.keys()), {'conan', 'vcpkg'})
+        self.assertLess(records['conan']['start'], records['vcpkg']['end'])
+        self.assertLess(records['vcpkg']['start'], records['conan']['end'])
+        self.assertLess(elapsed, 0.95)
+        # Half of job budget each
+        self.assertEqual(records['conan']['jobs'], 6)
+        self.assertEqual(records['vcpkg']['jobs'], 6)
+
+    def test_modes_at_once_share_job_budget(self):
+        self._download_modes(['debug', 'release'])
+        records = self._read_records()
+        self.assertEqual(sorted(record['tool'] for record in records), ['conan', 'conan', 'vcpkg', 'vcpkg'])
+        # Installs running at the same moment never exceed job budget
+        for record in records:
+            running = [other for other in records if other['start'] <= record['start'] < other['end']]
+            self.assertLessEqual(sum(other['jobs'] for other in running), 12)
+        # Conan installs of modes wait for each other, vcpkg ones of their triplets run together
+        conan_records = sorted((record for record in records if record['tool'] == 'conan'), key=lambda record: record['start'])
+        self.assertLessEqual(conan_records[0]['end'], conan_records[1]['start'])
+        vcpkg_records = [record for record in records if record['tool'] == 'vcpkg']
+        self.assertEqual(len({record['triplet'] for record in vcpkg_records}), 2)
+        self.assertLess(max(record['start'] for record in vcpkg_records), min(record['end'] for record in vcpkg_records))
+
+    def test_vcpkg_jobs_reserved_from_jobserver(self):
+        jobserver.start(12)
+        self.addCleanup(jobserver.stop)
+        toolset.download_dependencies([self.config])
+        records = {record['tool']: record for record in self._read_records()}
+        # Conan draws from the pool, vcpkg holds all of its jobs but the implicit one
+        self.assertEqual(records['conan']['jobs'], 0)
+        self.assertEqual(records['vcpkg']['jobs'], 6)
+        self.assertEqual(records['vcpkg']['free_tokens'], 11 - 5)
+        # Tokens are given back
+        self.assertEqual(_count_free_tokens(jobserver.get_active().auth), 11) # type: ignore
+
+    def test_failure_stops_other_install(self):
+        with unittest.mock.patch.dict(os.environ, {'FAKE_VCPKG_FAIL': '1', 'FAKE_VCPKG_SECONDS': '0.2', 'FAKE_CONAN_SECONDS': '30'}):
+            start = time.monotonic()
+            with self.assertRaises(SystemExit):
+                toolset.download_dependencies([self.config])
+            elapsed = time.monotonic() - start
+        # Other install was terminated instead of being waited for, none of them finished, exit() of commons is re-raised
+        self.assertLess(elapsed, 10)
+        self.assertEqual(self._read_records(), [])
+
+    def test_failure_stops_other_modes(self):
+        with unittest.mock.patch.dict(os.environ, {'FAKE_CONAN_FAIL': '1', 'FAKE_CONAN_SECONDS': '0.2', 'FAKE_VCPKG_SECONDS': '30'}):
+            start = time.monotonic()
+            with self.assertRaises(SystemExit):
+                self._download_modes(['debug', 'release'])
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 10)
+        self.assertEqual(self._read_records(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from build_tools import cache
+from build_tools import download
+
+from fake_server import FakeServer
+
+_CONTENT = bytes(range(256)) * 4096
+_CHANGED_CONTENT = bytes(reversed(range(256))) * 4096
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.server.files['/file.bin'] = _CONTENT
+        self.url = f'{self.server.url}/file.bin'
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.target_path = f'{self.temp_dir}/file.bin'
+        # Retries of injected failures don't wait
+        patcher = unittest.mock.patch.object(download, '_BACKOFF_START_SECONDS', 0.001)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read_target(self) -> bytes:
+        with open(self.target_path, 'rb') as file:
+            return file.read()
+
+    def _write_partial(self, content: bytes, validator: str | None):
+        with open(f'{self.target_path}.part', 'wb') as file:
+            file.write(content)
+        if validator is not None:
+            with open(f'{self.target_path}.part.validator', 'w', encoding='UTF-8') as file:
+                file.write(f'{self.url}\n{validator}\n')
+
+    def _get_etag(self) -> str:
+        with download.open_url(self.url) as stream:
+            stream.read()
+            assert stream.validator is not None
+            return stream.validator
+
+    def test_download(self):
+        download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CONTENT)
+        self.assertFalse(os.path.exists(f'{self.target_path}.part.validator'))
+
+    def test_dropped_connections_are_resumed(self):
+        self.server.drop_after['/file.bin'] = [1000, 5000, 10]
+        download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CONTENT)
+        ranges = [headers.get('Range') for _, headers in self.server.requests]
+        self.assertEqual(ranges, [None, 'bytes=1000-', 'bytes=6000-', 'bytes=6010-'])
+        # Resumed requests are guarded with validator of the first response
+        self.assertTrue(all('If-Range' in headers for _, headers in self.server.requests[1:]))
+
+    def test_retryable_statuses_are_retried(self):
+        self.server.fail_statuses['/file.bin'] = [503, 429]
+        download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CONTENT)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_not_found_exits(self):
+        with self.assertRaises(SystemExit):
+            download.download_file(f'{self.server.url}/missing.bin', self.target_path)
+
+    def test_partial_file_of_previous_run_is_resumed(self):
+        etag = self._get_etag()
+        self._write_partial(_CONTENT[:100000], etag)
+        self.server.requests.clear()
+        download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CONTENT)
+        self.assertEqual(self.server.requests[0][1].get('Range'), 'bytes=100000-')
+
+    def test_partial_file_of_changed_content_is_restarted(self):
+        etag = self._get_etag()
+        self._write_partial(_CONTENT[:100000], etag)
+        self.server.files['/file.bin'] = _CHANGED_CONTENT
+        download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CHANGED_CONTENT)
+
+    def test_partial_file_without_validator_is_restarted(self):
+        self._write_partial(b'garbage', None)
+        download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CONTENT)
+        self.assertNotIn('Range', self.server.requests[0][1])
+
+    def test_complete_partial_file_is_finished(self):
+        etag = self._get_etag()
+        self._write_partial(_CONTENT, etag)
+        with unittest.mock.patch.object(download.log, 'info') as log_info:
+            download.download_file(self.url, self.target_path)
+        self.assertEqual(self._read_target(), _CONTENT)
+        self.assertTrue(any('Downloaded' in call.args[0] for call in log_info.call_args_list))
+
+    def _interrupt_cached_download(self, size: int):
+        with self.assertRaises(KeyboardInterrupt):
+            with cache.open_url(self.url) as stream:
+                stream.read(size)
+                raise KeyboardInterrupt()
+
+    def test_cache_miss_is_resumed_by_next_run(self):
+        with unittest.mock.patch.dict(os.environ, {'BUILD_TOOLS_CACHE_DIR': f'{self.temp_dir}/cache'}):
+            self._interrupt_cached_download(50000)
+            self.server.requests.clear()
+            cached_path = cache.fetch(self.url)
+            with open(cached_path, 'rb') as file:
+                self.assertEqual(file.read(), _CONTENT)
+            self.assertEqual(self.server.requests[0][1].get('Range'), 'bytes=50000-')
+
+    def test_resumed_cache_miss_streams_whole_content(self):
+        with unittest.mock.patch.dict(os.environ, {'BUILD_TOOLS_CACHE_DIR': f'{self.temp_dir}/cache'}):
+            self._interrupt_cached_download(70000)
+            with cache.open_url(self.url) as stream:
+                self.assertEqual(stream.read(), _CONTENT)
+            self.assertIsNotNone(cache.lookup(self.url))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from build_tools import cmake
+from build_tools import config
+from build_tools import pch
+
+_CMAKE_LISTS = '''\
+cmake_minimum_required(VERSION 3.19)
+project(sample CXX)
+add_executable(sample main.cpp first.cpp second.cpp)
+'''
+_SOURCE = '''\
+#include <map>
+#include <string>
+#include <vector>
+int {name}() {{ std::map<std::string, std::vector<int>> values; return int(values.size()); }}
+'''
+
+@unittest.skipIf(any(shutil.which(tool) is None for tool in ['cmake', 'ninja', 'c++']), "needs cmake, ninja and C++ compiler")
+class PchConfigureTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        workspace_dir = f'{temp_dir.name}/workspace'
+        project_dir = f'{temp_dir.name}/project'
+        os.makedirs(project_dir)
+        with open(f'{project_dir}/CMakeLists.txt', 'w', encoding='UTF-8') as file:
+            file.write(_CMAKE_LISTS)
+        for name in ['first', 'second']:
+            with open(f'{project_dir}/{name}.cpp', 'w', encoding='UTF-8') as file:
+                file.write(_SOURCE.format(name=name))
+        with open(f'{project_dir}/main.cpp', 'w', encoding='UTF-8') as file:
+            file.write(_SOURCE.format(name='run') + 'int first(); int second();\nint main() { return first() + second() + run(); }\n')
+        self.toolset_config = config.BuildToolsConfig('cmake', None, None, shutil.which('ninja'), workspace_dir, project_dir, 'debug')
+        self.cmake_config = cmake.Config(project_dir, f'{workspace_dir}/cmake/build', 'debug')
+        # Project include wrapper is passed to configure from the very first run
+        patcher = unittest.mock.patch.dict(os.environ, {'BUILD_TOOLS_COMPILER_CACHE': 'builtin', 'BUILD_TOOLS_JOBS': '2'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _uses_pch(self) -> bool:
+        with open(f'{cmake.get_config_files_path(self.cmake_config)}/build.ninja', 'r', encoding='UTF-8') as file:
+            return 'cmake_pch' in file.read()
+
+    def test_generated_headers_are_configured(self):
+        cmake.configure(self.cmake_config, self.toolset_config)
+        cmake.build_project(self.cmake_config, self.toolset_config)
+        self.assertFalse(self._uses_pch())
+        pch.generate(self.cmake_config, self.toolset_config)
+        self.assertIsNotNone(cmake.get_configure_change(self.cmake_config, self.toolset_config))
+        cmake.configure(self.cmake_config, self.toolset_config)
+        self.assertTrue(self._uses_pch())
+        self.assertIsNone(cmake.get_configure_change(self.cmake_config, self.toolset_config))
+        pch.remove(self.toolset_config.workspace_dir)
+        cmake.configure(self.cmake_config, self.toolset_config)
+        self.assertFalse(self._uses_pch())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
+
+import setup
+
+from fake_server import FakeServer
+
+_COMMIT = '0123456789abcdef0123456789abcdef01234567'
+_BUILD_USER_FILE = b'# build.py template\n'
+
+def _make_archive(root: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        zip_file.writestr(f'{root}/', b'')
+        zip_file.writestr(f'{root}/build_user_file.py', _BUILD_USER_FILE)
+        zip_file.writestr(f'{root}/build_tools/__init__.py', b'')
+    return buffer.getvalue()
+
+def _make_refs(branch: str, commit: str) -> bytes:
+    # Smart HTTP ref advertisement, first ref carries capabilities after NUL
+    lines = [
+        b'001e# service=git-upload-pack\n0000',
+        f'{commit} HEAD\0multi_ack side-band-64k\n'.encode(),
+        f'{commit} refs/heads/{branch}\n'.encode(),
+        f'{"f" * 40} refs/heads/{branch}-other\n'.encode(),
+    ]
+    return b''.join(lines[:1] + [f'{len(line) + 4:04x}'.encode() + line for line in lines[1:]]) + b'0000'
+
+class SetupBuildToolsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.server.files['/owner/build.git/info/refs?service=git-upload-pack'] = _make_refs('master', _COMMIT)
+        self.server.files[f'/owner/build/archive/{_COMMIT}.zip'] = _make_archive(f'build-{_COMMIT}')
+        self.server.files['/owner/build/archive/refs/heads/master.zip'] = _make_archive('build-master')
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        patchers = [
+            unittest.mock.patch.object(setup, 'RELEASE_ZIP_LINK', f'{self.server.url}/owner/build/archive/refs/heads/master.zip'),
+            unittest.mock.patch.dict(os.environ, {'BUILD_TOOLS_CACHE_DIR': f'{self.temp_dir}/cache'}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _setup_project(self, name: str) -> str:
+        working_dir = f'{self.temp_dir}/{name}'
+        os.makedirs(working_dir)
+        setup.setup_build_tools(f'{working_dir}/.workspace', '.workspace', working_dir, False, False)
+        with open(f'{working_dir}/build.py', 'rb') as file:
+            self.assertEqual(file.read(), _BUILD_USER_FILE)
+        self.assertTrue(os.path.exists(f'{working_dir}/.workspace/build_tools/build_tools/__init__.py'))
+        return working_dir
+
+    def _get_archive_requests(self) -> list[str]:
+        return [path for path, _ in self.server.requests if path.endswith('.zip')]
+
+    def test_branch_resolved_to_cached_commit_archive(self):
+        self._setup_project('first')
+        self.assertEqual(self._get_archive_requests(), [f'/owner/build/archive/{_COMMIT}.zip'])
+        # Branch still points at the same commit, its archive comes from cache
+        self._setup_project('second')
+        self.assertEqual(self._get_archive_requests(), [f'/owner/build/archive/{_COMMIT}.zip'])
+
+    def test_unresolved_branch_is_downloaded_every_time(self):
+        self.server.fail_statuses['/owner/build.git/info/refs?service=git-upload-pack'] = [503, 503]
+        self._setup_project('first')
+        self._setup_project('second')
+        self.assertEqual(self._get_archive_requests(), ['/owner/build/archive/refs/heads/master.zip'] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+import unittest.mock
+import zipfile
+
+from build_tools import cmake
+from build_tools import commons
+from build_tools import conan
+from build_tools import ninja
+from build_tools import toolset
+from build_tools import vcpkg
+
+from fake_server import FakeServer
+
+_DELAY_SECONDS = 0.5
+
+def _make_tar(root: str | None, files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar_file:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name if root is None else f'{root}/{name}')
+            info.size = len(data)
+            info.mode = 0o755
+            tar_file.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def _make_zip(root: str | None, files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        for name, data in files.items():
+            info = zipfile.ZipInfo(name if root is None else f'{root}/{name}')
+            # Unix permissions, as zip of ninja release has them
+            info.external_attr = 0o755 << 16
+            zip_file.writestr(info, data)
+    return buffer.getvalue()
+
+# Release archives of every tool, laid out as on github
+_ARCHIVES = {
+    '/Kitware/CMake/releases/download/v4.2.0/cmake-4.2.0-linux-x86_64.tar.gz': _make_tar('cmake-4.2.0-linux-x86_64', {
+        'bin/cmake': b'#!/bin/sh\n',
+        'bin/ctest': b'#!/bin/sh\n',
+        'doc/readme.txt': b'doc',
+        'share/cmake-4.2/Modules/Module.cmake': b'module',
+    }),
+    '/conan-io/conan/releases/download/2.23.0/conan-2.23.0-linux-x86_64.tgz': _make_tar(None, {
+        'bin/conan': b'#!/bin/sh\n',
+        'bin/_internal/library.so': b'library',
+    }),
+    '/ninja-build/ninja/releases/download/v1.13.2/ninja-linux.zip': _make_zip(None, {'ninja': b'#!/bin/sh\n'}),
+    '/microsoft/vcpkg-tool/releases/download/2025-11-19/vcpkg-glibc': b'#!/bin/sh\n',
+    '/microsoft/vcpkg/archive/refs/tags/2025.10.17.zip': _make_zip('vcpkg-2025.10.17', {
+        'scripts/buildsystems/vcpkg.cmake': b'vcpkg',
+        'triplets/x64-linux.cmake': b'set(VCPKG_TARGET_ARCHITECTURE x64)\n',
+        'ports/rapidjson/vcpkg.json': json.dumps({'name': 'rapidjson', 'dependencies': [{'name': 'vcpkg-cmake', 'host': True}]}).encode(),
+        'ports/rapidjson/portfile.cmake': b'rapidjson',
+        'ports/vcpkg-cmake/vcpkg.json': json.dumps({'name': 'vcpkg-cmake'}).encode(),
+        'ports/unused/vcpkg.json': json.dumps({'name': 'unused'}).encode(),
+    }),
+}
+
+@unittest.skipIf(not commons.is_linux(), "served archives are linux ones")
+class InstallMissingToolsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.server.files.update(_ARCHIVES)
+        # Every download waits, concurrent installs wait once
+        self.server.delays.update({path: _DELAY_SECONDS for path in _ARCHIVES.keys()})
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.workspace_dir = f'{temp_dir.name}/workspace'
+        self.project_dir = f'{temp_dir.name}/project'
+        os.makedirs(self.project_dir)
+        with open(f'{self.project_dir}/vcpkg.json', 'w', encoding='UTF-8') as file:
+            json.dump({'name': 'project', 'dependencies': ['rapidjson']}, file)
+        patcher = unittest.mock.patch.dict(os.environ, {
+            'BUILD_TOOLS_GITHUB_URL': self.server.url,
+            'BUILD_TOOLS_CACHE_DIR': f'{temp_dir.name}/cache',
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_install_missing_tools(self):
+        start = time.monotonic()
+        installed = toolset.install_missing_tools(self.workspace_dir, project_dir=self.project_dir)
+        elapsed = time.monotonic() - start
+        self.assertEqual(sorted(installed), ['cmake', 'conan', 'ninja', 'vcpkg'])
+        self.assertEqual(toolset.get_missing_tools(self.workspace_dir), [])
+        # vcpkg downloads registry and executable one after another, the rest runs alongside
+        self.assertLess(elapsed, 4 * _DELAY_SECONDS)
+        for exe_path in [
+            cmake.get_toolset_cmake_exe_path(self.workspace_dir),
+            conan.get_toolset_conan_exe_path(self.workspace_dir),
+            ninja.get_toolset_ninja_exe_path(self.workspace_dir),
+            vcpkg.get_toolset_vcpkg_exe_path(self.workspace_dir),
+        ]:
+            self.assertTrue(os.access(exe_path, os.X_OK), exe_path)
+        # Excluded directories are not unpacked, only ports reachable from vcpkg.json are
+        self.assertFalse(os.path.exists(f'{os.path.dirname(os.path.dirname(cmake.get_toolset_cmake_exe_path(self.workspace_dir)))}/doc'))
+        ports_dir = f'{self.workspace_dir}/vcpkg/vcpkg-triplets/ports'
+        self.assertEqual(sorted(os.listdir(ports_dir)), ['rapidjson', 'vcpkg-cmake'])
+        # Nothing left to install on the next run
+        self.assertEqual(toolset.install_missing_tools(self.workspace_dir, project_dir=self.project_dir), [])
+
+    def test_failing_tool(self):
+        self.server.fail_statuses['/ninja-build/ninja/releases/download/v1.13.2/ninja-linux.zip'] = [404]
+        with self.assertRaises(SystemExit):
+            toolset.install_missing_tools(self.workspace_dir, project_dir=self.project_dir)
+        # Other tools were installed alongside, failed one is missing and is installed by the next run
+        self.assertEqual(toolset.get_missing_tools(self.workspace_dir), ['ninja'])
+        self.assertEqual(toolset.install_missing_tools(self.workspace_dir, project_dir=self.project_dir), ['ninja'])
+        self.assertEqual(toolset.get_missing_tools(self.workspace_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from build_tools import commons
+from build_tools import config
+from build_tools import log
+from build_tools import vcpkg
+
+_MANIFEST = {
+    'name': 'project',
+    'dependencies': ['fmt', {'name': 'zlib', 'host': True}],
+    'default-features': ['json'],
+    'features': {
+        'json': {'description': 'JSON support', 'dependencies': [{'name': 'rapidjson'}]},
+        'gui': {'description': 'Optional GUI', 'dependencies': ['qtbase']},
+    },
+}
+
+class FindDependenciesTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.workspace_dir = f'{temp_dir.name}/workspace'
+        self.project_dir = f'{temp_dir.name}/project'
+        os.makedirs(self.project_dir)
+        with open(f'{self.project_dir}/vcpkg.json', 'w', encoding='UTF-8') as file:
+            json.dump(_MANIFEST, file)
+        self.config = config.BuildToolsConfig('cmake', None, 'vcpkg', None, self.workspace_dir, self.project_dir, 'debug')
+        self.triplet = vcpkg.get_triplet(self.config)
+        self.install_dir = f'{self.workspace_dir}/vcpkg/install/{self.triplet}'
+
+    def _install(self, packages: dict[str, list[str]]):
+        # Installed database with cmake config of every package, as vcpkg install leaves it
+        os.makedirs(f'{self.install_dir}/vcpkg/info', exist_ok=True)
+        paragraphs = []
+        for package, depends in packages.items():
+            paragraphs.append('\n'.join([
+                f'Package: {package}',
+                f'Architecture: {self.triplet}',
+                *([f'Depends: {", ".join(depends)}'] if len(depends) > 0 else []),
+                'Status: install ok installed',
+            ]))
+            config_dir = f'share/{package}'
+            os.makedirs(f'{self.install_dir}/{config_dir}', exist_ok=True)
+            with open(f'{self.install_dir}/vcpkg/info/{package}_1.0_{self.triplet}.list', 'w', encoding='UTF-8') as file:
+                file.write(f'{self.triplet}/{config_dir}/{package}-config.cmake\n')
+        with open(f'{self.install_dir}/vcpkg/status', 'w', encoding='UTF-8') as file:
+            file.write('\n\n'.join(paragraphs) + '\n')
+
+    def _find_dependencies(self) -> tuple[list[str], list[str]]:
+        with unittest.mock.patch.object(log, 'warn') as warn:
+            found = vcpkg.try_to_find_dependencies(self.config)
+        return found, [call.args[0] for call in warn.call_args_list]
+
+    def test_optional_feature_dependencies_are_not_expected(self):
+        self._install({'fmt': [], 'zlib': [], 'rapidjson': ['vcpkg-cmake'], 'vcpkg-cmake': []})
+        found, warnings = self._find_dependencies()
+        self.assertEqual(warnings, [])
+        self.assertEqual(found, sorted(
+            commons.realpath(f'{self.install_dir}/{self.triplet}/share/{package}')
+            for package in ['fmt', 'zlib', 'rapidjson', 'vcpkg-cmake']
+        ))
+
+    def test_missing_default_dependency_is_reported(self):
+        self._install({'fmt': [], 'zlib': []})
+        _, warnings = self._find_dependencies()
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("'rapidjson'", warnings[0])
+
+    def test_lazy_ports_cover_all_features(self):
+        # Unpacking ports of optional features too is cheaper than missing one
+        self.assertEqual(vcpkg._get_manifest_dependency_names(_MANIFEST), {'fmt', 'zlib', 'rapidjson', 'qtbase'})
+
+if __name__ == '__main__':
+    unittest.main()